@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rollback.sql of a hot table, where a few rows are updated over and over, written per change and compacted into
+net changes, with the compaction state held in memory and spilled to disk.
+
+    python benchmarks/bench_compact.py --keys 1000 --changes 200000
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binlog2sql import Binlog2sql  # noqa: E402
+from tests.synthetic_binlog import BinlogWriter, Column, Table, write_schema_snapshot  # noqa: E402
+
+LOG_FILE = 'mysql-bin.000001'
+# rows changed per transaction
+TRX_ROWS = 10
+
+
+def generate(binlog_dir, keys, changes):
+    """inserts of every key, then updates of random keys, a few keys deleted and inserted again"""
+    table = Table('test', 'hot', 101, [Column('id', 'int', 'PRI'), Column('counter', 'int'),
+                                       Column('note', 'varchar')])
+    rnd = random.Random(keys)
+    writer = BinlogWriter(os.path.join(binlog_dir, LOG_FILE))
+    rows = {}
+    for start in range(0, keys, TRX_ROWS):
+        images = [(i, 0, 'row %d' % i) for i in range(start, min(start + TRX_ROWS, keys))]
+        rows.update((image[0], image) for image in images)
+        writer.transaction([(table, 'INSERT', images)])
+    for n in range(0, changes, TRX_ROWS):
+        statements = []
+        for i in rnd.sample(range(keys), TRX_ROWS):
+            before = rows[i]
+            if rnd.random() < 0.01:
+                statements.append((table, 'DELETE', [before]))
+                statements.append((table, 'INSERT', [(i, 0, 'again %d' % n)]))
+                rows[i] = (i, 0, 'again %d' % n)
+            else:
+                rows[i] = (i, before[1] + 1, before[2])
+                statements.append((table, 'UPDATE', [(before, rows[i])]))
+        writer.transaction(statements)
+    writer.close()
+    write_schema_snapshot(os.path.join(binlog_dir, 'schema.json'), [table])
+
+
+def run(conn, binlog_dir, compact, memory_limit):
+    output_path = os.path.join(binlog_dir, 'out')
+    start = time.time()
+    binlog2sql = Binlog2sql(None, start_file=LOG_FILE, binlog_dir=binlog_dir,
+                            schema_file=os.path.join(binlog_dir, 'schema.json'),
+                            sql_type=['INSERT', 'UPDATE', 'DELETE'], flashback=True, output_path=output_path,
+                            compact=compact, compact_memory_limit=memory_limit)
+    binlog2sql.process_binlog()
+    seconds = time.time() - start
+    with open(os.path.join(output_path, 'rollback.sql'), 'rb') as f:
+        statements = sum(1 for _ in f)
+    size = os.path.getsize(os.path.join(output_path, 'rollback.sql'))
+    shutil.rmtree(output_path, ignore_errors=True)
+    # kilobytes on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((seconds, statements, size, binlog2sql.output_stats.get('compact', {}).get('spills', 0),
+               rss / 1024.0 / 1024.0 if sys.platform == 'darwin' else rss / 1024.0))
+    conn.close()
+
+
+def measure(binlog_dir, compact, memory_limit):
+    """in a fresh process, ru_maxrss only ever grows"""
+    conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run, args=(child_conn, binlog_dir, compact, memory_limit))
+    process.start()
+    try:
+        return conn.recv()
+    finally:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compaction of a hot table')
+    parser.add_argument('--keys', dest='keys', type=int, default=1000, help='rows of the table. default: 1000')
+    parser.add_argument('--changes', dest='changes', type=int, default=200000,
+                        help='row changes after the inserts. default: 200000')
+    parser.add_argument('--dir', dest='dir', type=str, default=None, help='where to put the temp files')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        generate(work_dir, args.keys, args.changes)
+        print('%d keys, %d changes, %.1f MB binlog' % (args.keys, args.changes,
+                                                      os.path.getsize(os.path.join(work_dir, LOG_FILE)) / 1024.0 / 1024.0))
+        for name, compact, memory_limit in (('per change', False, 0), ('compact', True, 256 * 1024 * 1024),
+                                            ('compact spilled', True, 64 * 1024)):
+            seconds, statements, size, spills, rss = measure(work_dir, compact, memory_limit)
+            print('%-16s %7.2fs %9d statements %9.1f MB rollback.sql %5d spills   peak RSS %8.1f MB' % (
+                name, seconds, statements, size / 1024.0 / 1024.0, spills, rss))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
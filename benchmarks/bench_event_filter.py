@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Events/sec of process_binlog with selective filters, with the event filter pushed down into the stream
+(only_events) against the old path that decodes every event and filters in the loop.
+
+    python benchmarks/bench_event_filter.py --transactions 20000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binlog2sql import Binlog2sql  # noqa: E402
+from tests.synthetic_binlog import BinlogWriter, Column, Table, write_schema_snapshot  # noqa: E402
+
+LOG_FILE = 'mysql-bin.000001'
+FILTERS = [
+    ('sql_type DELETE', {'sql_type': ['DELETE']}),
+    ('sql_type INSERT, UPDATE', {'sql_type': ['INSERT', 'UPDATE']}),
+    ('only_tables t1', {'only_tables': ['t1']}),
+    ('no filter', {}),
+]
+
+
+def generate(binlog_dir, transactions, rows):
+    tables = [Table('test', 't%d' % i, 100 + i, [Column('id', 'int', 'PRI'), Column('name', 'varchar'),
+                                                 Column('note', 'varchar'), Column('amount', 'int')])
+              for i in range(1, 4)]
+    writer = BinlogWriter(os.path.join(binlog_dir, LOG_FILE))
+    for i in range(transactions):
+        table = tables[i // 3 % len(tables)]
+        images = [(i * rows + j, 'name %d' % j, 'some note text', j) for j in range(rows)]
+        sql_type = ('INSERT', 'UPDATE', 'DELETE')[i % 3]
+        if sql_type == 'UPDATE':
+            images = [(row, row[:3] + (row[3] + 1,)) for row in images]
+        writer.transaction([(table, sql_type, images)])
+    writer.close()
+    write_schema_snapshot(os.path.join(binlog_dir, 'schema.json'), tables)
+    return writer.events
+
+
+def run(binlog_dir, output_path, pushdown, options):
+    kwargs = {'sql_type': ['INSERT', 'UPDATE', 'DELETE']}
+    kwargs.update(options)
+    binlog2sql = Binlog2sql(None, start_file=LOG_FILE, binlog_dir=binlog_dir,
+                            schema_file=os.path.join(binlog_dir, 'schema.json'),
+                            only_dml=True, flashback=False, output_path=output_path, **kwargs)
+    if not pushdown:
+        binlog2sql.only_events = None
+    start = time.time()
+    binlog2sql.process_binlog()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark event filter pushdown')
+    parser.add_argument('--transactions', dest='transactions', type=int, default=20000,
+                        help='transactions in the binlog. default: 20000')
+    parser.add_argument('--rows', dest='rows', type=int, default=5, help='rows per transaction. default: 5')
+    parser.add_argument('--dir', dest='dir', type=str, default=None, help='where to put the temp files')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        events = generate(work_dir, args.transactions, args.rows)
+        output_path = os.path.join(work_dir, 'out')
+        print('%d events, %.1f MB' % (events, os.path.getsize(os.path.join(work_dir, LOG_FILE)) / 1024.0 / 1024.0))
+        for name, options in FILTERS:
+            legacy = run(work_dir, output_path, False, options)
+            pushdown = run(work_dir, output_path, True, options)
+            print('%-24s  decode all %10.0f events/s  pushdown %10.0f events/s  %5.2fx' % (
+                name, events / legacy, events / pushdown, legacy / pushdown))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
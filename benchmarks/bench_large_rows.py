@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Peak RSS and time of process_binlog on rows with large binary BLOB values, every row a rows event of its own,
+with every event held and rendered whole (event_memory_limit 0) against streamed rendering.
+
+    python benchmarks/bench_large_rows.py --rows 8 --blob-mb 32
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binlog2sql import Binlog2sql  # noqa: E402
+from tests.synthetic_binlog import BinlogWriter, Column, Table, write_schema_snapshot  # noqa: E402
+
+LOG_FILE = 'mysql-bin.000001'
+
+
+def generate(binlog_dir, rows, blob_size):
+    table = Table('test', 'media', 101, [Column('id', 'int', 'PRI'), Column('name', 'varchar'),
+                                         Column('data', 'blob')])
+    rnd = random.Random(rows)
+    writer = BinlogWriter(os.path.join(binlog_dir, LOG_FILE))
+    for i in range(rows):
+        images = [(i, 'media %d' % i, rnd.getrandbits(blob_size * 8).to_bytes(blob_size, 'little'))]
+        sql_type = ('INSERT', 'UPDATE', 'DELETE')[i % 3]
+        if sql_type == 'UPDATE':
+            images = [(images[0], images[0][:2] + (images[0][2][::-1],))]
+        writer.transaction([(table, sql_type, images)])
+    writer.close()
+    write_schema_snapshot(os.path.join(binlog_dir, 'schema.json'), [table])
+
+
+def run(conn, binlog_dir, flashback, event_memory_limit):
+    output_path = os.path.join(binlog_dir, 'out')
+    start = time.time()
+    Binlog2sql(None, start_file=LOG_FILE, binlog_dir=binlog_dir, schema_file=os.path.join(binlog_dir, 'schema.json'),
+               sql_type=['INSERT', 'UPDATE', 'DELETE'], flashback=flashback, output_path=output_path,
+               event_memory_limit=event_memory_limit).process_binlog()
+    seconds = time.time() - start
+    shutil.rmtree(output_path, ignore_errors=True)
+    # kilobytes on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((seconds, rss / 1024.0 / 1024.0 if sys.platform == 'darwin' else rss / 1024.0))
+    conn.close()
+
+
+def measure(binlog_dir, flashback, event_memory_limit):
+    """in a fresh process, ru_maxrss only ever grows"""
+    conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run, args=(child_conn, binlog_dir, flashback, event_memory_limit))
+    process.start()
+    try:
+        return conn.recv()
+    finally:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark memory of huge rows events')
+    parser.add_argument('--rows', dest='rows', type=int, default=6, help='rows, one per event. default: 6')
+    parser.add_argument('--blob-mb', dest='blob_mb', type=int, default=32, help='MB per BLOB value. default: 32')
+    parser.add_argument('--dir', dest='dir', type=str, default=None, help='where to put the temp files')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        generate(work_dir, args.rows, args.blob_mb * 1024 * 1024)
+        print('%d rows, %.1f MB binlog' % (args.rows, os.path.getsize(os.path.join(work_dir, LOG_FILE)) / 1024.0 / 1024.0))
+        for flashback in (False, True):
+            for name, limit in (('whole', 0), ('streamed', 1024 * 1024)):
+                seconds, rss = measure(work_dir, flashback, limit)
+                print('%-9s %-8s %7.2fs   peak RSS %8.1f MB' % ('flashback' if flashback else 'origin', name,
+                                                               seconds, rss))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of reversed_lines, the engine of the flashback phase.
+
+    python benchmarks/bench_reversed_lines.py --size-mb 5120
+    python benchmarks/bench_reversed_lines.py --size-mb 64 --legacy
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binlog2sql_util import reversed_lines  # noqa: E402
+
+SQL_LINE = ("UPDATE `test`.`tbl` SET `addtime`='2016-12-12 00:00:00', `id`=%d, `name`='小李' "
+            "WHERE `addtime`='2016-12-13 20:26:00' AND `id`=%d AND `name`='小李' LIMIT 1; "
+            "#start 514 end 701 time 2016-12-13 20:27:07\n")
+
+
+def legacy_reversed_lines(fin, block_size=4096):
+    """the character by character implementation reversed_lines replaced, for comparison"""
+    part = ''
+    fin.seek(0, os.SEEK_END)
+    here = fin.tell()
+    while 0 < here:
+        delta = min(block_size, here)
+        here -= delta
+        fin.seek(here, os.SEEK_SET)
+        for c in reversed(fin.read(delta)):
+            if c == '\n' and part:
+                yield part[::-1]
+                part = ''
+            part += c
+    if part:
+        yield part[::-1]
+
+
+def generate_file(filename, size):
+    chunk = ''.join(SQL_LINE % (i, i) for i in range(10000)).encode('utf-8')
+    with open(filename, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def run(fin, reader):
+    lines = 0
+    start = time.time()
+    for _ in reader(fin):
+        lines += 1
+    return lines, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reversed_lines')
+    parser.add_argument('--size-mb', dest='size_mb', type=int, default=5120, help='temp file size. default: 5120')
+    parser.add_argument('--dir', dest='dir', type=str, default=None, help='where to put the temp file')
+    parser.add_argument('--legacy', dest='legacy', action='store_true', default=False,
+                        help='also run the old character by character implementation')
+    args = parser.parse_args()
+
+    fd, filename = tempfile.mkstemp(suffix='.txt', dir=args.dir)
+    os.close(fd)
+    try:
+        size = generate_file(filename, args.size_mb * 1024 * 1024)
+        size_mb = size / 1024.0 / 1024.0
+        with open(filename, 'rb') as fin:
+            lines, seconds = run(fin, reversed_lines)
+        print('reversed_lines         %8.1f MB  %10d lines  %7.2f s  %8.1f MB/s  %10.0f lines/s' % (
+            size_mb, lines, seconds, size_mb / seconds, lines / seconds))
+        if args.legacy:
+            # latin-1: seeking a utf-8 text file into the middle of a character fails, which is one reason
+            # the old implementation was replaced
+            with io.open(filename, 'r', encoding='latin-1') as fin:
+                lines, seconds = run(fin, legacy_reversed_lines)
+            print('legacy_reversed_lines  %8.1f MB  %10d lines  %7.2f s  %8.1f MB/s  %10.0f lines/s' % (
+                size_mb, lines, seconds, size_mb / seconds, lines / seconds))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
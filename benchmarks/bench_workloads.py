@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of every stage of binlog2sql on synthetic workloads: narrow and 200 column tables,
+BLOB and JSON heavy rows, NULL heavy rows and one large transaction.
+
+process_binlog stub jsonl and msgpack write records instead of sql, msgpack only runs with the msgpack package.
+MB/s counts binlog bytes, except for concat_sql_from_binlog_event and reversed_lines which count sql bytes.
+Every workload runs in its own process so peak RSS is measured per workload.
+
+    python benchmarks/bench_workloads.py
+    python benchmarks/bench_workloads.py --workload wide blob --scale 0.1
+    python benchmarks/bench_workloads.py --workload narrow wide --render-workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binlog2sql import Binlog2sql  # noqa: E402
+from src.binlog2sql_events import msgpack  # noqa: E402
+from src.binlog2sql_file import BinLogFileReader, load_schema_snapshot  # noqa: E402
+from src.binlog2sql_rows import RowsReader  # noqa: E402
+from src.binlog2sql_util import (  # noqa: E402
+    concat_sql_from_binlog_event, generate_sql_pattern, is_dml_event, reversed_lines, SqlTemplateCache
+)
+from tests.synthetic_binlog import BinlogWriter, Column, Table, write_schema_snapshot  # noqa: E402
+
+LOG_FILE = 'mysql-bin.000001'
+SQL_TYPES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def narrow_table():
+    return Table('test', 'narrow', 101, [Column('id', 'int', 'PRI'), Column('name', 'varchar'),
+                                         Column('amount', 'int'), Column('note', 'varchar')])
+
+
+def wide_table():
+    columns = [Column('id', 'int', 'PRI')]
+    columns += [Column('c%03d' % i, 'int' if i % 2 else 'varchar') for i in range(1, 200)]
+    return Table('test', 'wide', 102, columns)
+
+
+def narrow_row(i, rnd):
+    return (i, 'name %d' % i, rnd.randint(0, 10 ** 6), "it's row %d" % i)
+
+
+def wide_row(i, rnd, null_ratio=0.0):
+    row = [i]
+    for j in range(1, 200):
+        if rnd.random() < null_ratio:
+            row.append(None)
+        else:
+            row.append(rnd.randint(0, 10 ** 6) if j % 2 else 'value %d' % j)
+    return tuple(row)
+
+
+def blob_row(i, rnd):
+    return (i, 'blob %d' % i, rnd.getrandbits(4096 * 8).to_bytes(4096, 'little'))
+
+
+def json_row(i, rnd):
+    return (i, {'key%02d' % j: 'value %d' % rnd.randint(0, 10 ** 6) for j in range(20)})
+
+
+# name: (table, row factory, rows, rows per transaction)
+WORKLOADS = {
+    'narrow': (narrow_table, narrow_row, 100000, 10),
+    'wide': (wide_table, wide_row, 5000, 10),
+    'blob': (lambda: Table('test', 'blob', 103, [Column('id', 'int', 'PRI'), Column('name', 'varchar'),
+                                                 Column('data', 'blob')]), blob_row, 5000, 10),
+    'json': (lambda: Table('test', 'json', 104, [Column('id', 'int', 'PRI'), Column('doc', 'json')]),
+             json_row, 20000, 10),
+    'nulls': (wide_table, lambda i, rnd: wide_row(i, rnd, null_ratio=0.9), 10000, 10),
+    'large_trx': (narrow_table, narrow_row, 100000, 100000),
+}
+
+
+def generate(binlog_dir, workload, scale):
+    """binlog with INSERT, UPDATE and DELETE transactions of the workload, returns the number of rows"""
+    table_factory, row_factory, rows, trx_rows = WORKLOADS[workload]
+    rows = max(int(rows * scale), 1)
+    table, rnd = table_factory(), random.Random(workload)
+    writer = BinlogWriter(os.path.join(binlog_dir, LOG_FILE))
+    for n, start in enumerate(range(0, rows, trx_rows)):
+        sql_type = SQL_TYPES[n % len(SQL_TYPES)]
+        images = [row_factory(i, rnd) for i in range(start, min(start + trx_rows, rows))]
+        if sql_type == 'UPDATE':
+            images = [(row, row_factory(row[0], rnd)) for row in images]
+        writer.transaction([(table, sql_type, images)])
+    writer.close()
+    write_schema_snapshot(os.path.join(binlog_dir, 'schema.json'), [table])
+    return rows
+
+
+class StubStream(object):
+    """replays decoded events in place of BinLogStreamReader, so process_binlog is measured without decoding"""
+
+    def __init__(self, log_file, events):
+        self.log_file, self.log_pos = log_file, 4
+        self.events = events
+
+    def __iter__(self):
+        for binlog_event in self.events:
+            self.log_pos = binlog_event.packet.log_pos
+            yield binlog_event
+
+    def close(self):
+        pass
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return rss / 1024.0 / 1024.0 if sys.platform == 'darwin' else rss / 1024.0
+
+
+def timed(results, stage, rows, func):
+    """func returns the bytes it processed"""
+    start = time.time()
+    size = func()
+    seconds = max(time.time() - start, 1e-9)
+    results.append((stage, rows / seconds, size / 1024.0 / 1024.0 / seconds, peak_rss_mb()))
+
+
+def run_workload(workload, scale, work_dir, render_workers=0):
+    binlog_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        rows = generate(binlog_dir, workload, scale)
+        binlog_size = os.path.getsize(os.path.join(binlog_dir, LOG_FILE))
+        schema_file = os.path.join(binlog_dir, 'schema.json')
+        output_path = os.path.join(binlog_dir, 'out')
+        results = []
+
+        events = []
+
+        def decode():
+            reader = BinLogFileReader(binlog_dir, [LOG_FILE], load_schema_snapshot(schema_file))
+            for binlog_event in reader:
+                if is_dml_event(binlog_event):
+                    binlog_event.rows
+                events.append(binlog_event)
+            return binlog_size
+        timed(results, 'decode', rows, decode)
+
+        rows_reader = RowsReader()
+        rows_batches = [rows_reader.read(binlog_event) for binlog_event in events if is_dml_event(binlog_event)]
+
+        def patterns():
+            cache = SqlTemplateCache()
+            for rows_batch in rows_batches:
+                for row in rows_batch.rows:
+                    generate_sql_pattern(rows_batch, row=row, template_cache=cache)
+            return binlog_size
+        timed(results, 'generate_sql_pattern', rows, patterns)
+
+        def concat():
+            cache, size = SqlTemplateCache(), 0
+            for rows_batch in rows_batches:
+                for row in rows_batch.rows:
+                    size += len(concat_sql_from_binlog_event(rows_batch, row=row, e_start_pos=4,
+                                                             template_cache=cache))
+            return size
+        timed(results, 'concat_sql_from_binlog_event', rows, concat)
+
+        def process(flashback, stub, render_workers=0, output_format='sql'):
+            binlog2sql = Binlog2sql(None, start_file=LOG_FILE, binlog_dir=binlog_dir, schema_file=schema_file,
+                                    sql_type=list(SQL_TYPES), flashback=flashback, output_path=output_path,
+                                    render_workers=render_workers, output_format=output_format)
+            if stub:
+                binlog2sql.create_stream = lambda: StubStream(LOG_FILE, events)
+            binlog2sql.process_binlog()
+            return binlog_size
+        timed(results, 'process_binlog stub stream', rows, lambda: process(False, True))
+        for output_format in ('jsonl', 'msgpack') if msgpack else ('jsonl',):
+            timed(results, 'process_binlog stub %s' % output_format, rows,
+                  lambda: process(False, True, output_format=output_format))
+
+        def reverse():
+            origin_file = os.path.join(output_path, 'origin.sql')
+            with open(origin_file, 'rb') as fin:
+                for _ in reversed_lines(fin):
+                    pass
+            return os.path.getsize(origin_file)
+        timed(results, 'reversed_lines', rows, reverse)
+
+        del events[:], rows_batches[:]
+        timed(results, 'process_binlog flashback', rows, lambda: process(True, False))
+        if render_workers > 1:
+            timed(results, 'process_binlog %d render workers' % render_workers, rows,
+                  lambda: process(False, False, render_workers))
+            timed(results, 'process_binlog inline render', rows, lambda: process(False, False))
+        return workload, rows, binlog_size, results
+    finally:
+        shutil.rmtree(binlog_dir, ignore_errors=True)
+
+
+def _run_workload(conn, args):
+    conn.send(run_workload(*args))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark binlog2sql on synthetic workloads')
+    parser.add_argument('--workload', dest='workload', type=str, nargs='*', default=sorted(WORKLOADS),
+                        choices=sorted(WORKLOADS), help='workloads to run. default: all')
+    parser.add_argument('--scale', dest='scale', type=float, default=1.0,
+                        help='multiply the rows of every workload. default: 1.0')
+    parser.add_argument('--render-workers', dest='render_workers', type=int, default=0,
+                        help='also run process_binlog with this many render workers. default: 0, skip')
+    parser.add_argument('--dir', dest='dir', type=str, default=None, help='where to put the temp files')
+    args = parser.parse_args()
+
+    for workload in args.workload:
+        # a fresh process per workload, ru_maxrss only ever grows. not a pool worker, those cannot start
+        # the render workers
+        conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_workload,
+                                          args=(child_conn, (workload, args.scale, args.dir, args.render_workers)))
+        process.start()
+        try:
+            workload, rows, binlog_size, results = conn.recv()
+        finally:
+            process.join()
+        print('%s: %d rows, %.1f MB binlog' % (workload, rows, binlog_size / 1024.0 / 1024.0))
+        for stage, rows_per_sec, mb_per_sec, rss in results:
+            print('  %-30s %12.0f rows/s %9.1f MB/s   peak RSS %8.1f MB' % (stage, rows_per_sec, mb_per_sec, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,11 +35,75 @@ only_dml = False
 sql_type = 'INSERT', 'UPDATE', 'DELETE'
 # no-primary-key 对INSERT语句去除主键。可选。默认False
 no_pk = False
+# binlog时间索引目录，记录每个binlog文件的时间范围和采样位置，按start_time/stop_time跳过文件并定位起始位置。从文件起始位置读完的binlog会建立索引。可选。默认为空，不使用索引
+index_dir = ''
+# 解析结束后把范围内还没有完整索引的已轮转binlog整个读一遍并建立索引，每个文件完成后在stderr报告，需设置index_dir。文件多时耗时较长。可选。默认False
+build_index = False
+# 表结构缓存文件，按binlog位置记录各表的历史表结构，启动时加载一次，解析中遇到DDL时更新，结束时写回。按事件所在位置的表结构解析，表结构中途变更也能得到正确的列。不存在时从information_schema(离线时从schema_file)生成。可选。默认为空，每个表从information_schema查询当前表结构
+schema_cache_file = ''
+# 并行解析的进程数，每个binlog文件由一个进程解析，结果按binlog顺序合并。可选。默认1，即串行解析。stop-never模式下无效
+workers = 1
+# 渲染SQL的进程数，读取binlog的同时由多个进程并行生成SQL，按事件顺序写入。可选。默认0，即在读取进程内生成
+render_workers = 0
+# 单个行事件超过该字节数时逐行解码并分段写出SQL，回滚时超过该长度的SQL也分块复制，避免解码后的行和SQL占满内存。事件的原始数据包仍整个读入内存。0表示不限制。可选。默认64MB
+event_memory_limit = 64 * 1024 * 1024
+# 断点文件，按事务边界记录已写入origin.sql的binlog位置，重启后从断点继续且不重复输出。断点中的gtid仅作记录，不用于续传，断点所在binlog已被清除时报错并给出该gtid。可选。默认为空。与flashback、output_compress不能同时使用
+checkpoint_file = ''
+# 保存断点的间隔秒数，越小重启后重放越少，但fsync越频繁。0表示每个事务都保存。可选。默认1
+checkpoint_interval = 1
+# 进度输出间隔秒数，按间隔向stderr打印当前binlog位置、落后eof的字节数、事件数、行数、输出字节数及各阶段耗时。可选。默认0，不输出
+progress_interval = 0
+# prometheus指标端口，解析期间在http://metrics_host:端口/metrics提供指标，适合stop-never模式。可选。默认为空，不开启
+metrics_port = None
+# prometheus指标监听地址，默认只允许本机访问，设为0.0.0.0时所有网卡均可访问。可选。默认127.0.0.1
+metrics_host = '127.0.0.1'
+# cProfile结果文件，设置后在cProfile下运行并将结果写入该文件，可用pstats或snakeviz查看。可选。默认为空
+profile_file = ''
+
+# offline
+# 本地binlog文件所在目录，设置后直接解析本地文件，无需连接mysql server。可选。默认为空
+binlog_dir = ''
+# 表结构快照文件，离线解析时必须，可用src.binlog2sql_file.dump_schema_snapshot从线上库导出
+schema_file = ''
+
+# fleet
+# 多实例解析，每项为一个实例的连接配置，如{'name': 'shard01', 'host': '10.0.0.1', 'port': 3306}，未填的user、password、port取上面的连接配置，
+# 也可为每个实例单独指定start_file、stop_file、start_pos、stop_pos或binlog_dir、schema_file，未指定start_file时解析该实例全部binlog。
+# 设置后按上面的时间范围和过滤条件并行解析所有实例，每个实例的SQL保存在output_path下以name命名的目录，汇总写入output_path/summary.json。可选。默认为空
+servers = []
+# 实例列表文件，json格式的实例数组，格式同servers，与servers合并。可选。默认为空
+servers_file = ''
+# 多实例解析时同时解析的binlog文件数，所有实例共用。可选。默认4
+fleet_concurrency = 4
 
 # output
 # 生成回滚SQL，可解析大文件，不受内存限制。可选。默认False。与stop-never或no-primary-key不能同时添加
 flashback = True
+# 回滚SQL按事务倒序输出，每个事务包在BEGIN;和COMMIT;之间，批量执行回滚更快。可选。默认False
+flashback_transaction = False
+# 合并连续的同表INSERT/DELETE为多行语句，值为单条SQL的最大字节数，DELETE需表有主键。可选。默认0，每行一条SQL
+batch_size = 0
+# 按主键合并每行的多次变更，只输出净变更：INSERT后多次UPDATE合并为一条INSERT最终值，多次UPDATE合并为一条UPDATE，INSERT后DELETE不输出。净变更在最后按每1000行一个事务输出，无主键的表不合并。回滚热点表时大幅减少回滚SQL。与stop_never、checkpoint_file不能同时使用，workers无效。可选。默认False
+compact = False
+# compact的行状态超过该字节数(估算)后排序写入output_path下的临时文件，最后多路归并合并，归并时内存同样受该值限制。可选。默认256MB
+compact_memory_limit = 256 * 1024 * 1024
 # SQL文件输出路径，tables不为空时，每个table的SQL文件保存在该路径下的table的文件夹下
 output_path = 'F:\\bjgcs3' + os.sep + tables
+# SQL文件压缩方式，可选gzip、zstd(需安装zstandard)。可选。默认为空，不压缩
+output_compress = ''
+# origin.sql超过该字节数后切换到origin.sql.1、origin.sql.2...。可选。默认0，不切分
+output_rotate_size = 0
+# 输出格式，sql输出origin.sql；jsonl、msgpack(需安装msgpack)不生成SQL，每行变更输出一条记录到origin.jsonl或origin.msgpack，包含库、表、类型、主键、变更前后的行、binlog位置和时间戳，供下游程序直接读取。非sql格式不能与flashback、batch_size同时使用。可选。默认sql
+output_format = 'sql'
 # 输出到控制台。默认False
 output_console = False
+
+# apply
+# 生成rollback.sql后直接在当前连接的数据库上执行回滚，无需再通过mysql客户端逐条执行。需开启flashback，会同时开启flashback_transaction，多实例解析时无效。与binlog_dir一起使用时在host指定的数据库上执行。可选。默认False
+apply_rollback = False
+# 与apply_rollback一起设置时只读取并分批rollback.sql，报告将执行的语句数、批次数和表数，不连接数据库。可选。默认False
+apply_dry_run = False
+# 执行回滚的连接数，只涉及一张表的事务按表分配到不同连接并行执行，同一张表的事务按原顺序执行，涉及多张表的事务单独执行。可选。默认1
+apply_workers = 1
+# 每批的语句数，若干个完整的事务合成一批，一次发送并一起提交，出错时该批回滚并停止执行。可选。默认500
+apply_batch_size = 500
@@ -2,20 +2,53 @@
 # -*- coding: utf-8 -*-
 
 from src.binlog2sql import Binlog2sql
+from src.binlog2sql_fleet import Fleet, load_servers, format_summary
+from src.binlog2sql_metrics import profiled
 from src.binlog2sql_util import command_line_args
 from config import *
 
 if __name__ == '__main__':
     # 命令行方式
     # args = command_line_args(sys.argv[1:])
-    # 数据库连接设置
-    conn_setting = {'host': host, 'port': port, 'user': user, 'passwd': password, 'charset': 'utf8'}
-    # 实例化
-    binlog2sql = Binlog2sql(connection_settings=conn_setting,
-                            start_file=start_file, stop_file=stop_file,
-                            start_time=start_time, stop_time=stop_time,
-                            start_pos=start_position, stop_pos=stop_position, stop_never=stop_never,
-                            only_schemas=databases, only_tables=tables,
-                            only_dml=only_dml, sql_type=sql_type, no_pk=no_pk,
-                            flashback=flashback, output_path=output_path, output_console=output_console)
-    binlog2sql.process_binlog()
+    # 多实例解析
+    if servers or servers_file:
+        fleet = Fleet(list(servers) + (load_servers(servers_file) if servers_file else []), output_path,
+                      concurrency=fleet_concurrency,
+                      server_defaults={'port': port, 'user': user, 'password': password, 'charset': 'utf8'},
+                      start_time=start_time, stop_time=stop_time,
+                      only_schemas=databases, only_tables=tables,
+                      only_dml=only_dml, sql_type=sql_type, no_pk=no_pk, event_memory_limit=event_memory_limit,
+                      render_workers=render_workers, index_dir=index_dir, build_index=build_index,
+                      schema_cache_file=schema_cache_file,
+                      flashback=flashback, flashback_transaction=flashback_transaction, batch_size=batch_size,
+                      compact=compact, compact_memory_limit=compact_memory_limit,
+                      output_compress=output_compress, output_rotate_size=output_rotate_size,
+                      output_format=output_format, progress_interval=progress_interval)
+        with profiled(profile_file):
+            print(format_summary(fleet.run()))
+    else:
+        # 数据库连接设置
+        conn_setting = {'host': host, 'port': port, 'user': user, 'passwd': password, 'charset': 'utf8'}
+        # 实例化
+        binlog2sql = Binlog2sql(connection_settings=conn_setting,
+                                start_file=start_file, stop_file=stop_file,
+                                start_time=start_time, stop_time=stop_time,
+                                start_pos=start_position, stop_pos=stop_position, stop_never=stop_never,
+                                only_schemas=databases, only_tables=tables,
+                                only_dml=only_dml, sql_type=sql_type, no_pk=no_pk, workers=workers,
+                                render_workers=render_workers, event_memory_limit=event_memory_limit,
+                                flashback=flashback, flashback_transaction=flashback_transaction,
+                                batch_size=batch_size, compact=compact, compact_memory_limit=compact_memory_limit,
+                                output_path=output_path, output_console=output_console,
+                                output_compress=output_compress, output_rotate_size=output_rotate_size,
+                                output_format=output_format,
+                                binlog_dir=binlog_dir, schema_file=schema_file, index_dir=index_dir,
+                                build_index=build_index,
+                                schema_cache_file=schema_cache_file,
+                                apply_rollback=apply_rollback, apply_dry_run=apply_dry_run,
+                                apply_workers=apply_workers, apply_batch_size=apply_batch_size,
+                                checkpoint_file=checkpoint_file, checkpoint_interval=checkpoint_interval,
+                                progress_interval=progress_interval, metrics_port=metrics_port,
+                                metrics_host=metrics_host)
+        with profiled(profile_file):
+            binlog2sql.process_binlog()
@@ -2,15 +2,54 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import OrderedDict
 
 import pymysql
+from pymysql.constants import SERVER_STATUS
 from pymysqlreplication import BinLogStreamReader
-from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent
+from pymysqlreplication.row_event import TableMapEvent
 
+from .binlog2sql_apply import RollbackApplier, APPLY_BATCH_SIZE
+from .binlog2sql_compact import RowCompactor, COMPACT_MEMORY_LIMIT, COMPACT_TRANSACTION_ROWS
+from .binlog2sql_checkpoint import Checkpoint, CHECKPOINT_INTERVAL, gtid_of
+from .binlog2sql_index import BinlogIndex
+from .binlog2sql_metrics import Metrics, MetricsServer, METRICS_HOST
+from .binlog2sql_output import output_open, COMPRESS_SUFFIX
+from .binlog2sql_events import EventWriter, OUTPUT_FORMATS
+from .binlog2sql_file import (
+    BinLogFileReader, list_binlog_files, load_schema_snapshot, read_schema_snapshot, read_table_columns
+)
 from .binlog2sql_util import (
-    create_file, create_unique_file, file_open, file_temp_open, is_dml_event, event_type,
-    concat_sql_from_binlog_event, reversed_lines
+    create_file, create_unique_file, file_temp_open, is_dml_event, event_type,
+    concat_sql_from_binlog_event, reversed_lines, merge_files, filter_events, SqlBatch, SqlTemplateCache, FileRange
 )
+from .binlog2sql_pipeline import SqlWriter, PipelinedSqlWriter, EVENT_MEMORY_LIMIT
+from .binlog2sql_rows import RowsReader
+from .binlog2sql_schema import SchemaCache, CachedBinLogStreamReader, read_ddl
+
+# replication server_id of parallel workers, far away from the ids real slaves use
+WORKER_SERVER_ID_BASE = 0xB2500000
+
+
+def _process_binlog_file(kwargs):
+    return Binlog2sql(**kwargs).process_binlog()
+
+
+def next_start_pos(binlog_event, last_pos):
+    """where the transaction after binlog_event starts, last_pos is where the one after the event before starts"""
+    if isinstance(binlog_event, RotateEvent):
+        # the next file, the first transaction there starts at its position
+        return binlog_event.position
+    if isinstance(binlog_event, FormatDescriptionEvent):
+        return last_pos
+    return binlog_event.packet.log_pos
 
 
 class Binlog2sql(object):
@@ -18,15 +57,47 @@ class Binlog2sql(object):
     def __init__(self, connection_settings, start_file=None, stop_file=None,
                  start_time=None, stop_time=None, start_pos=None, stop_pos=None, stop_never=False,
                  only_schemas=None, only_tables=None, only_dml=True, sql_type=None, no_pk=False,
-                 flashback=False, output_path=None, output_console=None):
+                 flashback=False, output_path=None, output_console=None, template_cache_size=1024,
+                 workers=1, stream_server_id=None, binlog_dir=None, schema_file=None, index_dir=None,
+                 build_index=False,
+                 flashback_transaction=False, batch_size=0, output_compress=None, output_rotate_size=0,
+                 checkpoint_file=None, checkpoint_interval=CHECKPOINT_INTERVAL, progress_interval=0,
+                 metrics_port=None, metrics_host=METRICS_HOST, render_workers=0, event_memory_limit=EVENT_MEMORY_LIMIT,
+                 connection=None,
+                 schema_cache_file=None, output_format='sql', compact=False,
+                 compact_memory_limit=COMPACT_MEMORY_LIMIT, apply_rollback=False, apply_dry_run=False,
+                 apply_workers=1, apply_batch_size=APPLY_BATCH_SIZE):
         """
         conn_setting: {'host': 127.0.0.1, 'port': 3306, 'user': user, 'passwd': passwd, 'charset': 'utf8'}
+        binlog_dir: parse binlog files in this local directory instead of a mysql server, needs schema_file
+        index_dir: directory of the binlog time index, used to skip files and seek to start_time
+        build_index: after the parse, read the rotated files of the range that have no complete index whole to
+            index them, reported on stderr. Without it only the files a parse reads from position 4 are indexed
+        checkpoint_file: save the resume point there every checkpoint_interval seconds, resume from it when it exists
+        progress_interval: print a progress line to stderr every progress_interval seconds, 0 prints none
+        metrics_port: serve prometheus metrics on http://metrics_host:metrics_port/metrics while parsing, metrics_host
+            is 127.0.0.1 by default, 0.0.0.0 serves them on every interface
+        render_workers: render sql in this many processes while the stream is read, 0 or 1 renders inline
+        event_memory_limit: rows events larger than this many bytes are rendered one row at a time and written
+            in pieces, flashback copies statements this long in blocks. 0 holds every event and statement whole
+        connection: open connection to the server for the metadata queries, e.g. from a ConnectionPool,
+            connected from connection_settings when None
+        schema_cache_file: versioned table metadata, loaded at start, ddl in the binlog adds versions and it is
+            saved back at the end. Seeded from information_schema, or from schema_file offline, when it does not exist
+        output_format: sql writes origin.sql, jsonl and msgpack write every row change as a record with its before
+            and after images to origin.jsonl or origin.msgpack, without rendering sql. No flashback or batch_size
+        compact: fold the changes of every row of a table with a primary key into its net change, written after
+            the other output. Files are parsed one after the other
+        compact_memory_limit: estimated bytes of row state held by compact before it is spilled to output_path
+        apply_rollback: apply rollback.sql to the server of connection_settings once it is written, in transactions
+            of apply_batch_size statements, the tables spread over apply_workers connections
+        apply_dry_run: only read and batch rollback.sql and report what would be applied
         """
 
         if not start_file:
             raise ValueError('Lack of parameter: start_file')
 
-        self.conn_setting = connection_settings
+        self.conn_setting = connection_settings if connection_settings else {}
         self.start_file = start_file
         self.stop_file = stop_file if stop_file else start_file
         if start_time:
@@ -49,109 +120,598 @@ class Binlog2sql(object):
         self.no_pk = no_pk
 
         self.flashback, self.output_path, self.output_console = (flashback, output_path, output_console)
+        self.flashback_transaction = flashback_transaction
+        self.batch_size = batch_size
+        self.output_compress = output_compress if output_compress else None
+        self.output_rotate_size = output_rotate_size
+        self.output_stats = {}
+        self.output_format = output_format if output_format else 'sql'
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError('unknown output_format: %s' % self.output_format)
+        if self.output_format != 'sql':
+            if self.flashback:
+                raise ValueError('Only one of flashback or output_format %s can be set' % self.output_format)
+            if self.batch_size:
+                raise ValueError('Only one of batch_size or output_format %s can be set' % self.output_format)
+        self.template_cache = SqlTemplateCache(maxsize=template_cache_size)
+        self.workers = workers if workers else 1
+        self.render_workers = render_workers if render_workers else 0
+        self.event_memory_limit = event_memory_limit if event_memory_limit else 0
+
+        self.apply_rollback, self.apply_dry_run = apply_rollback, apply_dry_run
+        self.apply_workers = apply_workers if apply_workers else 1
+        self.apply_batch_size = apply_batch_size if apply_batch_size else APPLY_BATCH_SIZE
+        self.apply_summary = None
+        if self.apply_rollback and not self.flashback:
+            raise ValueError('apply_rollback needs flashback')
+        if self.apply_rollback and not self.apply_dry_run and binlog_dir and not self.conn_setting.get('host'):
+            raise ValueError('apply_rollback with binlog_dir needs the host of connection_settings to apply to')
+        if self.apply_rollback:
+            # the transactions of rollback.sql are applied whole, BEGIN; and COMMIT; tell where they are
+            self.flashback_transaction = True
+        self.compact = compact
+        self.compact_memory_limit = compact_memory_limit if compact_memory_limit is not None else COMPACT_MEMORY_LIMIT
+        if self.compact and self.stop_never:
+            raise ValueError('Only one of compact or stop_never can be set')
+        self.checkpoint = Checkpoint(checkpoint_file) if checkpoint_file else None
+        self.checkpoint_interval = checkpoint_interval if checkpoint_interval is not None else CHECKPOINT_INTERVAL
+        self.resume_state = None
+        if self.checkpoint:
+            if self.flashback:
+                raise ValueError('Only one of flashback or checkpoint_file can be set')
+            if self.compact:
+                raise ValueError('Only one of compact or checkpoint_file can be set')
+            if self.output_compress:
+                raise ValueError('Only one of output_compress or checkpoint_file can be set')
+            self.resume_state = self.checkpoint.load()
+            if self.resume_state:
+                self.start_file, self.start_pos = self.resume_state['log_file'], self.resume_state['log_pos']
+
+        self.binlog_dir, self.schema_file = binlog_dir, schema_file
+        self.schema_cache_file = schema_cache_file
+        self.schema_cache = None
+        if self.schema_cache_file and os.path.exists(self.schema_cache_file):
+            self.schema_cache = SchemaCache.load(self.schema_cache_file,
+                                                 charset=self.conn_setting.get('charset', 'utf8'))
+        if self.binlog_dir:
+            bin_index, binlog_sizes = self.open_binlog_dir()
+        else:
+            bin_index, binlog_sizes = self.open_server(connection)
+        self.stream_server_id = stream_server_id if stream_server_id else self.server_id
+        if self.schema_cache_file and not self.schema_cache:
+            self.seed_schema_cache()
+        self.progress_interval, self.metrics_port = progress_interval, metrics_port
+        self.metrics_host = metrics_host if metrics_host else METRICS_HOST
+        self.metrics = Metrics(progress_interval=self.progress_interval, binlog_sizes=binlog_sizes,
+                               eof_file=self.eof_file, eof_pos=self.eof_pos)
+        # unwanted event types are dropped by the stream before they are decoded, None reads all of them
+        self.only_events = filter_events(self.sql_type, gtid=bool(self.checkpoint))
 
         self.binlogList = []
-        self.connection = pymysql.connect(**self.conn_setting)
+        binlog2i = lambda x: x.split('.')[1]
+        for binary in bin_index:
+            if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.stop_file):
+                self.binlogList.append(binary)
+        if self.resume_state and not self.stop_never and not self.binlogList:
+            raise ValueError('checkpoint %s:%s is beyond stop_file %s' % (self.start_file, self.start_pos,
+                                                                         self.stop_file))
+
+        self.index_dir, self.build_index = index_dir, build_index
+        if self.build_index and not self.index_dir:
+            raise ValueError('Lack of parameter: index_dir, build_index needs it')
+        self.index = BinlogIndex(self.index_dir) if self.index_dir else None
+        # the files of the range as they were before the index narrowed it, build_index indexes them at the end
+        self.index_files = list(self.binlogList)
+        if self.index and not self.stop_never:
+            self.binlogList, self.start_pos = self.index.plan(self.binlogList, self.start_pos,
+                                                              time.mktime(self.start_time.timetuple()),
+                                                              time.mktime(self.stop_time.timetuple()))
+            self.start_file = self.binlogList[0]
+            if self.binlogList[-1] != self.stop_file:
+                # stop_file is out of the time range, so is its stop_pos
+                self.stop_file, self.stop_pos = self.binlogList[-1], None
 
+    def open_binlog_dir(self):
+        """
+        offline mode: parse local binlog files, table metadata comes from a schema snapshot. Returns the files from
+        start_file on and their sizes
+        """
+        if not self.schema_file and not self.schema_cache:
+            raise ValueError('Lack of parameter: schema_file')
+        self.connection = None
+        if self.schema_cache:
+            self.schema_snapshot = self.schema_cache
+        else:
+            self.schema_snapshot = load_schema_snapshot(self.schema_file)
+        bin_index = list_binlog_files(self.binlog_dir, self.start_file)
+        if self.start_file not in bin_index:
+            raise self.missing_start_file(self.binlog_dir)
+        binlog_sizes = OrderedDict((f, os.path.getsize(os.path.join(self.binlog_dir, f))) for f in bin_index)
+        self.eof_file = bin_index[-1]
+        self.eof_pos = os.path.getsize(os.path.join(self.binlog_dir, self.eof_file))
+        self.server_id = None
+        self.charset = self.conn_setting.get('charset', 'utf8')
+        self.no_backslash_escapes = False
+        return bin_index, binlog_sizes
+
+    def open_server(self, connection=None):
+        """metadata of the server the binlog is read from, returns its binlog files and their sizes"""
+        self.connection = connection if connection else pymysql.connect(**self.conn_setting)
         with self.connection as cursor:
             cursor.execute("SHOW MASTER STATUS")
             self.eof_file, self.eof_pos = cursor.fetchone()[:2]
             cursor.execute("SHOW MASTER LOGS")
-            bin_index = [row[0] for row in cursor.fetchall()]
+            binlog_sizes = OrderedDict((row[0], row[1]) for row in cursor.fetchall())
+            bin_index = list(binlog_sizes)
             if self.start_file not in bin_index:
-                raise ValueError('parameter error: start_file %s not in mysql server' % self.start_file)
-            binlog2i = lambda x: x.split('.')[1]
-            for binary in bin_index:
-                if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.stop_file):
-                    self.binlogList.append(binary)
+                raise self.missing_start_file('mysql server')
 
             cursor.execute("SELECT @@server_id")
             self.server_id = cursor.fetchone()[0]
             if not self.server_id:
-                raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
+                raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'],
+                                                                self.conn_setting['port']))
 
-    def process_binlog(self):
-        stream = BinLogStreamReader(connection_settings=self.conn_setting,
-                                    server_id=self.server_id, log_file=self.start_file, log_pos=self.start_pos,
-                                    only_schemas=self.only_schemas, only_tables=self.only_tables,
-                                    resume_stream=True, blocking=True)
+        # escaping settings for client-side sql rendering, so rows are not rendered through the connection
+        self.charset = self.connection.charset
+        self.no_backslash_escapes = bool(self.connection.server_status &
+                                         SERVER_STATUS.SERVER_STATUS_NO_BACKSLASH_ESCAPES)
+        return bin_index, binlog_sizes
 
-        flag_last_event = False
-        e_start_pos, last_pos = stream.log_pos, stream.log_pos
+    def missing_start_file(self, where):
+        if not self.resume_state:
+            return ValueError('parameter error: start_file %s not in %s' % (self.start_file, where))
+        return ValueError('checkpoint %s:%s not in %s, the last transaction written was gtid %s' % (
+            self.start_file, self.start_pos, where, self.resume_state.get('gtid')))
+
+    def seed_schema_cache(self):
+        """
+        the schema cache of a first run: the tables of information_schema (of schema_file offline) as the columns
+        at start_file:start_pos, the ddl the parse reads from there adds versions
+        """
+        snapshot = self.schema_snapshot if self.binlog_dir else read_schema_snapshot(self.connection)
+        self.schema_cache = SchemaCache.from_snapshot(snapshot, charset=self.charset)
+        if self.binlog_dir:
+            self.schema_snapshot = self.schema_cache
+        self.schema_cache.save(self.schema_cache_file)
+
+    def create_ddl_stream(self, log_files, log_pos, only_events=None):
+        """a stream of the query events (or only_events) of log_files from log_pos on, rows are not decoded"""
+        only_events = only_events or [QueryEvent]
+        if self.binlog_dir:
+            return BinLogFileReader(self.binlog_dir, log_files, SchemaCache(), log_pos=log_pos, charset=self.charset,
+                                    only_events=only_events)
+        return BinLogStreamReader(connection_settings=self.conn_setting, server_id=self.stream_server_id,
+                                  log_file=log_files[0], log_pos=log_pos, only_events=only_events,
+                                  resume_stream=True, blocking=False)
+
+    def create_stream(self):
+        if self.binlog_dir:
+            return BinLogFileReader(self.binlog_dir, self.binlogList, self.schema_snapshot,
+                                    log_pos=self.start_pos, charset=self.charset, only_events=self.only_events,
+                                    only_schemas=self.only_schemas, only_tables=self.only_tables)
+        stream_settings = dict(connection_settings=self.conn_setting,
+                               server_id=self.stream_server_id, log_file=self.start_file, log_pos=self.start_pos,
+                               only_events=self.only_events,
+                               only_schemas=self.only_schemas, only_tables=self.only_tables,
+                               resume_stream=True, blocking=True)
+        if self.schema_cache:
+            return CachedBinLogStreamReader(self.schema_cache, **stream_settings)
+        return BinLogStreamReader(**stream_settings)
+
+    def backfill_index(self):
+        """index the rotated files of the range no parse has read whole, so the next run skips and seeks in them"""
+        for log_file in self.index.unbuilt(self.index_files, self.eof_file):
+            start = time.time()
+            stream = self.create_ddl_stream([log_file], 4, only_events=[QueryEvent, XidEvent, RotateEvent])
+            try:
+                self.index.build(log_file, stream)
+            finally:
+                stream.close()
+            sys.stderr.write('[binlog2sql] index built for %s in %.1fs\n' % (log_file, time.time() - start))
+
+    def process_binlog(self):
+        if self.workers > 1 and not self.stop_never and not self.checkpoint and not self.compact and \
+                len(self.binlogList) > 1:
+            return self.process_binlog_parallel()
 
-        origin_file = create_file(self.output_path, 'origin.sql')
+        metrics = self.metrics
+        metrics_server = MetricsServer(metrics, self.metrics_port, self.metrics_host) if self.metrics_port else None
+        stream = self.create_stream()
+        origin_file = create_file(self.output_path, OUTPUT_FORMATS[self.output_format])
         # to simplify code, we do not use flock for tmp_file.
-        tmp_file = create_unique_file('%s.%s.txt' % (self.conn_setting['host'], self.conn_setting['port']))
-        with file_open(origin_file, "w") as f_origin, file_temp_open(tmp_file, "w") as f_tmp, \
-                self.connection as cursor:
-            for binlog_event in stream:
-                if not self.stop_never:
-                    try:
-                        event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-                    except OSError:
-                        event_time = datetime.datetime(1980, 1, 1, 0, 0)
-                    if (stream.log_file == self.stop_file and stream.log_pos == self.stop_pos) or \
-                            (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
-                        flag_last_event = True
-                    elif event_time < self.start_time:
-                        if not (isinstance(binlog_event, RotateEvent)
-                                or isinstance(binlog_event, FormatDescriptionEvent)):
-                            last_pos = binlog_event.packet.log_pos
-                        continue
-                    elif (stream.log_file not in self.binlogList) or \
-                            (self.stop_pos and stream.log_file == self.stop_file and stream.log_pos > self.stop_pos) or \
-                            (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
-                            (event_time >= self.stop_time):
-                        break
-                    # else:
-                    #     raise ValueError('unknown binlog file or position')
-
-                if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
-                    e_start_pos = last_pos
-
-                if isinstance(binlog_event, QueryEvent) and not self.only_dml:
-                    sql = concat_sql_from_binlog_event(cursor=cursor, binlog_event=binlog_event,
-                                                       flashback=self.flashback, no_pk=self.no_pk)
-                    if sql:
-                        f_origin.write(sql + '\n')
-                        if self.output_console:
-                            print(sql)
-                elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
-                    for row in binlog_event.rows:
-                        sql = concat_sql_from_binlog_event(cursor=cursor, binlog_event=binlog_event, row=row,
-                                                           flashback=self.flashback, no_pk=self.no_pk,
-                                                           e_start_pos=e_start_pos)
-
-                        f_origin.write(sql + '\n')
-                        if self.output_console:
-                            print(sql)
-                        if self.flashback:
-                            f_tmp.write(sql + '\n')
-
-                if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
-                    last_pos = binlog_event.packet.log_pos
-                if flag_last_event:
-                    break
+        tmp_file = create_unique_file('%s.%s.%s.txt' % (self.conn_setting.get('host', 'localhost'),
+                                                         self.conn_setting.get('port', 3306), os.getpid()))
+        resume = None
+        if self.resume_state:
+            resume = (self.resume_state['origin_offset'], self.resume_state['origin_files'])
+        with output_open(origin_file, compress=self.output_compress, rotate_size=self.output_rotate_size,
+                         resume=resume) as f_origin, \
+                output_open(stream=sys.stdout if self.output_console else None) as console, \
+                file_temp_open(tmp_file, "wb") as f_tmp:
+            metrics.writer = f_origin
+            with self.create_writer(stream, f_origin, console, f_tmp) as writer:
+                if self.compact:
+                    self.read_compacted(stream, writer)
+                else:
+                    self.read_stream(stream, writer)
 
             stream.close()
+            if self.schema_cache and self.schema_cache.dirty:
+                self.schema_cache.save(self.schema_cache_file)
+            if self.checkpoint and writer.boundary:
+                self.save_checkpoint(f_origin, writer.boundary)
+            if self.index:
+                self.index.save()
+                if self.build_index:
+                    self.backfill_index()
             f_origin.close()
             f_tmp.close()
+            metrics.sample()
+            self.output_stats['origin'] = {'bytes': f_origin.bytes_written, 'files': f_origin.files,
+                                           'max_queue_depth': f_origin.max_queue_depth}
+            if self.flashback:
+                self.write_rollback(tmp_file, writer.trx_offsets, console)
+
+        if self.progress_interval:
+            metrics.report()
+        if metrics_server:
+            metrics_server.close()
+        if self.apply_rollback:
+            self.apply_rollback_file()
+        return True
+
+    def create_writer(self, stream, f_origin, console, f_tmp):
+        """the writer read_stream hands the output over to: EventWriter, SqlWriter or PipelinedSqlWriter"""
+        on_boundary = self.checkpointer(f_origin) if self.checkpoint else None
+        if self.output_format != 'sql':
+            # records are cheap to build, they are not worth a renderer process
+            return EventWriter(f_origin, stream, self.output_format, console=console, on_boundary=on_boundary)
+        batch = SqlBatch(self.batch_size, reverse=self.flashback) if self.batch_size else None
+        writer = SqlWriter(f_origin, console=console, f_tmp=f_tmp if self.flashback else None, batch=batch,
+                           on_boundary=on_boundary, template_cache=self.template_cache, flashback=self.flashback,
+                           no_pk=self.no_pk, batch_size=self.batch_size, charset=self.charset,
+                           no_backslash_escapes=self.no_backslash_escapes)
+        if self.render_workers > 1:
+            writer = PipelinedSqlWriter(writer, self.render_workers, metrics=self.metrics)
+        return writer
 
+    def checkpointer(self, f_origin):
+        """on_boundary of a writer: save a checkpoint once checkpoint_interval is over"""
+        checkpoint_time = time.time()
+
+        def on_boundary(boundary):
+            nonlocal checkpoint_time
+            if time.time() - checkpoint_time >= self.checkpoint_interval:
+                self.save_checkpoint(f_origin, boundary)
+                checkpoint_time = time.time()
+
+        return on_boundary
+
+    def read_stream(self, stream, writer, compactor=None):
+        """
+        Hand the events of stream in the time and position range over to writer in binlog order: ddl, rows of
+        sql_type, the ends of transactions and the checkpoint boundaries. With a compactor, the rows of tables with
+        a primary key are folded into it instead of written.
+        """
+        metrics = self.metrics
+        rows_reader = RowsReader()
+        if self.index:
+            self.index.start(self.start_file, self.start_pos)
+        flag_last_event = False
+        e_start_pos, last_pos = stream.log_pos, stream.log_pos
+        gtid = self.resume_state.get('gtid') if self.resume_state else None
+        for binlog_event in metrics.watch(stream):
+            if self.index:
+                self.index.observe(binlog_event)
+            if self.schema_cache and isinstance(binlog_event, QueryEvent) and \
+                    binlog_event.query not in ('BEGIN', 'COMMIT'):
+                # replayed before the time filter, ddl before start_time shapes the rows after it
+                self.replay_ddl(stream, binlog_event)
+            if not self.stop_never:
+                event_range = self.event_range(stream, binlog_event)
+                if event_range == 'skip':
+                    last_pos = next_start_pos(binlog_event, last_pos)
+                    metrics.counters['events_skipped'] += 1
+                    continue
+                elif event_range == 'stop':
+                    break
+                flag_last_event = event_range == 'last'
+
+            if self.batch_size and (isinstance(binlog_event, XidEvent) or isinstance(binlog_event, QueryEvent)):
+                # batches never cross a transaction or a ddl
+                writer.flush_batch()
+            if self.flashback and (isinstance(binlog_event, XidEvent) or (
+                    isinstance(binlog_event, QueryEvent) and binlog_event.query in ('BEGIN', 'COMMIT'))):
+                writer.mark_transaction()
+
+            if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
+                e_start_pos = last_pos
+            elif isinstance(binlog_event, QueryEvent) and binlog_event.query != 'COMMIT':
+                # ddl may change the column layout, cached templates are no longer valid
+                self.template_cache.invalidate()
+            elif isinstance(binlog_event, TableMapEvent):
+                self.template_cache.on_table_map(binlog_event.schema, binlog_event.table, binlog_event.table_id)
+
+            if isinstance(binlog_event, QueryEvent) and not self.only_dml:
+                self.write_query(binlog_event, writer)
+            elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
+                metrics.counters['rows'] += self.write_rows(binlog_event, writer, rows_reader, e_start_pos,
+                                                            compactor)
+
+            last_pos = next_start_pos(binlog_event, last_pos)
+
+            if self.checkpoint or self.output_console:
+                if isinstance(binlog_event, GtidEvent):
+                    gtid = gtid_of(binlog_event)
+                elif isinstance(binlog_event, XidEvent) or (
+                        isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN'):
+                    # batches are flushed at xid and query events, origin.sql ends with this transaction.
+                    # the console is flushed there too
+                    writer.mark_boundary(stream.log_file, stream.log_pos, gtid)
+            if flag_last_event:
+                break
+
+    def event_range(self, stream, binlog_event):
+        """
+        where an event is in the time and position range: 'last' for the event at stop_pos or at the end of
+        the binlog, 'skip' before start_time, 'stop' beyond the range, 'in' for every other event
+        """
+        try:
+            event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+        except OSError:
+            event_time = datetime.datetime(1980, 1, 1, 0, 0)
+        if (stream.log_file == self.stop_file and stream.log_pos == self.stop_pos) or \
+                (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
+            return 'last'
+        if event_time < self.start_time:
+            return 'skip'
+        if (stream.log_file not in self.binlogList) or \
+                (self.stop_pos and stream.log_file == self.stop_file and stream.log_pos > self.stop_pos) or \
+                (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
+                (event_time >= self.stop_time):
+            return 'stop'
+        return 'in'
+
+    def replay_ddl(self, stream, binlog_event):
+        """add the changes of a ddl to the schema cache, the tables it changed get their table map decoded again"""
+        for schema, table in self.schema_cache.replay(binlog_event.schema.decode('utf-8'), binlog_event.query,
+                                                      stream.log_file, stream.log_pos, refresh=self.ddl_refresh()):
+            stream.forget_table(schema, table)
+
+    def ddl_refresh(self):
+        """refresh of SchemaCache.replay: the columns on the server. Offline there is none, the tables are invalid"""
+        if self.binlog_dir:
+            return None
+        return lambda schema, table: read_table_columns(self.connection, schema, table)
+
+    def write_query(self, binlog_event, writer):
+        if self.output_format != 'sql':
+            if binlog_event.query not in ('BEGIN', 'COMMIT'):
+                writer.write_query(binlog_event)
+            return
+        sql = concat_sql_from_binlog_event(binlog_event=binlog_event, flashback=self.flashback, no_pk=self.no_pk)
+        if sql:
+            writer.write_sql(sql)
+
+    def write_rows(self, binlog_event, writer, rows_reader, e_start_pos, compactor=None):
+        """hand the rows of a rows event over to the compactor or the writer, return their number"""
+        metrics, clock = self.metrics, time.perf_counter
+        if compactor and binlog_event.primary_key:
+            # folded into the net changes written at the end, rows are never held twice
+            render_start = clock()
+            rows = compactor.add(rows_reader.read(binlog_event, lazy=True), e_start_pos)
+        elif self.event_memory_limit and binlog_event.event_size > self.event_memory_limit:
+            # rows are decoded while they are written, decode time counts as render time
+            render_start = clock()
+            rows = writer.stream(rows_reader.read(binlog_event, lazy=True), e_start_pos)
+        else:
+            # row images are decoded on first access
+            decode_start = clock()
+            rows_batch = rows_reader.read(binlog_event)
+            render_start = clock()
+            metrics.seconds['decode'] += render_start - decode_start
+            writer.render(rows_batch, e_start_pos)
+            if isinstance(writer, PipelinedSqlWriter):
+                # only handed over here, the renderer processes report their own time
+                return len(rows_batch)
+            rows = len(rows_batch)
+        metrics.seconds['render'] += clock() - render_start
+        return rows
+
+    def read_compacted(self, stream, writer):
+        """read_stream folding rows into their net changes, written once the stream is read"""
+        with RowCompactor(self.compact_memory_limit, spill_dir=self.output_path) as compactor:
+            self.read_stream(stream, writer, compactor)
+            self.write_compacted(compactor, writer)
+        self.output_stats['compact'] = {'rows': compactor.rows, 'changes': compactor.changes_written,
+                                        'spills': compactor.spills, 'runs': compactor.runs}
+
+    def write_rollback(self, tmp_file, trx_offsets, console=None):
+        """rollback.sql from the flashback temp file: transactions in reverse, the sql inside them too"""
+        metrics, clock = self.metrics, time.perf_counter
+        rollback_file = create_file(self.output_path, 'rollback.sql')
+        if console:
+            console.write('###### rollback sql ######\n')
+        with output_open(rollback_file, compress=self.output_compress) as f_rollback, \
+                file_temp_open(tmp_file, "rb") as f_tmp:
+            # 从缓存文件读取原始SQL, 事务倒序, 事务内的SQL也倒序
+            metrics.rollback_total = trx_offsets[-1]
+            for i in range(len(trx_offsets) - 1, 0, -1):
+                reverse_start = clock()
+                lines = reversed_lines(f_tmp, start=trx_offsets[i - 1], end=trx_offsets[i],
+                                       max_line_size=self.event_memory_limit or None)
+                if self.flashback_transaction:
+                    lines = itertools.chain([b'BEGIN;'], lines, [b'COMMIT;'])
+                for line in lines:
+                    # a statement too long to read at once is copied in blocks
+                    blocks = itertools.chain(line.blocks(), [b'\n']) if isinstance(line, FileRange) \
+                        else [line.rstrip() + b'\n']
+                    for block in blocks:
+                        f_rollback.write(block)
+                        if console:
+                            console.write(block)
+                metrics.seconds['reverse'] += clock() - reverse_start
+                metrics.counters['rollback_bytes'] += trx_offsets[i] - trx_offsets[i - 1]
+                metrics.tick()
+            f_tmp.close()
+            f_rollback.close()
+            self.output_stats['rollback'] = {'bytes': f_rollback.bytes_written, 'files': f_rollback.files,
+                                             'max_queue_depth': f_rollback.max_queue_depth}
+
+    def apply_rollback_file(self):
+        """
+        apply output_path/rollback.sql, the summary is kept in apply_summary. A failed apply records what it
+        committed in rollback.sql.applied. The next run resumes from there if it writes the same rollback.sql
+        """
+        applier = RollbackApplier(self.conn_setting, workers=self.apply_workers, batch_size=self.apply_batch_size,
+                                  dry_run=self.apply_dry_run, progress_interval=self.progress_interval)
+        rollback_file = os.path.join(self.output_path, 'rollback.sql') + COMPRESS_SUFFIX[self.output_compress]
+        state_file = rollback_file + '.applied'
+        if applier.stale_state(rollback_file, state_file):
+            # left by an apply of another rollback.sql, what it committed is in the binlog this run parsed
+            sys.stderr.write('[binlog2sql] %s records an apply of another rollback.sql, applying from the start\n'
+                             % state_file)
+            os.remove(state_file)
+        self.apply_summary = applier.apply_file(rollback_file, compress=self.output_compress, state_file=state_file)
+        sys.stderr.write(applier.progress_line() + '\n')
+        return self.apply_summary
+
+    def write_compacted(self, compactor, writer):
+        """net changes of compactor, in transactions of COMPACT_TRANSACTION_ROWS rows of their own"""
+        writer.flush_batch()
+        writer.mark_transaction()
+        for i, (rows_batch, e_start_pos) in enumerate(compactor.changes(), 1):
+            writer.render(rows_batch, e_start_pos)
+            if i % COMPACT_TRANSACTION_ROWS == 0:
+                writer.flush_batch()
+                writer.mark_transaction()
+        writer.flush_batch()
+        writer.mark_transaction()
+
+    def save_checkpoint(self, f_origin, boundary):
+        """wait for origin.sql to reach the disk, then save the end of the transaction it ends with"""
+        log_file, log_pos, origin_offset, gtid = boundary
+        f_origin.sync()
+        if self.schema_cache and self.schema_cache.dirty:
+            # a resumed parse replays only the ddl after the checkpoint
+            self.schema_cache.save(self.schema_cache_file)
+        self.checkpoint.save({'log_file': log_file, 'log_pos': log_pos, 'gtid': gtid,
+                              'origin_offset': origin_offset, 'origin_files': list(f_origin.file_starts)})
+
+    def process_binlog_parallel(self):
+        """parse every file of binlogList in its own worker process, then merge the outputs in binlog order"""
+        tasks = self.file_tasks()
+        pool = multiprocessing.Pool(processes=min(self.workers, len(tasks)))
+        try:
+            pending = tasks
+            while pending:
+                pool.map(_process_binlog_file, pending, chunksize=1)
+                pending = self.merge_schema_parts(tasks)
+        finally:
+            pool.close()
+            pool.join()
+        self.merge_parts([task['output_path'] for task in tasks])
+        if self.apply_rollback:
+            self.apply_rollback_file()
+        return True
+
+    def file_tasks(self):
+        """
+        Binlog2sql kwargs parsing one file of binlogList each, with its output in output_path/<file>.part.
+        Each part gets a copy of the schema cache, the ddl of its file is merged back by merge_parts.
+        """
+        tasks = []
+        for i, binlog_file in enumerate(self.binlogList):
+            part_path = os.path.join(self.output_path, '%s.part' % binlog_file)
+            schema_cache_file = None
+            if self.schema_cache:
+                if len(self.binlogList) == 1:
+                    schema_cache_file = self.schema_cache_file
+                else:
+                    schema_cache_file = create_file(part_path, 'schema_cache.json')
+                    self.schema_cache.save(schema_cache_file)
+            stop_pos = self.stop_pos if binlog_file == self.stop_file else None
+            if not stop_pos and binlog_file == self.eof_file:
+                # pin the end to the master status seen by this process, not the one seen by the worker
+                stop_pos = self.eof_pos
+            tasks.append({
+                'connection_settings': self.conn_setting,
+                'start_file': binlog_file, 'stop_file': binlog_file,
+                'start_time': self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                'stop_time': self.stop_time.strftime("%Y-%m-%d %H:%M:%S"),
+                'start_pos': self.start_pos if binlog_file == self.start_file else 4,
+                'stop_pos': stop_pos,
+                'only_schemas': self.only_schemas, 'only_tables': self.only_tables,
+                'only_dml': self.only_dml, 'sql_type': self.sql_type, 'no_pk': self.no_pk,
+                'flashback': self.flashback, 'flashback_transaction': self.flashback_transaction,
+                'batch_size': self.batch_size,
+                'output_path': part_path,
+                'output_console': False,
+                'template_cache_size': self.template_cache.maxsize,
+                'binlog_dir': self.binlog_dir, 'schema_file': self.schema_file, 'index_dir': self.index_dir,
+                'build_index': self.build_index,
+                'progress_interval': self.progress_interval, 'event_memory_limit': self.event_memory_limit,
+                'schema_cache_file': schema_cache_file, 'output_format': self.output_format,
+                # every replication stream needs its own server_id, or the master kicks the previous one
+                'stream_server_id': WORKER_SERVER_ID_BASE + i,
+            })
+        return tasks
+
+    def merge_schema_parts(self, tasks):
+        """
+        merge the schema caches saved by the workers of file_tasks into the schema cache, in binlog order.
+        A worker knows the ddl of the files before its own only from the cache it started with, so once a file
+        added versions the files after it were parsed with stale columns, and the versions their workers added
+        may be stale too. The ddl of those files is replayed in one pass in binlog order instead, then they get
+        the merged cache and are returned to be parsed once more. Nothing is returned without new ddl, so a stale
+        file is parsed again at most once.
+        """
+        if not self.schema_cache or len(tasks) < 2:
+            return []
+        for i, task in enumerate(tasks):
+            if self.schema_cache.merge(SchemaCache.load(task['schema_cache_file'])) and i + 1 < len(tasks):
+                stale_tasks = tasks[i + 1:]
+                stream = self.create_ddl_stream([t['start_file'] for t in stale_tasks], stale_tasks[0]['start_pos'])
+                try:
+                    for schema, query, log_file, log_pos in read_ddl(stream, stale_tasks[-1]['stop_file'],
+                                                                     stale_tasks[-1]['stop_pos']):
+                        self.schema_cache.replay(schema, query, log_file, log_pos, refresh=self.ddl_refresh())
+                finally:
+                    stream.close()
+                for stale_task in stale_tasks:
+                    self.schema_cache.save(stale_task['schema_cache_file'])
+                return stale_tasks
+        return []
+
+    def merge_parts(self, part_paths):
+        """merge the outputs of file_tasks in binlog order into output_path, then remove them"""
+        origin_name = OUTPUT_FORMATS[self.output_format]
+        origin_file = create_file(self.output_path, origin_name)
+        # console output of the workers is off, a merged msgpack part is not for the console
+        console_stream = sys.stdout if self.output_console and self.output_format != 'msgpack' else None
+        with output_open(origin_file, compress=self.output_compress, rotate_size=self.output_rotate_size) as f_origin, \
+                output_open(stream=console_stream) as console:
+            merge_files([os.path.join(path, origin_name) for path in part_paths], f_origin, console)
             if self.flashback:
                 rollback_file = create_file(self.output_path, 'rollback.sql')
-                """print rollback sql from tmp_file"""
-                if self.output_console:
-                    print('###### rollback sql ######')
-                with file_open(rollback_file, "w") as f_rollback, file_temp_open(tmp_file, "r") as f_tmp1:
-                    # 从缓存文件读取原始SQL
-                    for line in reversed_lines(f_tmp1):
-                        f_rollback.write(line.rstrip() + '\n')
-                        if self.output_console:
-                            print(line.rstrip())
-                    f_tmp1.close()
-                f_rollback.close()
+                if console:
+                    console.write('###### rollback sql ######\n')
+                with output_open(rollback_file, compress=self.output_compress) as f_rollback:
+                    merge_files([os.path.join(path, 'rollback.sql') for path in reversed(part_paths)],
+                                f_rollback, console)
+        if self.schema_cache:
+            self.schema_cache.save(self.schema_cache_file)
+        for path in part_paths:
+            shutil.rmtree(path, ignore_errors=True)
 
-        return True
+    def summary(self):
+        """counters of the last process_binlog run and where it stopped"""
+        self.metrics.sample()
+        summary = dict(self.metrics.counters)
+        summary['seconds'] = round(time.time() - self.metrics.started, 3)
+        summary['log_file'], summary['log_pos'] = self.metrics.log_file, self.metrics.log_pos
+        return summary
 
     def __del__(self):
         pass
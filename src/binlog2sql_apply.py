@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import pymysql
+from pymysql.constants import CLIENT
+
+from .binlog2sql_output import zstandard
+from .binlog2sql_pool import ConnectionPool
+
+# statements sent in one round trip and committed as one transaction
+APPLY_BATCH_SIZE = 500
+# a batch is closed before it grows beyond this many bytes, well below the default max_allowed_packet
+APPLY_BATCH_BYTES = 1024 * 1024
+# batches waiting for a lane before the reader blocks
+APPLY_QUEUE_SIZE = 4
+
+STATEMENT_TABLE = re.compile(br'^(?:INSERT INTO|DELETE FROM|UPDATE) (`(?:[^`]|``)+`\.`(?:[^`]|``)+`)')
+
+
+def statement_table(line):
+    """`schema`.`table` of a statement of rollback.sql, None for anything else"""
+    match = STATEMENT_TABLE.match(line)
+    return match.group(1).decode('utf-8') if match else None
+
+
+def input_open(filename, compress=None):
+    """binary file of output_open, read back"""
+    if compress == 'gzip':
+        return gzip.open(filename, 'rb')
+    if compress == 'zstd':
+        if zstandard is None:
+            raise ValueError('compress zstd needs the zstandard package')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True))
+    return open(filename, 'rb')
+
+
+class RollbackApplier(object):
+    """
+    Apply rollback.sql to a server. A transaction, the statements between BEGIN; and COMMIT;, is applied whole: its
+    statements are sent with those of the next transactions in one multi-statement round trip of at most batch_size
+    statements and committed together. Tables are spread over workers lanes, each with its own pooled connection.
+    A transaction of one table always goes to the lane of the table, so the table is changed in file order while
+    other tables go on in parallel. A transaction of several tables waits for every lane to commit what it was given,
+    then runs alone. A statement outside BEGIN; and COMMIT; is a transaction of its own.
+    """
+
+    def __init__(self, conn_setting, workers=1, batch_size=APPLY_BATCH_SIZE, batch_bytes=APPLY_BATCH_BYTES,
+                 dry_run=False, progress_interval=0, pool=None, out=None):
+        """dry_run: read and batch the statements without connecting. pool: a ConnectionPool, a new one when None"""
+        self.conn_setting = dict(conn_setting if conn_setting else {}, autocommit=False,
+                                 client_flag=CLIENT.MULTI_STATEMENTS)
+        self.workers = workers if workers else 1
+        self.batch_size = batch_size if batch_size else APPLY_BATCH_SIZE
+        self.batch_bytes = batch_bytes if batch_bytes else APPLY_BATCH_BYTES
+        self.dry_run = dry_run
+        self.progress_interval = progress_interval
+        self.pool = pool if pool else ConnectionPool()
+        self.out = out if out else sys.stderr
+        self.statements = 0
+        self.batches = 0
+        # statements of transactions a resumed apply found committed already
+        self.skipped = 0
+        # `schema`.`table` -> statements committed
+        self.tables = OrderedDict()
+        self.started = None
+        self._lock = threading.Lock()
+        self._error = None
+        self._error_line = None
+        # file offsets of the transactions handed to a lane and not committed yet, in file order
+        self._pending_offsets = OrderedDict()
+        # file offsets of the transactions committed after the first pending one, what is before it is committed
+        self._committed_offsets = set()
+        # file offsets of the transactions the apply resumed found committed after its start
+        self._resumed_offsets = set()
+        # filename -> sha1, a state file is only resumed for the file it was written for
+        self._digests = {}
+
+    def apply_file(self, filename, compress=None, state_file=None):
+        """
+        apply every statement of filename, return the summary. The first failed batch is rolled back and raised.
+        state_file: where a failed apply records the transactions committed, a later apply_file of the same file
+        with the same state_file skips them and goes on. It is removed once the whole file is applied
+        """
+        self.started = time.time()
+        next_report = self.started + self.progress_interval
+        resume = self.load_state(filename, state_file) if state_file else None
+        if resume:
+            self._resumed_offsets = resume['committed']
+        lanes = [queue.Queue(maxsize=APPLY_QUEUE_SIZE) for _ in range(self.workers)]
+        threads = [threading.Thread(target=self._run_lane, args=(lane,), name='binlog2sql-apply-%d' % i)
+                   for i, lane in enumerate(lanes)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # per lane: transactions of the open batch, their statements and bytes
+        pending = [([], 0, 0) for _ in lanes]
+        end_offset = 0
+        try:
+            for offset, first_line, statements, tables in self.transactions(filename, compress):
+                if self._error is not None:
+                    break
+                end_offset = offset
+                if resume and (offset < resume['offset'] or offset in resume['committed']):
+                    self.skipped += len(statements)
+                    continue
+                if self.progress_interval and time.time() >= next_report:
+                    self.out.write(self.progress_line() + '\n')
+                    self.out.flush()
+                    next_report = time.time() + self.progress_interval
+                with self._lock:
+                    self._pending_offsets[offset] = None
+                transaction = (offset, first_line, statements, tables)
+                if len(set(tables)) != 1 or tables[0] is None:
+                    # tables on other lanes may have older statements queued, the transaction waits for them
+                    for i, (batch, _, _) in enumerate(pending):
+                        self._put(lanes[i], batch)
+                        pending[i] = ([], 0, 0)
+                    for lane in lanes:
+                        lane.join()
+                    self._put(lanes[0], [transaction])
+                    lanes[0].join()
+                    continue
+                i = zlib.crc32(tables[0].encode('utf-8')) % len(lanes)
+                batch, count, size = pending[i]
+                line_bytes = sum(len(line) + 1 for line in statements)
+                if batch and (count + len(statements) > self.batch_size or size + line_bytes > self.batch_bytes):
+                    self._put(lanes[i], batch)
+                    batch, count, size = [], 0, 0
+                batch.append(transaction)
+                pending[i] = (batch, count + len(statements), size + line_bytes)
+            else:
+                end_offset = None
+            for i, (batch, _, _) in enumerate(pending):
+                self._put(lanes[i], batch)
+        finally:
+            for lane in lanes:
+                lane.put(None)
+            for thread in threads:
+                thread.join()
+            self.pool.close()
+            if state_file and not self.dry_run:
+                self.save_state(filename, state_file, end_offset if self._error is None else None)
+        if self._error is not None:
+            self.out.write('%s, the batch from line %d of %s failed and is rolled back%s\n' % (
+                self.progress_line(), self._error_line, filename,
+                ', the transactions committed are recorded in %s for a resume' % state_file if state_file else ''))
+            raise self._error
+        return self.summary()
+
+    @staticmethod
+    def transactions(filename, compress=None):
+        """(offset, line, statements, their tables) of every transaction of filename, offset and line of its start"""
+        statements, tables = [], []
+        in_transaction = False
+        offset = start_offset = start_line = 0
+        with input_open(filename, compress) as f:
+            for line_no, line in enumerate(f, 1):
+                line_offset, offset = offset, offset + len(line)
+                line = line.rstrip()
+                if not line:
+                    continue
+                if not statements and not in_transaction:
+                    start_offset, start_line = line_offset, line_no
+                if line == b'BEGIN;':
+                    in_transaction = True
+                    continue
+                if line != b'COMMIT;':
+                    statements.append(line)
+                    tables.append(statement_table(line))
+                if statements and (not in_transaction or line == b'COMMIT;'):
+                    yield start_offset, start_line, statements, tables
+                    statements, tables = [], []
+                if line == b'COMMIT;':
+                    in_transaction = False
+        if statements:
+            yield start_offset, start_line, statements, tables
+
+    @staticmethod
+    def _put(lane, transactions):
+        if transactions:
+            lane.put(transactions)
+
+    def file_digest(self, filename):
+        """sha1 of filename, read once per apply"""
+        if filename not in self._digests:
+            digest = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            self._digests[filename] = digest.hexdigest()
+        return self._digests[filename]
+
+    def stale_state(self, filename, state_file):
+        """whether state_file records an apply of a file other than filename, as it is now"""
+        if not os.path.exists(state_file):
+            return False
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        return state['file'] != os.path.abspath(filename) or state['size'] != os.path.getsize(filename) or \
+            state.get('digest') != self.file_digest(filename)
+
+    def load_state(self, filename, state_file):
+        if not os.path.exists(state_file):
+            return None
+        if self.stale_state(filename, state_file):
+            raise ValueError('%s records an apply of another %s, remove it to apply from the start' % (
+                state_file, filename))
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        state['committed'] = set(state['committed'])
+        self.out.write('[binlog2sql] resume applying %s from offset %d\n' % (filename, state['offset']))
+        return state
+
+    def save_state(self, filename, state_file, end_offset=None):
+        """
+        record the first transaction not committed and the ones committed after it, end_offset is where reading
+        stopped without an error, None once the whole file is read
+        """
+        with self._lock:
+            if self._pending_offsets:
+                offset = next(iter(self._pending_offsets))
+            elif end_offset is None:
+                if os.path.exists(state_file):
+                    os.remove(state_file)
+                return
+            else:
+                offset = end_offset
+            committed = sorted(o for o in self._committed_offsets | self._resumed_offsets if o >= offset)
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'file': os.path.abspath(filename), 'size': os.path.getsize(filename),
+                       'digest': self.file_digest(filename), 'offset': offset, 'committed': committed}, f)
+        os.replace(tmp_file, state_file)
+
+    def _committed(self, offset):
+        first = next(iter(self._pending_offsets))
+        del self._pending_offsets[offset]
+        if not self._pending_offsets:
+            self._committed_offsets.clear()
+        elif offset != first:
+            self._committed_offsets.add(offset)
+        elif self._committed_offsets:
+            # the first transaction not committed moved on, what is before it needs no record
+            first = next(iter(self._pending_offsets))
+            self._committed_offsets = set(o for o in self._committed_offsets if o > first)
+
+    def _run_lane(self, lane):
+        connection = None
+        try:
+            while True:
+                transactions = lane.get()
+                try:
+                    if transactions is None:
+                        break
+                    if self._error is not None:
+                        # keep draining so the reader never blocks on a stopped lane
+                        continue
+                    statements = [line for _, _, lines, _ in transactions for line in lines]
+                    try:
+                        if not self.dry_run:
+                            if connection is None:
+                                connection = self.pool.acquire(self.conn_setting)
+                            self._execute(connection, statements)
+                    except Exception as e:
+                        self._error, self._error_line = e, transactions[0][1]
+                        if connection is not None:
+                            try:
+                                connection.rollback()
+                            except pymysql.err.Error:
+                                # the server rolls the batch back when the connection goes
+                                pass
+                            try:
+                                connection.close()
+                            except pymysql.err.Error:
+                                pass
+                            connection = None
+                        continue
+                    with self._lock:
+                        self.statements += len(statements)
+                        self.batches += 1
+                        for offset, _, _, tables in transactions:
+                            self._committed(offset)
+                            for table in tables:
+                                self.tables[table] = self.tables.get(table, 0) + 1
+                finally:
+                    lane.task_done()
+        finally:
+            if connection is not None:
+                self.pool.release(self.conn_setting, connection)
+
+    @staticmethod
+    def _execute(connection, statements):
+        # every statement ends with its #start comment, a newline closes the comment
+        with connection.cursor() as cursor:
+            cursor.execute(b'\n'.join(statements).decode('utf-8'))
+            while cursor.nextset():
+                pass
+        connection.commit()
+
+    @property
+    def seconds(self):
+        return time.time() - self.started if self.started else 0.0
+
+    def progress_line(self):
+        seconds = self.seconds
+        return '[binlog2sql] %s %d statements in %d batches to %d tables, %.1fs %.0f statements/s' % (
+            'dry run, would apply' if self.dry_run else 'applied', self.statements, self.batches, len(self.tables),
+            seconds, self.statements / seconds if seconds else 0)
+
+    def summary(self):
+        seconds = self.seconds
+        return OrderedDict([('dry_run', self.dry_run), ('statements', self.statements), ('batches', self.batches),
+                            ('workers', self.workers), ('seconds', round(seconds, 3)),
+                            ('statements_per_second', round(self.statements / seconds, 1) if seconds else 0),
+                            ('skipped', self.skipped), ('tables', self.tables)])
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import uuid
+
+# seconds between two checkpoints, every checkpoint costs an fsync of origin.sql and of the checkpoint file
+CHECKPOINT_INTERVAL = 1.0
+
+
+def gtid_of(gtid_event):
+    """source_id:transaction_id of a GtidEvent"""
+    return '%s:%d' % (uuid.UUID(bytes=gtid_event.sid), gtid_event.gno)
+
+
+class Checkpoint(object):
+    """
+    Resume point of a parse, one json file:
+    {"log_file": name, "log_pos": pos, "gtid": gtid, "origin_offset": offset, "origin_files": [offset, ...]}
+
+    log_file/log_pos is the end of the last transaction written to origin.sql and origin_offset the size
+    origin.sql had right after it (origin_files: offset of the first byte of origin.sql, origin.sql.1, ...).
+    A checkpoint is only saved once origin.sql is on disk up to origin_offset, a resumed parse cuts origin.sql
+    back to origin_offset and reads on from log_file/log_pos, so no transaction is written twice or lost.
+    gtid, the last transaction written if the server logs gtids, is not used to resume: a checkpoint whose log_file
+    is purged is refused with the gtid in the error, to find the position again by hand.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, 'r') as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp_file = self.filename + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.filename)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+
+from .binlog2sql_rows import RowsBatch
+
+# estimated bytes of row state held before it is spilled to disk
+COMPACT_MEMORY_LIMIT = 256 * 1024 * 1024
+# net changes are written in transactions of this many rows, flashback_transaction wraps each of them
+COMPACT_TRANSACTION_ROWS = 1000
+# states of a run pickled together, a merge holds one such chunk of every run it reads
+COMPACT_MERGE_CHUNK = 1000
+# runs merged at once, more runs are merged into fewer first so a merge never holds more than this many chunks
+COMPACT_MERGE_FANIN = 32
+# estimated bytes of a state besides its images
+STATE_OVERHEAD = 200
+
+# a state is a list: [columns of first, first image, columns of last, last image, start_pos of the first change,
+# sequence number of the first change, log_pos and timestamp of the last change, table_id, primary_key].
+# An image of None means the row did not exist
+FIRST_COLUMNS, FIRST, LAST_COLUMNS, LAST, START_POS, SEQUENCE, LOG_POS, TIMESTAMP, TABLE_ID, PRIMARY_KEY = range(10)
+
+
+def image_size(values):
+    """rough bytes of a row image, strings and bytes by their length and everything else as 8"""
+    if values is None:
+        return 0
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in values)
+
+
+def state_size(state):
+    return STATE_OVERHEAD + image_size(state[FIRST]) + image_size(state[LAST])
+
+
+def run_key(item):
+    """order of the states of a spilled run, equal keys next to each other whatever the types of the key values"""
+    schema, table, key = item[0]
+    return schema, table, repr(key)
+
+
+def first_change(item):
+    return item[1][SEQUENCE]
+
+
+class RowCompactor(object):
+    """
+    Fold the row changes of tables with a primary key into their net effect per row: the image before the first
+    change and the image after the last one. INSERT and UPDATEs become one INSERT of the final image, an UPDATE
+    chain one UPDATE from the original to the final image, INSERT and DELETE nothing at all.
+    Beyond memory_limit the state is spilled to a run file in spill_dir, sorted by row. changes() merges the runs,
+    folds the states of each row and sorts them back into first change order in runs of memory_limit, so besides
+    memory_limit it holds at most COMPACT_MERGE_FANIN chunks of COMPACT_MERGE_CHUNK states. Net changes come out
+    in the order the rows were first changed, spilled or not.
+    """
+
+    def __init__(self, memory_limit=COMPACT_MEMORY_LIMIT, spill_dir=None):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        # (schema, table, primary key values) -> state, in the order rows were first changed
+        self.states = {}
+        self.size = 0
+        self.rows = 0
+        self.changes_written = 0
+        self.spills = 0
+        # rows first changed so far, the sequence number of the next one
+        self.sequence = 0
+        # run files written, spilled or merged
+        self.runs = 0
+        self._spill_path = None
+        self._spilled = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, rows_batch, e_start_pos):
+        """fold the rows of a batch of a table with a primary key, return the number of rows"""
+        rows = 0
+        indexes = rows_batch.key_indexes
+        schema, table = rows_batch.schema, rows_batch.table
+        for row in rows_batch.rows:
+            if rows_batch.sql_type == 'UPDATE':
+                before, after = row
+            elif rows_batch.sql_type == 'INSERT':
+                before, after = None, row
+            else:
+                before, after = row, None
+            before_key = tuple(before[i] for i in indexes) if before is not None else None
+            after_key = tuple(after[i] for i in indexes) if after is not None else None
+            if before_key is not None and after_key is not None and before_key != after_key:
+                # the primary key changed: the old row is gone and a new one appeared
+                self._fold((schema, table, before_key), rows_batch, before, None, e_start_pos)
+                self._fold((schema, table, after_key), rows_batch, None, after, e_start_pos)
+            else:
+                self._fold((schema, table, before_key or after_key), rows_batch, before, after, e_start_pos)
+            rows += 1
+        self.rows += rows
+        if self.memory_limit and self.size > self.memory_limit:
+            self.spill()
+        return rows
+
+    def _fold(self, key, rows_batch, before, after, e_start_pos):
+        state = self.states.get(key)
+        if state is None:
+            state = [rows_batch.columns, before, rows_batch.columns, after, e_start_pos, self.sequence,
+                     rows_batch.log_pos, rows_batch.timestamp, rows_batch.table_id, rows_batch.primary_key]
+            self.states[key] = state
+            self.sequence += 1
+            self.size += state_size(state)
+            return
+        self.size += image_size(after) - image_size(state[LAST])
+        state[LAST_COLUMNS], state[LAST] = rows_batch.columns, after
+        state[LOG_POS:] = [rows_batch.log_pos, rows_batch.timestamp, rows_batch.table_id, rows_batch.primary_key]
+
+    def spill(self):
+        """write the states held in memory to a new run, sorted by row"""
+        self._spilled.append(self._write_run(sorted(self.states.items(), key=run_key)))
+        self.states, self.size = {}, 0
+        self.spills += 1
+
+    def _write_run(self, items):
+        if self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix='binlog2sql-compact-', dir=self.spill_dir)
+        filename = os.path.join(self._spill_path, '%d.run' % self.runs)
+        self.runs += 1
+        with open(filename, 'wb') as f:
+            chunk = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= COMPACT_MERGE_CHUNK:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return filename
+
+    @staticmethod
+    def _read_run(filename):
+        with open(filename, 'rb') as f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    break
+                for item in chunk:
+                    yield item
+        os.remove(filename)
+
+    def _merge(self, runs, key):
+        """
+        the items of runs in key order, items of equal key in the order of their runs. Runs beyond
+        COMPACT_MERGE_FANIN are merged into one first, the earliest ones, so the order of equal keys is kept
+        """
+        runs = list(runs)
+        while len(runs) > COMPACT_MERGE_FANIN:
+            merged = heapq.merge(*[self._read_run(run) for run in runs[:COMPACT_MERGE_FANIN]], key=key)
+            runs[:COMPACT_MERGE_FANIN] = [self._write_run(merged)]
+        return heapq.merge(*[self._read_run(run) for run in runs], key=key)
+
+    @staticmethod
+    def _fold_runs(items):
+        """fold the states of a row, items of one row are next to each other and in the order they were spilled"""
+        folded = None
+        for key, state in items:
+            if folded is not None and folded[0] == key:
+                # the first change, and its sequence number, is the one folded already
+                folded[1][LAST_COLUMNS:LAST + 1] = state[LAST_COLUMNS:LAST + 1]
+                folded[1][LOG_POS:] = state[LOG_POS:]
+                continue
+            if folded is not None:
+                yield folded
+            folded = (key, state)
+        if folded is not None:
+            yield folded
+
+    def _sort_runs(self, items):
+        """write items to runs sorted by their first change, each of about memory_limit, return the runs"""
+        runs, buffered, size = [], [], 0
+        for item in items:
+            buffered.append(item)
+            size += state_size(item[1])
+            if size > self.memory_limit and len(buffered) >= COMPACT_MERGE_CHUNK:
+                runs.append(self._write_run(sorted(buffered, key=first_change)))
+                buffered, size = [], 0
+        if buffered:
+            runs.append(self._write_run(sorted(buffered, key=first_change)))
+        return runs
+
+    def changes(self):
+        """(RowsBatch of one row, e_start_pos) of every net change in first change order, unchanged rows skipped"""
+        if self._spill_path is None:
+            # in the order the rows were first changed already
+            states = self.states.items()
+        else:
+            if self.states:
+                self.spill()
+            folded = self._fold_runs(self._merge(self._spilled, key=run_key))
+            states = self._merge(self._sort_runs(folded), key=first_change)
+            self._spilled = []
+        for (schema, table, _), state in states:
+            for change in net_changes(schema, table, state):
+                self.changes_written += 1
+                yield change
+        self.states, self.size = {}, 0
+
+    def close(self):
+        if self._spill_path is not None:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+
+
+def net_changes(schema, table, state):
+    """the statements that take a row from the first image of a state to the last one"""
+    first_columns, first, last_columns, last = state[FIRST_COLUMNS:LAST + 1]
+
+    def change(sql_type, columns, row):
+        return (RowsBatch(schema, table, state[TABLE_ID], state[PRIMARY_KEY], state[TIMESTAMP], state[LOG_POS],
+                          sql_type, columns, [row]), state[START_POS])
+
+    if first is None and last is None:
+        return []
+    if first is None:
+        return [change('INSERT', last_columns, last)]
+    if last is None:
+        return [change('DELETE', first_columns, first)]
+    if first_columns != last_columns:
+        # a ddl changed the columns in between, one UPDATE can not have both
+        return [change('DELETE', first_columns, first), change('INSERT', last_columns, last)]
+    if first == last:
+        return []
+    return [change('UPDATE', last_columns, (first, last))]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base64
+import datetime
+import decimal
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .binlog2sql_util import json_value
+
+# output format: file name of the changes in output_path
+OUTPUT_FORMATS = {'sql': 'origin.sql', 'jsonl': 'origin.jsonl', 'msgpack': 'origin.msgpack'}
+# values written as they are, everything else goes through change_value
+PLAIN_TYPES = (int, float, str, bool, type(None))
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return {'base64': base64.b64encode(value).decode('ascii')}
+    return str(value)
+
+
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def change_value(value, binary=False):
+    """
+    A column value as json or msgpack can hold it. Bytes are text when they are utf-8, otherwise
+    {"base64": ...} in json, or kept as bytes (bin) with binary. Decimals, dates and times are their str,
+    a SET is a sorted list and a JSON column its document.
+    """
+    if type(value) in PLAIN_TYPES:
+        return value
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value if binary else {'base64': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (dict, list)):
+        return json_value(value)
+    if isinstance(value, set):
+        return sorted(value)
+    if isinstance(value, datetime.timedelta):
+        return time_value(value)
+    if isinstance(value, (decimal.Decimal, datetime.date, datetime.time)):
+        return str(value)
+    return value
+
+
+def time_value(value):
+    """a TIME column, read as a timedelta, as mysql writes it: -838:59:59.000000 to 838:59:59.000000"""
+    sign = '-' if value < datetime.timedelta(0) else ''
+    value = abs(value)
+    minutes, seconds = divmod(value.days * 86400 + value.seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    text = '%s%02d:%02d:%02d' % (sign, hours, minutes, seconds)
+    return text + '.%06d' % value.microseconds if value.microseconds else text
+
+
+def change_image(columns, values, binary=False):
+    return dict(zip(columns, [v if type(v) in PLAIN_TYPES else change_value(v, binary) for v in values]))
+
+
+def change_record(rows_batch, row, log_file, e_start_pos, binary=False):
+    """
+    One row change of a RowsBatch: type, schema, table, primary_key, the before image of an UPDATE or DELETE,
+    the after image of an INSERT or UPDATE, start_pos of its transaction and log_file:log_pos of its event.
+    """
+    before, after = None, None
+    if rows_batch.sql_type == 'UPDATE':
+        before = change_image(rows_batch.columns, row[0], binary)
+        after = change_image(rows_batch.columns, row[1], binary)
+    elif rows_batch.sql_type == 'INSERT':
+        after = change_image(rows_batch.columns, row, binary)
+    else:
+        before = change_image(rows_batch.columns, row, binary)
+    return {'type': rows_batch.sql_type, 'schema': rows_batch.schema, 'table': rows_batch.table,
+            'primary_key': list(rows_batch.key_columns), 'before': before, 'after': after,
+            'log_file': log_file, 'start_pos': e_start_pos, 'log_pos': rows_batch.log_pos,
+            'timestamp': rows_batch.timestamp}
+
+
+def query_record(binlog_event, log_file):
+    """a ddl QueryEvent, it has no images"""
+    schema = binlog_event.schema
+    return {'type': 'DDL', 'schema': schema.decode('utf-8') if isinstance(schema, bytes) else schema,
+            'query': binlog_event.query, 'log_file': log_file, 'log_pos': binlog_event.packet.log_pos,
+            'timestamp': binlog_event.timestamp}
+
+
+class EventWriter(object):
+    """
+    The output operations of process_binlog for structured output: every row change is one record, written as
+    a line of json (jsonl) or a msgpack object (msgpack, a stream msgpack.Unpacker reads one record at a time).
+    Rows are never rendered to sql. The console always gets json lines.
+    """
+
+    def __init__(self, f_origin, binlog_stream, output_format='jsonl', console=None, on_boundary=None):
+        """binlog_stream: records carry its log_file. on_boundary: called with every boundary"""
+        if output_format not in ('jsonl', 'msgpack'):
+            raise ValueError('unknown structured output format: %s' % output_format)
+        if output_format == 'msgpack' and msgpack is None:
+            raise ValueError('output_format msgpack needs the msgpack package')
+        self.f_origin, self.binlog_stream, self.console = f_origin, binlog_stream, console
+        self.on_boundary = on_boundary
+        self.output_format = output_format
+        self._packer = msgpack.Packer(use_bin_type=True) if output_format == 'msgpack' else None
+        # no flashback temp file, rollback is up to the consumer of the before images
+        self.trx_offsets = [0]
+        self.boundary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def write_record(self, record):
+        if self._packer:
+            self.f_origin.write(self._packer.pack(record))
+            if self.console:
+                self.console.write(JSONL_ENCODER.encode(record) + '\n')
+            return
+        line = JSONL_ENCODER.encode(record) + '\n'
+        self.f_origin.write(line)
+        if self.console:
+            self.console.write(line)
+
+    def write_query(self, binlog_event):
+        self.write_record(query_record(binlog_event, self.binlog_stream.log_file))
+
+    def render(self, rows_batch, e_start_pos):
+        binary, log_file = self._packer is not None, self.binlog_stream.log_file
+        for row in rows_batch.rows:
+            self.write_record(change_record(rows_batch, row, log_file, e_start_pos, binary))
+
+    def stream(self, rows_batch, e_start_pos):
+        """write the rows of a batch read lazily, one record at a time. Return the number of rows"""
+        binary, log_file = self._packer is not None, self.binlog_stream.log_file
+        rows = 0
+        for row in rows_batch.rows:
+            self.write_record(change_record(rows_batch, row, log_file, e_start_pos, binary))
+            rows += 1
+        return rows
+
+    def flush_batch(self):
+        pass
+
+    def mark_transaction(self):
+        pass
+
+    def mark_boundary(self, log_file, log_pos, gtid=None):
+        """log_file:log_pos is the end of a transaction, the output is complete up to here"""
+        self.boundary = (log_file, log_pos, self.f_origin.tell(), gtid)
+        if self.console:
+            self.console.flush()
+        if self.on_boundary:
+            self.on_boundary(self.boundary)
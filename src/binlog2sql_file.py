@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import mmap
+import os
+import re
+import struct
+
+import pymysql
+from pymysqlreplication.constants.BINLOG import FORMAT_DESCRIPTION_EVENT, ROTATE_EVENT, TABLE_MAP_EVENT
+from pymysqlreplication.event import (
+    QueryEvent, RotateEvent, StopEvent, FormatDescriptionEvent, XidEvent, GtidEvent,
+    BeginLoadQueryEvent, ExecuteLoadQueryEvent, HeartbeatLogEvent
+)
+from pymysqlreplication.packet import BinLogPacketWrapper
+from pymysqlreplication.row_event import RowsEvent, WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, TableMapEvent
+
+from .binlog2sql_schema import SchemaCache
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER_SIZE = 19
+# first mysql version writing binlog checksum algorithm in format description event
+CHECKSUM_VERSION = (5, 6, 1)
+BINLOG_CHECKSUM_ALG_OFF = 0
+BINLOG_CHECKSUM_SIZE = 4
+# rows events start with the 6 byte id of their table map
+TABLE_ID_SIZE = 6
+EVENT_CLASSES = BinLogPacketWrapper._BinLogPacketWrapper__event_map
+
+DEFAULT_EVENTS = frozenset((
+    QueryEvent, RotateEvent, StopEvent, FormatDescriptionEvent, XidEvent, GtidEvent,
+    BeginLoadQueryEvent, ExecuteLoadQueryEvent, UpdateRowsEvent, WriteRowsEvent, DeleteRowsEvent,
+    TableMapEvent, HeartbeatLogEvent,
+))
+
+
+def list_binlog_files(binlog_dir, sample_file):
+    """binlog files in binlog_dir with the same basename as sample_file, e.g. mysql-bin.000001"""
+    basename = sample_file.split('.')[0]
+    pattern = re.compile(r'^%s\.\d+$' % re.escape(basename))
+    return sorted(f for f in os.listdir(binlog_dir) if pattern.match(f))
+
+
+def dump_schema_snapshot(connection_settings, filename, only_schemas=None):
+    """save column metadata of a live server to filename, so binlog files can be parsed offline later"""
+    connection = pymysql.connect(**connection_settings)
+    try:
+        snapshot = read_schema_snapshot(connection, only_schemas=only_schemas)
+    finally:
+        connection.close()
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=1)
+    return snapshot
+
+
+def read_schema_snapshot(connection, only_schemas=None):
+    """column metadata of every table of a live server in one query, {'schema.table': [column, ...]}"""
+    sql = """
+        SELECT
+            TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, COLLATION_NAME, CHARACTER_SET_NAME,
+            COLUMN_COMMENT, COLUMN_TYPE, COLUMN_KEY
+        FROM
+            information_schema.columns
+        WHERE
+            TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys')
+        ORDER BY
+            TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+    """
+    snapshot = {}
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(sql)
+        for column in cursor.fetchall():
+            if only_schemas and column['TABLE_SCHEMA'] not in only_schemas:
+                continue
+            key = '%s.%s' % (column.pop('TABLE_SCHEMA'), column.pop('TABLE_NAME'))
+            snapshot.setdefault(key, []).append(column)
+    finally:
+        cursor.close()
+    return snapshot
+
+
+def read_table_columns(connection, schema, table):
+    """column metadata of one table of a live server, None if it does not exist"""
+    sql = """
+        SELECT
+            COLUMN_NAME, COLLATION_NAME, CHARACTER_SET_NAME, COLUMN_COMMENT, COLUMN_TYPE, COLUMN_KEY
+        FROM
+            information_schema.columns
+        WHERE
+            TABLE_SCHEMA = %s AND TABLE_NAME = %s
+        ORDER BY
+            ORDINAL_POSITION
+    """
+    connection.ping(reconnect=True)
+    cursor = connection.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(sql, (schema, table))
+        return list(cursor.fetchall()) or None
+    finally:
+        cursor.close()
+
+
+def load_schema_snapshot(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class _EventPacket(object):
+    """In-memory stand-in for the pymysql packet BinLogPacketWrapper reads an event from"""
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read(self, size):
+        start = self._position
+        self._position += size
+        return self._data[start:self._position]
+
+    def advance(self, size):
+        self._position += size
+
+
+class _SnapshotConnection(object):
+    """Plays the ctl_connection of BinLogStreamReader, table metadata comes from a SchemaCache at the reader position"""
+
+    def __init__(self, schema_cache, reader, charset='utf8'):
+        self.charset = charset
+        self.schema_cache = schema_cache
+        self.reader = reader
+
+    def _get_table_information(self, schema, table):
+        columns = self.schema_cache.columns(schema, table, self.reader.log_file, self.reader.log_pos)
+        if columns is None:
+            raise ValueError('table %s.%s not found in schema snapshot' % (schema, table))
+        return columns
+
+
+class BinLogFileReader(object):
+    """
+    Read events from local binlog files, a drop-in replacement of BinLogStreamReader
+    that needs no mysql server: table metadata is taken from a schema snapshot or a SchemaCache.
+    """
+
+    def __init__(self, binlog_dir, log_files, schema_snapshot, log_pos=4, charset='utf8',
+                 only_events=None, only_schemas=None, only_tables=None, ignored_schemas=None, ignored_tables=None):
+        self.binlog_dir = binlog_dir
+        self.log_files = list(log_files)
+        self.log_file = self.log_files[0] if self.log_files else None
+        self.log_pos = log_pos
+        self._reset_table_map()
+
+        if not isinstance(schema_snapshot, SchemaCache):
+            schema_snapshot = SchemaCache.from_snapshot(schema_snapshot, charset=charset)
+        self._ctl_connection = _SnapshotConnection(schema_snapshot, self, charset=charset)
+        self._allowed_events = frozenset(only_events) if only_events is not None else DEFAULT_EVENTS
+        self._allowed_events_in_packet = self._allowed_events.union((TableMapEvent, RotateEvent))
+        # type codes looked up in the raw header, so unwanted events are skipped without being decoded
+        self._allowed_types = frozenset(code for code, event_class in EVENT_CLASSES.items()
+                                        if event_class in self._allowed_events_in_packet)
+        self._rows_types = frozenset(code for code, event_class in EVENT_CLASSES.items()
+                                     if issubclass(event_class, RowsEvent))
+        self._only_schemas, self._only_tables = only_schemas, only_tables
+        self._ignored_schemas, self._ignored_tables = ignored_schemas, ignored_tables
+        self._events = None
+
+    def __iter__(self):
+        self._events = self._read_events()
+        return self._events
+
+    def close(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+    def forget_table(self, schema, table):
+        """drop the table map of schema.table, its next rows are decoded with the columns in the cache"""
+        for table_id, table_map in list(self.table_map.items()):
+            if table_map.schema == schema and table_map.table == table:
+                del self.table_map[table_id]
+                self._map_bodies.pop(table_id, None)
+
+    def _read_events(self):
+        for i, log_file in enumerate(self.log_files):
+            self.log_file = log_file
+            self._reset_table_map()
+            start_pos = self.log_pos if i == 0 else 4
+            for binlog_event in self._read_file(os.path.join(self.binlog_dir, log_file), start_pos):
+                yield binlog_event
+
+    def _reset_table_map(self):
+        self.table_map = {}
+        # table map events not decoded yet: table_id -> (pos, event_size, next_pos)
+        self._pending_maps = {}
+        # raw body of the table map event every entry of table_map was decoded from
+        self._map_bodies = {}
+
+    def _read_file(self, filename, start_pos):
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= len(BINLOG_MAGIC):
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if buf[:len(BINLOG_MAGIC)] != BINLOG_MAGIC:
+                    raise ValueError('%s is not a binlog file' % filename)
+                pos, use_checksum = len(BINLOG_MAGIC), False
+                while pos + EVENT_HEADER_SIZE <= len(buf):
+                    event_type = buf[pos + 4]
+                    event_size, next_pos = struct.unpack_from('<II', buf, pos + 9)
+                    if pos + event_size > len(buf):
+                        # partially written event at the end of an active binlog
+                        break
+                    if event_type == FORMAT_DESCRIPTION_EVENT:
+                        use_checksum = self._checksum_enabled(buf, pos, event_size)
+                    elif pos < start_pos:
+                        pos += event_size
+                        continue
+                    elif event_type == TABLE_MAP_EVENT:
+                        # decoded only once rows of a wanted type refer to it
+                        self._pending_maps[self._table_id(buf, pos)] = (pos, event_size, next_pos)
+                        pos += event_size
+                        self.log_pos = next_pos if next_pos else pos
+                        continue
+                    elif event_type not in self._allowed_types:
+                        pos += event_size
+                        self.log_pos = next_pos if next_pos else pos
+                        continue
+                    elif event_type in self._rows_types:
+                        table_id = self._table_id(buf, pos)
+                        if table_id in self._pending_maps:
+                            table_map_event = self._decode_table_map(buf, table_id, use_checksum)
+                            if table_map_event is not None:
+                                yield table_map_event
+                        if table_id not in self.table_map:
+                            # rows of a table whose table map was filtered out
+                            pos += event_size
+                            self.log_pos = next_pos if next_pos else pos
+                            continue
+
+                    binlog_event = self._decode(buf, pos, event_size, use_checksum)
+                    pos += event_size
+                    self.log_pos = next_pos if next_pos else pos
+                    if binlog_event.event_type == ROTATE_EVENT:
+                        self._reset_table_map()
+
+                    if binlog_event.event is None or binlog_event.event.__class__ not in self._allowed_events:
+                        continue
+                    yield binlog_event.event
+            finally:
+                buf.close()
+
+    def _decode(self, buf, pos, event_size, use_checksum):
+        # BinLogPacketWrapper expects the OK byte that leads every replication packet
+        packet = _EventPacket(b'\x00' + buf[pos:pos + event_size])
+        return BinLogPacketWrapper(packet, self.table_map, self._ctl_connection, use_checksum,
+                                   self._allowed_events_in_packet,
+                                   self._only_tables, self._ignored_tables,
+                                   self._only_schemas, self._ignored_schemas,
+                                   False, False)
+
+    def _decode_table_map(self, buf, table_id, use_checksum):
+        """
+        Decode the pending table map of table_id into table_map, return the event if it is to be yielded.
+        A table map identical to the one in use is not decoded again.
+        """
+        pos, event_size, next_pos = self._pending_maps.pop(table_id)
+        # the checksum covers the header with its position, compare the body without it
+        body = buf[pos + EVENT_HEADER_SIZE:pos + event_size - (BINLOG_CHECKSUM_SIZE if use_checksum else 0)]
+        if table_id in self.table_map and self._map_bodies.get(table_id) == body:
+            return None
+        self.table_map.pop(table_id, None)
+        self._map_bodies.pop(table_id, None)
+        binlog_event = self._decode(buf, pos, event_size, use_checksum)
+        self.log_pos = next_pos if next_pos else pos + event_size
+        if binlog_event.event is None:
+            return None
+        self.table_map[table_id] = binlog_event.event.get_table()
+        self._map_bodies[table_id] = body
+        return binlog_event.event if TableMapEvent in self._allowed_events else None
+
+    @staticmethod
+    def _table_id(buf, pos):
+        return int.from_bytes(buf[pos + EVENT_HEADER_SIZE:pos + EVENT_HEADER_SIZE + TABLE_ID_SIZE], 'little')
+
+    @staticmethod
+    def _checksum_enabled(buf, pos, event_size):
+        """the checksum algorithm is the byte before the 4 checksum bytes of a format description event"""
+        server_version = buf[pos + EVENT_HEADER_SIZE + 2:pos + EVENT_HEADER_SIZE + 52].split(b'\x00')[0].decode()
+        version = tuple(int(v) for v in re.findall(r'\d+', server_version)[:3])
+        if version < CHECKSUM_VERSION:
+            return False
+        return buf[pos + event_size - 5] != BINLOG_CHECKSUM_ALG_OFF
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+import os
+import re
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .binlog2sql import Binlog2sql
+from .binlog2sql_file import list_binlog_files
+from .binlog2sql_metrics import COUNTERS
+from .binlog2sql_pool import ConnectionPool
+
+# binlog files parsed at the same time across all servers
+FLEET_CONCURRENCY = 4
+# keys of a server entry that are connection settings, every other key is a Binlog2sql argument of that server
+CONNECTION_KEYS = ('host', 'port', 'user', 'passwd', 'password', 'charset', 'unix_socket', 'ssl',
+                   'connect_timeout', 'read_timeout', 'write_timeout')
+# Binlog2sql arguments the fleet sets itself
+FLEET_OPTIONS = ('workers', 'output_path', 'output_console', 'connection', 'stream_server_id')
+# Binlog2sql arguments naming files of one server, shared ones get a path of their own per server
+SERVER_PATH_OPTIONS = ('index_dir', 'schema_cache_file')
+
+
+def load_servers(filename):
+    """
+    server entries of a json file, a list of objects like
+    {"name": "shard01", "host": "10.0.0.1", "port": 3306, "user": "root", "password": "...",
+     "start_file": "mysql-bin.000120", "stop_file": "mysql-bin.000123"}
+    """
+    with open(filename) as f:
+        servers = json.load(f)
+    if not isinstance(servers, list):
+        raise ValueError('%s must hold a list of servers' % filename)
+    return servers
+
+
+def server_name(server):
+    return str(server.get('name') or '%s_%s' % (server.get('host', '127.0.0.1'), server.get('port', 3306)))
+
+
+def split_server(server, defaults=None):
+    """(name, connection settings, Binlog2sql arguments) of a server entry, missing settings taken from defaults"""
+    entry = dict(defaults) if defaults else {}
+    entry.update(server)
+    conn_setting, options = {}, {}
+    for key, value in entry.items():
+        if key == 'name':
+            continue
+        if key in CONNECTION_KEYS:
+            conn_setting['passwd' if key == 'password' else key] = value
+        else:
+            options[key] = value
+    conn_setting.setdefault('charset', 'utf8')
+    return server_name(entry), conn_setting, options
+
+
+def server_path(path, name, option):
+    """path of a shared index_dir or schema_cache_file for one server: index_dir/<name>, schema_cache.<name>.json"""
+    if option == 'index_dir':
+        return os.path.join(path, name)
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, name, ext)
+
+
+def binlog_range(conn_setting, options, connection=None):
+    """
+    (first, last) binlog file of a server, from SHOW MASTER LOGS or the files in binlog_dir. In binlog_dir those
+    are the files with the basename of stop_file, or of the only binlog basename there without stop_file
+    """
+    if options.get('binlog_dir'):
+        if options.get('stop_file'):
+            files = list_binlog_files(options['binlog_dir'], os.path.basename(options['stop_file']))
+        else:
+            pattern = re.compile(r'^[^.]+\.\d+$')
+            files = sorted(f for f in os.listdir(options['binlog_dir']) if pattern.match(f))
+            basenames = sorted(set(f.split('.')[0] for f in files))
+            if len(basenames) > 1:
+                raise ValueError('binlog files of several basenames in %s: %s, set start_file or stop_file' % (
+                    options['binlog_dir'], ', '.join(basenames)))
+    else:
+        with connection as cursor:
+            cursor.execute("SHOW MASTER LOGS")
+            files = [row[0] for row in cursor.fetchall()]
+    if not files:
+        raise ValueError('no binlog files on %s' % (options.get('binlog_dir') or conn_setting.get('host')))
+    return files[0], files[-1]
+
+
+_worker = {}
+
+
+def _init_worker():
+    _worker['pool'] = ConnectionPool()
+
+
+def _run_task(item):
+    """parse one binlog file of one server, errors are returned rather than raised so the other servers go on"""
+    name, task = item
+    pool = _worker['pool']
+    start = time.time()
+    try:
+        if task.get('binlog_dir'):
+            summary = _process(task)
+        else:
+            with pool.connection(task['connection_settings']) as connection:
+                summary = _process(task, connection)
+        error = None
+    except Exception as e:
+        summary = {'seconds': round(time.time() - start, 3)}
+        error = '%s: %s' % (task['start_file'], ''.join(traceback.format_exception_only(type(e), e)).strip())
+    return name, task['start_file'], summary, error, (os.getpid(), pool.created, pool.reused)
+
+
+def _process(task, connection=None):
+    binlog2sql = Binlog2sql(connection=connection, **task)
+    binlog2sql.process_binlog()
+    return binlog2sql.summary()
+
+
+class Fleet(object):
+    """
+    The same extraction run on many servers at once. Every binlog file of every server is a task, at most
+    concurrency of them run at a time, taken from the servers in turn. Each server gets its own
+    output_path/<name>/origin.sql and rollback.sql, output_path/summary.json sums up the run. A shared index_dir or
+    schema_cache_file becomes one per server.
+    Metadata connections are pooled: one pool plans all servers, every worker process keeps its own.
+    """
+
+    def __init__(self, servers, output_path, concurrency=FLEET_CONCURRENCY, server_defaults=None, **options):
+        """
+        servers: server entries, connection settings and per-server Binlog2sql arguments like start_file
+        server_defaults: settings of every server entry that does not set them, e.g. user and password
+        options: Binlog2sql arguments shared by every server, e.g. start_time, stop_time and flashback
+        """
+        if not servers:
+            raise ValueError('Lack of parameter: servers')
+        if not output_path:
+            raise ValueError('Lack of parameter: output_path')
+        if options.get('stop_never'):
+            raise ValueError('stop_never can not be used with servers')
+        if options.get('checkpoint_file'):
+            raise ValueError('checkpoint_file can not be used with servers')
+        if options.get('apply_rollback'):
+            raise ValueError('apply_rollback can not be used with servers')
+        self.servers = [split_server(server, server_defaults) for server in servers]
+        names = [name for name, _, _ in self.servers]
+        if len(set(names)) != len(names):
+            raise ValueError('server names must be unique: %s' % ', '.join(names))
+        self.output_path = output_path
+        self.concurrency = concurrency if concurrency else FLEET_CONCURRENCY
+        self.options = {k: v for k, v in options.items() if k not in FLEET_OPTIONS}
+        self.pool = ConnectionPool()
+
+    def plan(self, name, conn_setting, options):
+        """the Binlog2sql of a server, it only lists files here, and its file tasks"""
+        kwargs = dict(self.options)
+        for option in SERVER_PATH_OPTIONS:
+            if kwargs.get(option):
+                kwargs[option] = server_path(kwargs[option], name, option)
+        kwargs.update(options)
+        kwargs.update(output_path=os.path.join(self.output_path, name), output_console=False)
+        if kwargs.get('binlog_dir'):
+            if not kwargs.get('start_file'):
+                kwargs['start_file'], last_file = binlog_range(conn_setting, kwargs)
+                kwargs['stop_file'] = kwargs.get('stop_file') or last_file
+            binlog2sql = Binlog2sql(conn_setting, **kwargs)
+        else:
+            with self.pool.connection(conn_setting) as connection:
+                if not kwargs.get('start_file'):
+                    kwargs['start_file'], last_file = binlog_range(conn_setting, kwargs, connection)
+                    kwargs['stop_file'] = kwargs.get('stop_file') or last_file
+                binlog2sql = Binlog2sql(conn_setting, connection=connection, **kwargs)
+            # back in the pool, the planner only merges from now on
+            binlog2sql.connection = None
+        tasks = binlog2sql.file_tasks()
+        for task in tasks:
+            task['render_workers'] = binlog2sql.render_workers
+        if len(tasks) == 1:
+            # nothing to merge, the only task writes the final files itself
+            tasks[0].update(output_path=binlog2sql.output_path, output_compress=binlog2sql.output_compress,
+                            output_rotate_size=binlog2sql.output_rotate_size)
+        return binlog2sql, tasks
+
+    def run(self):
+        """parse every server, then return the summary also written to output_path/summary.json"""
+        start = time.time()
+        results = OrderedDict()
+        planned = OrderedDict()
+        for name, conn_setting, options in self.servers:
+            results[name] = OrderedDict([('status', 'ok'), ('errors', []), ('files', 0)] +
+                                        [(counter, 0) for counter in COUNTERS] + [('seconds', 0.0)])
+            try:
+                planned[name] = self.plan(name, conn_setting, options)
+            except Exception as e:
+                results[name]['status'] = 'failed'
+                results[name]['errors'].append(''.join(traceback.format_exception_only(type(e), e)).strip())
+        self.pool.close()
+
+        worker_pools = {}
+        # (server, binlog file) -> (summary, error) of its last parse
+        file_results = {}
+        pending = OrderedDict((name, tasks) for name, (_, tasks) in planned.items())
+        if pending:
+            # the workers of an executor may start processes of their own, the renderers of render_workers
+            pool = ProcessPoolExecutor(max_workers=self.concurrency, initializer=_init_worker)
+            try:
+                while pending:
+                    # servers in turn, so a server with many files does not hold every slot
+                    queued = [item for items in itertools.zip_longest(
+                        *[[(name, task) for task in tasks] for name, tasks in pending.items()]) for item in items
+                        if item]
+                    for future in as_completed([pool.submit(_run_task, item) for item in queued]):
+                        name, start_file, summary, error, worker_pool = future.result()
+                        file_results[(name, start_file)] = (summary, error)
+                        worker_pools[worker_pool[0]] = worker_pool[1:]
+                    pending = OrderedDict()
+                    for name, (binlog2sql, tasks) in planned.items():
+                        if not any(file_results[(name, task['start_file'])][1] for task in tasks):
+                            # files parsed before the ddl of an earlier file was known
+                            stale = binlog2sql.merge_schema_parts(tasks)
+                            if stale:
+                                pending[name] = stale
+            finally:
+                pool.shutdown()
+
+        for name, (_, tasks) in planned.items():
+            result = results[name]
+            for task in tasks:
+                summary, error = file_results[(name, task['start_file'])]
+                result['files'] += 1
+                for key in list(COUNTERS) + ['seconds']:
+                    result[key] += summary.get(key, 0)
+                if error:
+                    result['status'] = 'failed'
+                    result['errors'].append(error)
+
+        for name, (binlog2sql, tasks) in planned.items():
+            if results[name]['status'] != 'ok':
+                # the parts of the files that did parse are kept for a look
+                continue
+            if len(tasks) > 1:
+                binlog2sql.merge_parts([task['output_path'] for task in tasks])
+            results[name]['seconds'] = round(results[name]['seconds'], 3)
+
+        summary = OrderedDict([
+            ('servers', results),
+            ('totals', OrderedDict([('servers', len(results)),
+                                    ('failed', sum(1 for r in results.values() if r['status'] != 'ok'))] +
+                                   [(counter, sum(r[counter] for r in results.values())) for counter in COUNTERS])),
+            ('concurrency', self.concurrency),
+            ('connections', OrderedDict([
+                ('created', self.pool.created + sum(created for created, _ in worker_pools.values())),
+                ('reused', self.pool.reused + sum(reused for _, reused in worker_pools.values()))])),
+            ('seconds', round(time.time() - start, 3)),
+        ])
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        with open(os.path.join(self.output_path, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def format_summary(summary):
+    """summary of Fleet.run as a table, one line per server"""
+    lines = ['%-24s %-7s %5s %10s %10s %12s %9s' % ('server', 'status', 'files', 'events', 'rows', 'written MB',
+                                                   'seconds')]
+    for name, result in summary['servers'].items():
+        lines.append('%-24s %-7s %5d %10d %10d %12.1f %9.1f' % (
+            name, result['status'], result['files'], result['events'], result['rows'],
+            result['bytes_written'] / 1024.0 / 1024.0, result['seconds']))
+        lines.extend('    %s' % error for error in result['errors'])
+    totals = summary['totals']
+    lines.append('%d servers, %d failed, %d rows, %.1fs with concurrency %d, connections %d created %d reused' % (
+        totals['servers'], totals['failed'], totals['rows'], summary['seconds'], summary['concurrency'],
+        summary['connections']['created'], summary['connections']['reused']))
+    return '\n'.join(lines)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import json
+import os
+
+from pymysqlreplication.event import QueryEvent, RotateEvent
+
+# distance in bytes between two sampled positions of a binlog file
+INDEX_SAMPLE_BYTES = 1024 * 1024
+
+
+class BinlogIndex(object):
+    """
+    Sidecar time index of binlog files, one json file per binlog in index_dir:
+    {"first_time": ts, "last_time": ts, "max_time": ts, "complete": bool, "samples": [[max_time_before, pos], ...]}
+
+    A sample is the start position of a transaction together with the max timestamp of all events before it,
+    so every event skipped by seeking to that position is older than the time we are looking for.
+    The index is filled while process_binlog reads the files from position 4, rotated files a parse did not read
+    whole are indexed by build afterwards.
+    """
+
+    def __init__(self, index_dir, sample_bytes=INDEX_SAMPLE_BYTES):
+        self.index_dir = index_dir
+        self.sample_bytes = sample_bytes
+        self._entries = {}
+        self._building = {}
+        self._current = None
+
+    def _filename(self, log_file):
+        return os.path.join(self.index_dir, '%s.idx' % log_file)
+
+    def get(self, log_file):
+        if log_file not in self._entries:
+            entry = None
+            if os.path.exists(self._filename(log_file)):
+                with open(self._filename(log_file), 'r') as f:
+                    entry = json.load(f)
+            self._entries[log_file] = entry
+        return self._entries[log_file]
+
+    def plan(self, binlog_list, start_pos, start_time, stop_time):
+        """
+        Narrow binlog_list to the files that may hold events in [start_time, stop_time),
+        return (binlog_list, start_pos) where start_pos may be moved forward inside the first file.
+        """
+        files = list(binlog_list)
+        while len(files) > 1:
+            entry = self.get(files[0])
+            if not (entry and entry['complete'] and entry['max_time'] < start_time):
+                break
+            files.pop(0)
+            start_pos = 4
+        while len(files) > 1:
+            entry = self.get(files[-1])
+            if not (entry and entry['first_time'] is not None and entry['first_time'] >= stop_time):
+                break
+            files.pop()
+
+        entry = self.get(files[0]) if files else None
+        if entry and entry['samples']:
+            times = [sample[0] for sample in entry['samples']]
+            i = bisect.bisect_left(times, start_time)
+            if i > 0 and entry['samples'][i - 1][1] > start_pos:
+                start_pos = entry['samples'][i - 1][1]
+        return files, start_pos
+
+    def unbuilt(self, binlog_list, eof_file):
+        """the rotated files of binlog_list without a complete index"""
+        return [log_file for log_file in binlog_list
+                if log_file != eof_file and not (self.get(log_file) and self.get(log_file)['complete'])]
+
+    def build(self, log_file, stream):
+        """index log_file whole, stream yields its query, xid and rotate events from position 4"""
+        self.start(log_file, 4)
+        for binlog_event in stream:
+            self.observe(binlog_event)
+            if self._current != log_file:
+                break
+        self.save()
+
+    def start(self, log_file, log_pos):
+        self._current = log_file
+        if log_pos <= 4:
+            self._building[log_file] = {'first_time': None, 'last_time': None, 'max_time': 0,
+                                        'complete': False, 'samples': []}
+
+    def observe(self, binlog_event):
+        """feed every event read from the stream, in order"""
+        if isinstance(binlog_event, RotateEvent):
+            if binlog_event.timestamp and self._current in self._building:
+                # a real rotate event closes the current file, the fake one only names the next file
+                self._building[self._current]['complete'] = True
+            if binlog_event.next_binlog != self._current:
+                self.start(binlog_event.next_binlog, binlog_event.position)
+            return
+
+        entry = self._building.get(self._current)
+        if entry is None or not binlog_event.timestamp:
+            return
+        if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
+            pos = binlog_event.packet.log_pos - binlog_event.packet.event_size
+            last_pos = entry['samples'][-1][1] if entry['samples'] else 0
+            if entry['first_time'] is not None and pos - last_pos >= self.sample_bytes:
+                entry['samples'].append([entry['max_time'], pos])
+        if entry['first_time'] is None:
+            entry['first_time'] = binlog_event.timestamp
+        entry['last_time'] = binlog_event.timestamp
+        entry['max_time'] = max(entry['max_time'], binlog_event.timestamp)
+
+    def save(self):
+        """write entries built by observe, a complete index on disk is never replaced by a partial one"""
+        if not os.path.exists(self.index_dir):
+            os.makedirs(self.index_dir)
+        for log_file, entry in self._building.items():
+            if entry['first_time'] is None:
+                continue
+            old = self.get(log_file)
+            if old and old['first_time'] == entry['first_time'] and \
+                    (old['complete'] or old['last_time'] >= entry['last_time']) and not entry['complete']:
+                continue
+            tmp_file = self._filename(log_file) + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, self._filename(log_file))
+            self._entries[log_file] = entry
+        self._building = {}
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import cProfile
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# events: read from the stream, events_skipped: dropped by the time filter, rows: rendered to sql,
+# bytes_written: sql written to origin.sql, rollback_bytes: part of the flashback temp file already reversed
+COUNTERS = ('events', 'events_skipped', 'rows', 'bytes_written', 'rollback_bytes')
+# decode: waiting for the stream to read and decode the next event, render: rows to sql,
+# reverse: the flashback phase
+STAGES = ('decode', 'render', 'reverse')
+# address MetricsServer listens on, the metrics are only served to the host itself unless another one is given
+METRICS_HOST = '127.0.0.1'
+
+
+class Metrics(object):
+    """
+    Counters and stage timers of a process_binlog run, reported as progress lines every progress_interval seconds
+    and served in prometheus text format by MetricsServer.
+    """
+
+    def __init__(self, progress_interval=0, binlog_sizes=None, eof_file=None, eof_pos=None, out=None):
+        """binlog_sizes: {log_file: size} of the files up to eof_file, in order, used for the lag"""
+        self.counters = OrderedDict((name, 0) for name in COUNTERS)
+        self.seconds = OrderedDict((stage, 0.0) for stage in STAGES)
+        self.progress_interval = progress_interval
+        self.binlog_sizes = binlog_sizes if binlog_sizes else OrderedDict()
+        self.eof_file, self.eof_pos = eof_file, eof_pos
+        self.log_file, self.log_pos = None, 0
+        self.rollback_total = 0
+        # the origin.sql writer, bytes_written is sampled from it
+        self.writer = None
+        self.out = out if out else sys.stderr
+        self.started = time.time()
+        self._next_report = self.started + progress_interval
+
+    def watch(self, stream):
+        """iterate stream, timing the wait for every event and keeping the position up to date"""
+        events = iter(stream)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                binlog_event = next(events)
+            except StopIteration:
+                return
+            self.seconds['decode'] += clock() - start
+            self.counters['events'] += 1
+            self.log_file, self.log_pos = stream.log_file, stream.log_pos
+            if self.progress_interval and time.time() >= self._next_report:
+                self.report()
+            yield binlog_event
+
+    @property
+    def lag_bytes(self):
+        """bytes between the current position and eof_file/eof_pos, None if unknown"""
+        if self.log_file is None or self.eof_file is None:
+            return None
+        if self.log_file == self.eof_file:
+            return max(self.eof_pos - self.log_pos, 0)
+        if self.log_file not in self.binlog_sizes:
+            return None
+        lag, behind = 0, False
+        for log_file, size in self.binlog_sizes.items():
+            if log_file == self.log_file:
+                lag, behind = max(size - self.log_pos, 0), True
+            elif log_file == self.eof_file:
+                return lag + self.eof_pos
+            elif behind:
+                lag += size
+        return lag
+
+    def sample(self):
+        if self.writer is not None:
+            self.counters['bytes_written'] = self.writer.tell()
+
+    def tick(self):
+        """report if the progress interval is over, for loops without a stream"""
+        if self.progress_interval and time.time() >= self._next_report:
+            self.report()
+
+    def report(self):
+        self.sample()
+        self._next_report = time.time() + self.progress_interval
+        self.out.write(self.progress_line() + '\n')
+        self.out.flush()
+
+    def progress_line(self):
+        counters, lag = self.counters, self.lag_bytes
+        line = '[binlog2sql] %s:%s lag %s events %d (skipped %d) rows %d written %.1f MB' % (
+            self.log_file, self.log_pos, '%.1f MB' % (lag / 1024.0 / 1024.0) if lag is not None else '-',
+            counters['events'], counters['events_skipped'], counters['rows'],
+            counters['bytes_written'] / 1024.0 / 1024.0)
+        if self.rollback_total:
+            line += ' rollback %.0f%%' % (100.0 * counters['rollback_bytes'] / self.rollback_total)
+        line += ' | %s elapsed %.1fs' % (' '.join('%s %.1fs' % item for item in self.seconds.items()),
+                                          time.time() - self.started)
+        return line
+
+    def prometheus_text(self):
+        self.sample()
+        lines = []
+        for name, value in self.counters.items():
+            lines.append('# TYPE binlog2sql_%s_total counter' % name)
+            lines.append('binlog2sql_%s_total %d' % (name, value))
+        lines.append('# TYPE binlog2sql_stage_seconds_total counter')
+        for stage, value in self.seconds.items():
+            lines.append('binlog2sql_stage_seconds_total{stage="%s"} %.6f' % (stage, value))
+        lines.append('# TYPE binlog2sql_log_pos gauge')
+        lines.append('binlog2sql_log_pos{log_file="%s"} %d' % (self.log_file or '', self.log_pos))
+        lag = self.lag_bytes
+        if lag is not None:
+            lines.append('# TYPE binlog2sql_lag_bytes gauge')
+            lines.append('binlog2sql_lag_bytes %d' % lag)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """serve metrics.prometheus_text() on http://host:port/metrics from a daemon thread"""
+
+    def __init__(self, metrics, port, host=METRICS_HOST):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='binlog2sql-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@contextmanager
+def profiled(filename=None):
+    """run the block under cProfile and dump the stats to filename, a no-op without filename"""
+    if not filename:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(filename)
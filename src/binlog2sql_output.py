@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import gzip
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# bytes collected on the decode thread before they are handed to the writer thread
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+# console output is for people watching the run, hand it over in small pieces
+CONSOLE_BUFFER_SIZE = 64 * 1024
+# max buffers waiting for the writer thread, decoding blocks beyond that so memory stays bounded
+OUTPUT_QUEUE_SIZE = 16
+# seconds a buffer waits at most, the writer thread takes it over once the queue is idle that long
+OUTPUT_FLUSH_INTERVAL = 1.0
+
+COMPRESS_SUFFIX = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+class AsyncWriter(object):
+    """
+    Write sql text from a background thread: write() only appends to a buffer, full buffers go through
+    a bounded queue to the writer thread which compresses, rotates and writes them to disk (or to a console stream).
+    A buffer that does not fill up is taken over by the writer thread after flush_interval seconds.
+    """
+
+    def __init__(self, filename=None, stream=None, compress=None, rotate_size=0,
+                 buffer_size=OUTPUT_BUFFER_SIZE, queue_size=OUTPUT_QUEUE_SIZE, resume=None,
+                 flush_interval=OUTPUT_FLUSH_INTERVAL):
+        """
+        resume: (offset, file_starts) saved from tell() and file_starts of an earlier run, the output is cut back
+        to offset and continued from there, so whatever was written after offset is written only once.
+        flush_interval: seconds the queue stays idle before the buffer is written anyway, 0 waits for a full buffer
+        """
+        if compress not in COMPRESS_SUFFIX:
+            raise ValueError('unknown compress method: %s' % compress)
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError('compress zstd needs the zstandard package')
+        if resume and compress:
+            raise ValueError('compressed output can not be resumed')
+        self.filename, self.stream = filename, stream
+        self.compress, self.rotate_size, self.buffer_size = compress, rotate_size, buffer_size
+        self.flush_interval = flush_interval
+
+        self.bytes_written = 0
+        self.max_queue_depth = 0
+        self.files = []
+        # logical offset of the first byte of every file in files
+        self.file_starts = []
+
+        self._resume = resume
+        self._total = resume[0] if resume else 0
+
+        # the buffer is shared with the writer thread once flush_interval is over
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='binlog2sql-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def tell(self):
+        """logical offset of the output, counted over all rotated files"""
+        return self._total
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        self._total += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """hand the buffered data to the writer thread, does not wait for it to reach the disk"""
+        if self._error is not None:
+            raise self._error
+        with self._lock:
+            chunk = self._take()
+            if chunk is not None:
+                # put under the lock, so the writer thread sees it queued before it takes the buffer
+                self._queue.put(chunk)
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def _take(self):
+        if not self._buffer:
+            return None
+        chunk = b''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        return chunk
+
+    def _next_chunk(self):
+        """the next queued item, or the buffer once the queue has been idle for flush_interval"""
+        while True:
+            if not self.flush_interval:
+                return self._queue.get()
+            try:
+                return self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                pass
+            with self._lock:
+                # anything queued meanwhile was written before the buffer
+                chunk = self._take() if self._queue.empty() else None
+            if chunk is not None:
+                return chunk
+
+    def sync(self):
+        """wait until everything written so far is on disk (fsync)"""
+        self.flush()
+        barrier = threading.Event()
+        self._queue.put(barrier)
+        barrier.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """flush and wait for the writer thread, errors of the writer thread are raised here"""
+        if self._thread is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _name(self, n):
+        filename = self.filename if n == 0 else '%s.%d' % (self.filename, n)
+        return filename + COMPRESS_SUFFIX[self.compress]
+
+    def _open(self, n, start):
+        filename = self._name(n)
+        self.files.append(filename)
+        self.file_starts.append(start)
+        if self.compress == 'gzip':
+            # no timestamp in the header, the same output is the same file, an apply of it can be resumed
+            return gzip.GzipFile(filename, 'wb', compresslevel=6, mtime=0)
+        if self.compress == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(open(filename, 'wb'))
+        return open(filename, 'wb')
+
+    def _reopen(self, offset, file_starts):
+        """cut the output of an earlier run back to offset, return the last file opened for append"""
+        file_starts = file_starts or [0]
+        n = max(i for i, start in enumerate(file_starts) if start <= offset)
+        for i in range(n):
+            self.files.append(self._name(i))
+            self.file_starts.append(file_starts[i])
+        i = n + 1
+        while os.path.exists(self._name(i)):
+            os.remove(self._name(i))
+            i += 1
+        size = offset - file_starts[n]
+        exists = os.path.exists(self._name(n))
+        if (exists and os.path.getsize(self._name(n)) or 0) < size:
+            raise ValueError('output file %s is shorter than its checkpoint' % self._name(n))
+        self.files.append(self._name(n))
+        self.file_starts.append(file_starts[n])
+        f = open(self._name(n), 'r+b' if exists else 'wb')
+        f.truncate(size)
+        f.seek(size)
+        return f, size
+
+    def _run(self):
+        # size of the current file, and whether the last byte written ends a line
+        f, size, line_end = None, 0, True
+        # a chunk may end inside a multibyte character, the console gets it once it is complete
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            if self._resume:
+                f, size = self._reopen(*self._resume)
+        except Exception as e:
+            self._error = e
+        total = self._resume[0] if self._resume else 0
+        try:
+            while True:
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                if isinstance(chunk, threading.Event):
+                    try:
+                        if f is not None and self._error is None:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    except Exception as e:
+                        self._error = e
+                    chunk.set()
+                    continue
+                if self._error is not None:
+                    # keep draining so write() never blocks on a dead writer
+                    continue
+                try:
+                    self.bytes_written += len(chunk)
+                    if self.stream is not None:
+                        self.stream.write(decoder.decode(chunk))
+                        self.stream.flush()
+                        total += len(chunk)
+                    while self.stream is None and chunk:
+                        # rotate only after a newline, a chunk may end inside a statement
+                        full = self.rotate_size and size >= self.rotate_size
+                        if f is None or (full and line_end):
+                            if f is not None:
+                                f.close()
+                            f, size = self._open(len(self.files), total), 0
+                            full = False
+                        cut = chunk.find(b'\n') + 1 if full else 0
+                        piece, chunk = (chunk[:cut], chunk[cut:]) if cut else (chunk, b'')
+                        f.write(piece)
+                        size += len(piece)
+                        total += len(piece)
+                        line_end = piece.endswith(b'\n')
+                except Exception as e:
+                    self._error = e
+            if f is None and self.stream is None and self._error is None:
+                # nothing to write, still leave an empty output file like a plain open() would
+                f = self._open(0, 0)
+        finally:
+            if f is not None:
+                f.close()
+
+
+@contextmanager
+def output_open(filename=None, stream=None, compress=None, rotate_size=0, resume=None):
+    """AsyncWriter of filename or stream, None if neither is given"""
+    if filename is None and stream is None:
+        yield None
+        return
+    buffer_size = OUTPUT_BUFFER_SIZE if stream is None else CONSOLE_BUFFER_SIZE
+    writer = AsyncWriter(filename=filename, stream=stream, compress=compress, rotate_size=rotate_size,
+                         buffer_size=buffer_size, resume=resume)
+    try:
+        yield writer
+    finally:
+        writer.close()
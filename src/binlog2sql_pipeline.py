@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import array
+import multiprocessing
+import queue
+import threading
+import time
+
+from .binlog2sql_util import (
+    concat_sql_from_binlog_event, generate_batch_pattern, render_sql, stream_sql, SqlTemplateCache
+)
+
+# rows collected on the reader before they go to a renderer process as one task
+PIPELINE_CHUNK_ROWS = 2000
+# rendered chunks and other output operations waiting for the writer thread, per renderer process
+PIPELINE_QUEUE_SIZE = 4
+# rows events larger than this are streamed: rows decoded one at a time, sql written in pieces
+EVENT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def render_rows(rows_batch, e_start_pos, flashback=False, no_pk=False, batch_size=0, charset='utf8',
+                no_backslash_escapes=False, template_cache=None):
+    """sql of rows, one str per statement or (pattern, item) for a row SqlBatch merges with the following ones"""
+    outputs = []
+    for row in rows_batch.rows:
+        if batch_size:
+            pattern = generate_batch_pattern(rows_batch, row=row, flashback=flashback, no_pk=no_pk,
+                                             template_cache=template_cache)
+            if pattern:
+                values = pattern.pop('values')
+                outputs.append((pattern, render_sql(pattern['item'], values, charset=charset,
+                                                    no_backslash_escapes=no_backslash_escapes)))
+                continue
+        outputs.append(concat_sql_from_binlog_event(binlog_event=rows_batch, row=row, flashback=flashback,
+                                                    no_pk=no_pk, e_start_pos=e_start_pos, charset=charset,
+                                                    no_backslash_escapes=no_backslash_escapes,
+                                                    template_cache=template_cache))
+    return outputs
+
+
+class SqlWriter(object):
+    """
+    The output operations of process_binlog, applied in event order: sql to origin.sql, the console and
+    the flashback temp file, batching, transaction offsets in the temp file and checkpoint boundaries.
+    """
+
+    def __init__(self, f_origin, console=None, f_tmp=None, batch=None, on_boundary=None, template_cache=None,
+                 **render_options):
+        """f_tmp: flashback temp file, None without flashback. on_boundary: called with every boundary"""
+        self.f_origin, self.console, self.f_tmp = f_origin, console, f_tmp
+        self.batch = batch
+        self.on_boundary = on_boundary
+        self.template_cache = template_cache
+        self.render_options = render_options
+        self.stream_options = {k: v for k, v in render_options.items() if k != 'batch_size'}
+        # offsets of transaction boundaries in f_tmp, rollback is written one transaction at a time
+        self.trx_offsets = array.array('Q', [0])
+        # (log_file, log_pos, origin offset, gtid) at the end of the last transaction
+        self.boundary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write_row_sql(self, sql):
+        self.f_origin.write(sql + '\n')
+        if self.console:
+            self.console.write(sql + '\n')
+        if self.f_tmp:
+            self.f_tmp.write((sql + '\n').encode('utf-8'))
+
+    def write_sql(self, sql):
+        """sql of a ddl, it is not rolled back"""
+        self.f_origin.write(sql + '\n')
+        if self.console:
+            self.console.write(sql + '\n')
+
+    def flush_batch(self):
+        if self.batch:
+            sql = self.batch.flush()
+            if sql:
+                self.write_row_sql(sql)
+
+    def mark_transaction(self):
+        if self.f_tmp and self.f_tmp.tell() != self.trx_offsets[-1]:
+            self.trx_offsets.append(self.f_tmp.tell())
+
+    def mark_boundary(self, log_file, log_pos, gtid=None):
+        """log_file:log_pos is the end of a transaction, origin.sql is complete up to here"""
+        self.boundary = (log_file, log_pos, self.f_origin.tell(), gtid)
+        if self.console:
+            # show whole transactions as they come
+            self.console.flush()
+        if self.on_boundary:
+            self.on_boundary(self.boundary)
+
+    def render(self, rows_batch, e_start_pos):
+        self.write_rendered(rows_batch, e_start_pos, render_rows(rows_batch, e_start_pos,
+                                                                 template_cache=self.template_cache,
+                                                                 **self.render_options))
+
+    def stream(self, rows_batch, e_start_pos):
+        """
+        write the rows of a batch read lazily one at a time, every statement in pieces, without batching.
+        Return the number of rows.
+        """
+        self.flush_batch()
+        rows = 0
+        for row in rows_batch.rows:
+            for piece in stream_sql(rows_batch, row, e_start_pos, template_cache=self.template_cache,
+                                    **self.stream_options):
+                self._write_row_piece(piece)
+            self._write_row_piece('\n')
+            rows += 1
+        return rows
+
+    def _write_row_piece(self, piece):
+        self.f_origin.write(piece)
+        if self.console:
+            self.console.write(piece)
+        if self.f_tmp:
+            self.f_tmp.write(piece.encode('utf-8'))
+
+    def write_rendered(self, rows_batch, e_start_pos, outputs):
+        for output in outputs:
+            if isinstance(output, tuple):
+                sql = self.batch.add(output[0], output[1], e_start_pos, rows_batch)
+                if sql:
+                    self.write_row_sql(sql)
+                continue
+            self.flush_batch()
+            self.write_row_sql(output)
+
+    def close(self):
+        self.flush_batch()
+        self.mark_transaction()
+
+
+_renderer = {}
+
+
+def _init_renderer(template_cache_size, render_options):
+    _renderer['template_cache'] = SqlTemplateCache(maxsize=template_cache_size)
+    _renderer['generation'] = 0
+    _renderer['render_options'] = render_options
+
+
+def _render_chunk(chunk):
+    """seconds spent rendering and the outputs of every rows batch of chunk"""
+    start = time.perf_counter()
+    template_cache = _renderer['template_cache']
+    results = []
+    for rows_batch, e_start_pos, generation in chunk:
+        if generation != _renderer['generation']:
+            # the reader dropped templates since the last chunk
+            template_cache.invalidate()
+            _renderer['generation'] = generation
+        results.append(render_rows(rows_batch, e_start_pos, template_cache=template_cache,
+                                   **_renderer['render_options']))
+    return time.perf_counter() - start, results
+
+
+class PipelinedSqlWriter(object):
+    """
+    SqlWriter in three stages: the reader (the caller) hands rows over in chunks, a pool of renderer processes
+    turns them into sql, and a writer thread applies rendered chunks and every other operation to the SqlWriter
+    in the order they were handed over. The queue between reader and writer is bounded, a reader ahead of
+    the renderers or the disk blocks.
+    """
+
+    def __init__(self, writer, processes, chunk_rows=PIPELINE_CHUNK_ROWS, queue_size=PIPELINE_QUEUE_SIZE,
+                 metrics=None):
+        """metrics: Metrics the time the renderers spend is added to, render() only hands rows over"""
+        self.writer = writer
+        self.metrics = metrics
+        self.chunk_rows = chunk_rows
+        self._pool = multiprocessing.Pool(processes=processes, initializer=_init_renderer,
+                                          initargs=(writer.template_cache.maxsize, writer.render_options))
+        self._queue = queue.Queue(maxsize=processes * queue_size)
+        self._chunk, self._chunk_size = [], 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='binlog2sql-pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def trx_offsets(self):
+        return self.writer.trx_offsets
+
+    @property
+    def boundary(self):
+        return self.writer.boundary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # skip what is still queued, then drop the renderers
+            self._error = exc_value
+            self._stop()
+            self._pool.terminate()
+
+    def render(self, rows_batch, e_start_pos):
+        self._chunk.append((rows_batch, e_start_pos, self.writer.template_cache.generation))
+        self._chunk_size += len(rows_batch)
+        if self._chunk_size >= self.chunk_rows:
+            self._submit()
+
+    def write_row_sql(self, sql):
+        self._put('write_row_sql', sql)
+
+    def write_sql(self, sql):
+        self._put('write_sql', sql)
+
+    def flush_batch(self):
+        self._put('flush_batch')
+
+    def mark_transaction(self):
+        self._put('mark_transaction')
+
+    def mark_boundary(self, log_file, log_pos, gtid=None):
+        self._put('mark_boundary', log_file, log_pos, gtid)
+
+    def stream(self, rows_batch, e_start_pos):
+        """streamed on the calling thread once everything before is applied, a large event is never queued"""
+        self._sync()
+        return self.writer.stream(rows_batch, e_start_pos)
+
+    def close(self):
+        """wait for every operation to be applied, errors of the renderers and the writer thread are raised here"""
+        if self._thread is None:
+            return
+        try:
+            self._put('close')
+        finally:
+            self._pool.close()
+            self._stop()
+            self._pool.join()
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, name, *args):
+        if self._error is not None:
+            raise self._error
+        self._submit()
+        self._queue.put((name, args))
+
+    def _submit(self):
+        if not self._chunk:
+            return
+        chunk, self._chunk, self._chunk_size = self._chunk, [], 0
+        result = self._pool.apply_async(_render_chunk, (chunk,))
+        self._queue.put(('rendered', (result, [(rows_batch, e_start_pos) for rows_batch, e_start_pos, _ in chunk])))
+
+    def _sync(self):
+        barrier = threading.Event()
+        self._put('sync', barrier)
+        barrier.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                break
+            if operation[0] == 'sync':
+                operation[1][0].set()
+                continue
+            if self._error is not None:
+                # keep draining so the reader never blocks on a dead writer
+                continue
+            name, args = operation
+            try:
+                if name == 'rendered':
+                    result, events = args
+                    seconds, results = result.get()
+                    if self.metrics:
+                        self.metrics.seconds['render'] += seconds
+                    for (rows_batch, e_start_pos), outputs in zip(events, results):
+                        self.writer.write_rendered(rows_batch, e_start_pos, outputs)
+                else:
+                    getattr(self.writer, name)(*args)
+            except Exception as e:
+                self._error = e
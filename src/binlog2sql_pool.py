@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+
+import pymysql
+
+# idle connections kept per server
+POOL_MAX_IDLE = 4
+
+
+class ConnectionPool(object):
+    """
+    Idle pymysql connections kept per server and user for reuse, at most max_idle of each.
+    Thread safe. A connection is pinged before it is handed out again, a dead one is replaced.
+    """
+
+    def __init__(self, max_idle=POOL_MAX_IDLE, connect=pymysql.connect):
+        self.max_idle = max_idle
+        self.connect = connect
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(conn_setting):
+        # settings may hold unhashable values, e.g. an ssl dict
+        return tuple(sorted((k, repr(v)) for k, v in conn_setting.items()))
+
+    @contextmanager
+    def connection(self, conn_setting):
+        """a connection to conn_setting, back to the pool after the block, closed if the block raised"""
+        connection = self.acquire(conn_setting)
+        try:
+            yield connection
+        except BaseException:
+            _close(connection)
+            raise
+        self.release(conn_setting, connection)
+
+    def acquire(self, conn_setting):
+        key = self.key(conn_setting)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                connection = idle.pop() if idle else None
+            if connection is None:
+                break
+            try:
+                connection.ping(reconnect=False)
+            except pymysql.err.Error:
+                _close(connection)
+                continue
+            with self._lock:
+                self.reused += 1
+            return connection
+        connection = self.connect(**conn_setting)
+        with self._lock:
+            self.created += 1
+        return connection
+
+    def release(self, conn_setting, connection):
+        with self._lock:
+            idle = self._idle.setdefault(self.key(conn_setting), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        _close(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                _close(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except pymysql.err.Error:
+        # already closed by the server or a failed ping
+        pass
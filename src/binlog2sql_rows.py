@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+ROWS_EVENT_TYPES = ((WriteRowsEvent, 'INSERT'), (UpdateRowsEvent, 'UPDATE'), (DeleteRowsEvent, 'DELETE'))
+
+# RowsReader decodes rows one at a time through private members of the rows events, as mysql-replication 0.13
+# has them. The version is pinned in requirements.txt, tests/test_rows.py fails when they change
+for _event_class, _ in ROWS_EVENT_TYPES:
+    if not callable(getattr(_event_class, '_fetch_one_row', None)):
+        raise ImportError('binlog2sql needs mysql-replication==0.13, %s._fetch_one_row is missing' %
+                          _event_class.__name__)
+
+
+class RowsBatch(object):
+    """
+    The rows of one rows event in a compact form. Column names are stored once, shared by every batch of the
+    same table map, and every row image is a tuple of values in column order: a row of an INSERT or DELETE is
+    one tuple, a row of an UPDATE is a (before, after) pair of tuples. rows is a list, or an iterator for
+    a batch read lazily.
+    Unlike the event it is read from, a batch holds no packet, table map or connection and can be pickled.
+    """
+    __slots__ = ('schema', 'table', 'table_id', 'primary_key', 'timestamp', 'log_pos', 'sql_type', 'columns',
+                 'rows', '_key_indexes')
+
+    def __init__(self, schema, table, table_id, primary_key, timestamp, log_pos, sql_type, columns, rows):
+        self.schema, self.table, self.table_id = schema, table, table_id
+        self.primary_key, self.timestamp, self.log_pos = primary_key, timestamp, log_pos
+        self.sql_type, self.columns, self.rows = sql_type, columns, rows
+        self._key_indexes = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def key_columns(self):
+        """primary key column names, empty without a primary key"""
+        if not self.primary_key:
+            return ()
+        return self.primary_key if isinstance(self.primary_key, tuple) else (self.primary_key,)
+
+    @property
+    def key_indexes(self):
+        """positions of the primary key columns in a row image"""
+        if self._key_indexes is None:
+            self._key_indexes = tuple(self.columns.index(column) for column in self.key_columns)
+        return self._key_indexes
+
+    def without_primary_key(self, values):
+        """columns and values of a row image without the primary key columns"""
+        key_indexes = self.key_indexes
+        return (tuple(column for i, column in enumerate(self.columns) if i not in key_indexes),
+                tuple(value for i, value in enumerate(values) if i not in key_indexes))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__[:-1])
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class RowsReader(object):
+    """Read rows events into RowsBatch, column names are built once per table map"""
+
+    def __init__(self):
+        # table_id -> (columns of the table map, their names)
+        self._columns = {}
+
+    def column_names(self, binlog_event):
+        cached = self._columns.get(binlog_event.table_id)
+        if cached is None or cached[0] is not binlog_event.columns:
+            cached = (binlog_event.columns, tuple(column.name for column in binlog_event.columns))
+            self._columns[binlog_event.table_id] = cached
+        return cached[1]
+
+    def read(self, binlog_event, lazy=False):
+        """
+        RowsBatch of a rows event. Rows not accessed yet are decoded one at a time and their dicts dropped at once,
+        the event packet is consumed and binlog_event.rows is empty afterwards.
+        lazy: rows are decoded as the iterator in batch.rows is consumed, only one of them is held at a time.
+        The raw packet of the event is still held whole by pymysql, only the decoded rows are bounded
+        """
+        sql_type = rows_event_type(binlog_event)
+        rows = self._rows(binlog_event, sql_type)
+        return RowsBatch(binlog_event.schema, binlog_event.table, binlog_event.table_id, binlog_event.primary_key,
+                         binlog_event.timestamp, binlog_event.packet.log_pos, sql_type,
+                         self.column_names(binlog_event), rows if lazy else list(rows))
+
+    @staticmethod
+    def _rows(binlog_event, sql_type):
+        fetched = binlog_event._RowsEvent__rows
+        if fetched is not None:
+            for row in fetched:
+                yield compact_row(sql_type, row)
+        elif binlog_event.complete:
+            packet, event_size = binlog_event.packet, binlog_event.event_size
+            while packet.read_bytes + 1 < event_size:
+                yield compact_row(sql_type, binlog_event._fetch_one_row())
+
+
+def rows_event_type(binlog_event):
+    for event_class, sql_type in ROWS_EVENT_TYPES:
+        if isinstance(binlog_event, event_class):
+            return sql_type
+    raise ValueError('binlog_event must be WriteRowsEvent, UpdateRowsEvent or DeleteRowsEvent')
+
+
+def compact_row(sql_type, row):
+    """a row dict of pymysqlreplication as tuples of values in column order"""
+    if sql_type == 'UPDATE':
+        return tuple(row['before_values'].values()), tuple(row['after_values'].values())
+    return tuple(row['values'].values())
@@ -0,0 +1,666 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import QueryEvent
+
+# CachedBinLogStreamReader replaces a private method of BinLogStreamReader, as mysql-replication 0.13 has it.
+# The version is pinned in requirements.txt
+if not callable(getattr(BinLogStreamReader, '_BinLogStreamReader__get_table_information', None)):
+    raise ImportError('binlog2sql needs mysql-replication==0.13, '
+                      'BinLogStreamReader.__get_table_information is missing')
+
+SCHEMA_CACHE_FORMAT = 1
+# column types holding text, they get the character set of the column, else of the table
+TEXT_TYPES = frozenset(('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set'))
+# words that start an index or constraint where a column definition could start
+INDEX_WORDS = frozenset(('PRIMARY', 'KEY', 'INDEX', 'UNIQUE', 'FULLTEXT', 'SPATIAL', 'FOREIGN', 'CHECK',
+                         'CONSTRAINT'))
+# ALTER TABLE clauses that leave the columns as they are, any other clause not replayed refreshes the table
+NEUTRAL_ALTER_WORDS = frozenset(('ALTER', 'ENGINE', 'ALGORITHM', 'LOCK', 'FORCE', 'ORDER', 'COMMENT', 'AUTO_INCREMENT',
+                                 'ROW_FORMAT', 'KEY_BLOCK_SIZE', 'ENABLE', 'DISABLE', 'PARTITION', 'REMOVE'))
+
+_TOKEN = re.compile(r"""
+    \s+ | --[^\n]* | \#[^\n]* | /\*(?!!).*?\*/ | /\*!\d* | \*/
+  | `(?P<quoted>(?:[^`]|``)*)`
+  | '(?P<string>(?:[^'\\]|\\.|'')*)'
+  | "(?P<dstring>(?:[^"\\]|\\.|"")*)"
+  | (?P<word>[\w$]+)
+  | (?P<punct>.)
+""", re.S | re.X)
+
+
+def position_key(log_file, log_pos):
+    """sortable binlog position, (-1, -1) before every position for a version valid from the start"""
+    if log_file is None:
+        return -1, -1
+    return int(log_file.rsplit('.', 1)[1]), log_pos
+
+
+class DdlError(ValueError):
+    pass
+
+
+class SchemaCache(object):
+    """
+    Column metadata of tables in versions ordered by binlog position, one json file:
+    {"format": 1, "tables": {"schema.table": [{"log_file": name, "log_pos": pos, "columns": [...],
+                                                "charset": charset}, ...]}}
+
+    A version holds the columns of a table from its position on, the columns as information_schema reports
+    them and BinLogStreamReader expects them, None once the table is dropped. The first version of a table is
+    used for every event before it, a version without log_file is valid from the start. A version with "invalid"
+    marks columns a ddl left unknown, columns() raises for events there instead of decoding them wrongly.
+    Ddl read from the binlog adds versions, so a table map is decoded with the columns the table had at
+    its position and not with the columns of a later ddl. A schema snapshot of dump_schema_snapshot loads as
+    a cache of one version per table.
+    """
+
+    def __init__(self, tables=None, charset='utf8'):
+        """charset: character set of text columns of a table whose ddl does not name one"""
+        self.tables = tables if tables else {}
+        self.charset = charset
+        # versions added since load or save
+        self.dirty = False
+        # versions are added by the thread reading the stream, save may run on the thread writing the output
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, log_file=None, log_pos=None, charset='utf8'):
+        """a cache of the tables in a schema snapshot, valid from log_file:log_pos"""
+        return cls({key: [_version(log_file, log_pos, columns)] for key, columns in snapshot.items()},
+                   charset=charset)
+
+    @classmethod
+    def load(cls, filename, charset='utf8'):
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if 'format' not in data:
+            return cls.from_snapshot(data, charset=charset)
+        if data['format'] != SCHEMA_CACHE_FORMAT:
+            raise ValueError('%s: unknown schema cache format %s' % (filename, data['format']))
+        return cls(data['tables'], charset=charset)
+
+    def save(self, filename):
+        with self.lock:
+            # versions are only ever inserted, a copy of the lists is a consistent cache
+            tables = {key: list(versions) for key, versions in self.tables.items()}
+            self.dirty = False
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'format': SCHEMA_CACHE_FORMAT, 'tables': tables}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, filename)
+
+    def columns(self, schema, table, log_file=None, log_pos=None):
+        """columns of schema.table at log_file:log_pos, None for a table unknown or dropped there"""
+        version = self._version_at('%s.%s' % (schema, table), position_key(log_file, log_pos))
+        if version and version.get('invalid'):
+            raise ValueError('schema cache: columns of %s.%s at %s:%s are unknown, %s' % (
+                schema, table, log_file, log_pos, version['invalid']))
+        return version['columns'] if version else None
+
+    def add(self, schema, table, log_file, log_pos, columns, charset=None, invalid=None):
+        """add a version of schema.table, False if there is one at log_file:log_pos already"""
+        with self.lock:
+            versions = self.tables.setdefault('%s.%s' % (schema, table), [])
+            keys = [position_key(v['log_file'], v['log_pos']) for v in versions]
+            key = position_key(log_file, log_pos)
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return False
+            versions.insert(i, _version(log_file, log_pos, columns, charset, invalid))
+            self.dirty = True
+        return True
+
+    def merge(self, other):
+        """
+        add the versions of another cache, e.g. one a worker process saved. Return True if a version of a ddl
+        was new, a table only looked up in information_schema changes no position
+        """
+        added = False
+        for key, versions in other.tables.items():
+            schema, table = key.split('.', 1)
+            for version in versions:
+                added = self.add(schema, table, version['log_file'], version['log_pos'], version['columns'],
+                                 version.get('charset'), version.get('invalid')) and \
+                    version['log_file'] is not None or added
+        return added
+
+    def replay(self, schema, query, log_file, log_pos, refresh=None):
+        """
+        apply the ddl query of a QueryEvent ending at log_file:log_pos, schema is the default database of
+        the query. Return the (schema, table) of the tables it changed. Tables with a version at or after
+        log_file:log_pos already have the change, unknown tables are left unknown. The cached tables of a ddl that
+        is not replayed get their columns from refresh(schema, table), the columns on the server or None for
+        a table that is gone. Without refresh they are invalid from log_file:log_pos on.
+        """
+        replay = _DdlReplay(self, schema, position_key(log_file, log_pos))
+        try:
+            changes = replay.run(query)
+        except DdlError as e:
+            reason = 'the ddl at %s:%s is not replayed: %s' % (log_file, log_pos, e)
+            keys = [key for key in self._known(replay, query, e) if self.latest_key('%s.%s' % key) < replay.position]
+            if refresh:
+                changes = {key: (refresh(*key), None) for key in keys}
+                outcome = 'read from the server again'
+            else:
+                changes = {key: (None, None, reason) for key in keys}
+                outcome = 'unknown from there on'
+            sys.stderr.write('[binlog2sql] schema cache: %s, columns of %s %s\n' % (
+                reason, ', '.join('%s.%s' % key for key in changes) or 'no cached table', outcome))
+        changed = []
+        for (table_schema, table), change in changes.items():
+            if self.add(table_schema, table, log_file, log_pos, *change):
+                changed.append((table_schema, table))
+        return changed
+
+    def _known(self, ddl, query, error):
+        """the cached tables of a ddl that failed, ValueError if the statement names none"""
+        if not ddl.targets:
+            raise ValueError('schema cache: no table in ddl %s: %s' % (' '.join(query.split())[:200], error))
+        return [key for key in dict.fromkeys(ddl.targets) if '%s.%s' % key in self.tables]
+
+    def latest_key(self, key):
+        versions = self.tables.get(key)
+        return position_key(versions[-1]['log_file'], versions[-1]['log_pos']) if versions else None
+
+    def _version_at(self, key, position):
+        versions = self.tables.get(key)
+        if not versions:
+            return None
+        keys = [position_key(v['log_file'], v['log_pos']) for v in versions]
+        return versions[max(bisect.bisect_right(keys, position) - 1, 0)]
+
+
+def _version(log_file, log_pos, columns, charset=None, invalid=None):
+    version = {'log_file': log_file, 'log_pos': log_pos, 'columns': columns}
+    if charset:
+        version['charset'] = charset
+    if invalid:
+        version['invalid'] = invalid
+    return version
+
+
+def read_ddl(stream, stop_file, stop_pos=None):
+    """(schema, query, log_file, log_pos) of every ddl in a stream up to stop_file:stop_pos, or the end of stop_file"""
+    stop = position_key(stop_file, stop_pos if stop_pos else float('inf'))
+    for binlog_event in stream:
+        if position_key(stream.log_file, stream.log_pos) > stop:
+            break
+        if isinstance(binlog_event, QueryEvent) and binlog_event.query not in ('BEGIN', 'COMMIT'):
+            yield binlog_event.schema.decode('utf-8'), binlog_event.query, stream.log_file, stream.log_pos
+
+
+class _Tokens(object):
+    """tokens of a sql statement: ('word', text), ('name', text) for a quoted name, ('string', text), ('punct', c)"""
+
+    def __init__(self, query):
+        self.tokens = []
+        for match in _TOKEN.finditer(query):
+            kind = match.lastgroup
+            if kind is None:
+                continue
+            value = match.group(kind)
+            if kind == 'quoted':
+                kind, value = 'name', value.replace('``', '`')
+            elif kind in ('string', 'dstring'):
+                quote = "'" if kind == 'string' else '"'
+                kind, value = 'string', re.sub(r'\\(.)', r'\1', value.replace(quote * 2, quote))
+            self.tokens.append((kind, value))
+        self.i = 0
+
+    def peek(self, *words, offset=0):
+        """the next token, or the one offset tokens after it, is one of words. Keywords compare case insensitive"""
+        if self.i + offset >= len(self.tokens):
+            return False
+        kind, value = self.tokens[self.i + offset]
+        if kind == 'word':
+            return value.upper() in words
+        return kind == 'punct' and value in words
+
+    def accept(self, *words):
+        if self.peek(*words):
+            self.i += 1
+            return True
+        return False
+
+    def expect(self, *words):
+        if not self.accept(*words):
+            raise DdlError('expected %s' % ' or '.join(words))
+
+    def at_end(self):
+        return self.i >= len(self.tokens) or self.peek(';')
+
+    def next(self):
+        if self.i >= len(self.tokens):
+            raise DdlError('unexpected end of statement')
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def name(self):
+        """a name, quoted or not, or a string"""
+        kind, value = self.next()
+        if kind not in ('word', 'name', 'string'):
+            raise DdlError('expected a name, got %s' % value)
+        return value
+
+    def table_name(self, schema):
+        name = self.name()
+        if self.accept('.'):
+            return name, self.name()
+        return schema, name
+
+    def skip_parenthesized(self):
+        """skip a ( ... ) group, return its text as mysql shows it in a column type"""
+        self.expect('(')
+        parts, depth = ['('], 1
+        while depth:
+            kind, value = self.next()
+            if kind == 'punct' and value == '(':
+                depth += 1
+            elif kind == 'punct' and value == ')':
+                depth -= 1
+            parts.append("'%s'" % value.replace("'", "''") if kind == 'string' else value)
+        return ''.join(parts)
+
+    def skip_clause(self):
+        """skip to the ',' or ')' closing the current clause, parentheses included"""
+        while not self.at_end() and not self.peek(',', ')'):
+            if self.peek('('):
+                self.skip_parenthesized()
+            else:
+                self.next()
+
+
+class _DdlReplay(object):
+    """
+    the changes of one ddl statement: {(schema, table): (columns or None, charset)}. Replayed are CREATE TABLE,
+    ALTER TABLE ADD/DROP/CHANGE/MODIFY/RENAME COLUMN, primary keys and RENAME TO, DROP TABLE, DROP DATABASE and
+    RENAME TABLE. Anything else that could change columns raises DdlError
+    """
+
+    def __init__(self, cache, schema, position):
+        self.cache, self.schema, self.position = cache, schema, position
+        self.changes = {}
+        # (schema, table) of every table the statement names, as far as it was parsed
+        self.targets = []
+
+    def run(self, query):
+        self.statement(_Tokens(query))
+        return self.new_versions()
+
+    def statement(self, tokens):
+        if tokens.accept('CREATE'):
+            if tokens.accept('OR'):
+                tokens.expect('REPLACE')
+            if tokens.accept('TABLE'):
+                self.create_table(tokens)
+        elif tokens.accept('ALTER'):
+            while tokens.accept('ONLINE', 'OFFLINE', 'IGNORE'):
+                pass
+            if tokens.accept('TABLE'):
+                self.alter_table(tokens)
+        elif tokens.accept('DROP'):
+            if tokens.accept('TABLE'):
+                self.drop_tables(tokens)
+            elif tokens.accept('DATABASE', 'SCHEMA'):
+                self.drop_database(tokens)
+        elif tokens.accept('RENAME'):
+            if tokens.accept('TABLE', 'TABLES'):
+                self.rename_tables(tokens)
+
+    def new_versions(self):
+        changes = {}
+        for key, (columns, charset) in self.changes.items():
+            latest = self.cache.latest_key('%s.%s' % key)
+            if latest is not None and latest >= self.position:
+                continue
+            version = self.cache._version_at('%s.%s' % key, self.position)
+            if version and version['columns'] == columns and (columns is None or self.table_charset(
+                    columns, version.get('charset')) == self.table_charset(columns, charset)):
+                # table options, indexes and the like, the columns are unchanged
+                continue
+            changes[key] = (columns, charset)
+        return changes
+
+    def table(self, key):
+        """(columns, charset) of a table before this statement, None if unknown or dropped"""
+        if key in self.changes:
+            columns, charset = self.changes[key]
+        else:
+            latest = self.cache.latest_key('%s.%s' % key)
+            if latest is None or latest >= self.position:
+                # unknown, or the cache has the table as it is after this statement already
+                return None
+            version = self.cache._version_at('%s.%s' % key, self.position)
+            columns, charset = version['columns'], version.get('charset')
+        if columns is None:
+            return None
+        return [dict(column) for column in columns], charset
+
+    def table_charset(self, columns, charset):
+        """default character set of a table, taken from its text columns when its ddl was not seen"""
+        if charset:
+            return charset
+        for column in columns:
+            if column.get('CHARACTER_SET_NAME'):
+                return column['CHARACTER_SET_NAME']
+        return self.cache.charset
+
+    def create_table(self, tokens):
+        if tokens.accept('IF'):
+            tokens.expect('NOT')
+            tokens.expect('EXISTS')
+        key = tokens.table_name(self.schema)
+        self.targets.append(key)
+        if tokens.accept('LIKE'):
+            source = self.table(tokens.table_name(self.schema))
+            if source is not None:
+                self.changes[key] = source
+            return
+        if not tokens.accept('(') or tokens.peek('LIKE'):
+            raise DdlError('CREATE TABLE without column definitions')
+        definitions = []
+        primary_key = []
+        while True:
+            if tokens.peek(*INDEX_WORDS):
+                primary_key.extend(self.index_definition(tokens))
+            else:
+                definitions.append(self.column_definition(tokens, tokens.name()))
+            if not tokens.accept(','):
+                break
+        tokens.expect(')')
+        charset = self.table_options(tokens)
+        columns = []
+        for column, column_charset, _ in definitions:
+            if column['COLUMN_TYPE'].split('(')[0] in TEXT_TYPES and not column_charset:
+                column['CHARACTER_SET_NAME'] = charset or self.cache.charset
+            columns.append(column)
+        self.set_primary_key(columns, primary_key)
+        self.changes[key] = (columns, charset)
+
+    @staticmethod
+    def table_options(tokens):
+        """default character set in the table options, None if not named"""
+        charset = collation = None
+        while not tokens.at_end():
+            if tokens.peek('SELECT', 'AS', 'IGNORE', 'REPLACE'):
+                raise DdlError('CREATE TABLE ... SELECT')
+            if tokens.accept('CHARSET') or (tokens.accept('CHARACTER') and tokens.accept('SET')):
+                tokens.accept('=')
+                charset = tokens.name().lower()
+            elif tokens.accept('COLLATE'):
+                tokens.accept('=')
+                collation = tokens.name().lower()
+            elif tokens.peek('('):
+                tokens.skip_parenthesized()
+            else:
+                tokens.next()
+        if charset is None and collation:
+            charset = collation.split('_')[0]
+        return charset if charset != 'default' else None
+
+    def index_definition(self, tokens):
+        """skip an index or constraint definition, return the columns of a primary key"""
+        if tokens.accept('CONSTRAINT'):
+            if not tokens.peek('PRIMARY', 'UNIQUE', 'FOREIGN', 'CHECK'):
+                tokens.name()
+        columns = []
+        if tokens.accept('PRIMARY'):
+            tokens.expect('KEY')
+            while not tokens.peek('('):
+                tokens.next()
+            columns = self.key_parts(tokens)
+        tokens.skip_clause()
+        return columns
+
+    @staticmethod
+    def key_parts(tokens):
+        """column names of a (col(length) DESC, ...) key part list"""
+        tokens.expect('(')
+        columns = []
+        while True:
+            columns.append(tokens.name())
+            tokens.skip_clause()
+            if not tokens.accept(','):
+                break
+        tokens.expect(')')
+        return columns
+
+    @staticmethod
+    def set_primary_key(columns, primary_key):
+        if not primary_key:
+            return
+        names = set(name.lower() for name in primary_key)
+        for column in columns:
+            if column['COLUMN_NAME'].lower() in names:
+                column['COLUMN_KEY'] = 'PRI'
+
+    def column_definition(self, tokens, name):
+        """(column, the character set it names or None, (FIRST or AFTER, column) or None) of a column definition"""
+        type_name = tokens.name().lower()
+        column_type = type_name + (tokens.skip_parenthesized() if tokens.peek('(') else '')
+        column = {'COLUMN_NAME': name, 'COLLATION_NAME': None, 'CHARACTER_SET_NAME': None, 'COLUMN_COMMENT': '',
+                  'COLUMN_TYPE': column_type, 'COLUMN_KEY': ''}
+        unsigned = zerofill = False
+        charset = None
+        place = None
+        while not tokens.at_end() and not tokens.peek(',', ')'):
+            if tokens.accept('UNSIGNED'):
+                unsigned = True
+            elif tokens.accept('ZEROFILL'):
+                unsigned = zerofill = True
+            elif tokens.accept('CHARSET') or (tokens.accept('CHARACTER') and tokens.accept('SET')):
+                charset = tokens.name().lower()
+            elif tokens.accept('COLLATE'):
+                column['COLLATION_NAME'] = tokens.name().lower()
+            elif tokens.accept('COMMENT'):
+                column['COLUMN_COMMENT'] = tokens.name()
+            elif tokens.accept('PRIMARY'):
+                tokens.expect('KEY')
+                column['COLUMN_KEY'] = 'PRI'
+            elif tokens.accept('UNIQUE'):
+                tokens.accept('KEY')
+                if column['COLUMN_KEY'] != 'PRI':
+                    column['COLUMN_KEY'] = 'UNI'
+            elif tokens.accept('KEY'):
+                column['COLUMN_KEY'] = 'PRI'
+            elif tokens.accept('FIRST'):
+                place = ('FIRST', None)
+            elif tokens.accept('AFTER'):
+                place = ('AFTER', tokens.name())
+            elif tokens.peek('('):
+                tokens.skip_parenthesized()
+            else:
+                tokens.next()
+        if unsigned:
+            column['COLUMN_TYPE'] += ' unsigned'
+        if zerofill:
+            column['COLUMN_TYPE'] += ' zerofill'
+        if charset is None and column['COLLATION_NAME']:
+            charset = column['COLLATION_NAME'].split('_')[0]
+        if type_name in TEXT_TYPES and charset != 'binary':
+            # binary strings are not decoded, information_schema shows no character set for them
+            column['CHARACTER_SET_NAME'] = charset
+        return column, charset, place
+
+    def alter_table(self, tokens):
+        key = tokens.table_name(self.schema)
+        self.targets.append(key)
+        table = self.table(key)
+        if table is None:
+            return
+        columns, charset = table
+        charset = self.table_charset(columns, charset)
+        while not tokens.at_end():
+            key = self.alter_specification(tokens, key, columns, charset)
+            if not tokens.accept(','):
+                break
+        self.changes[key] = (columns, charset)
+
+    def alter_specification(self, tokens, key, columns, charset):
+        """apply one change of an ALTER TABLE to columns, return the name of the table after it"""
+        if tokens.accept('ADD'):
+            if tokens.peek(*INDEX_WORDS) or tokens.peek('PARTITION'):
+                self.set_primary_key(columns, self.index_definition(tokens))
+                return key
+            tokens.accept('COLUMN')
+            if tokens.accept('('):
+                while True:
+                    self.add_column(columns, charset, self.column_name(tokens), tokens)
+                    if not tokens.accept(','):
+                        break
+                tokens.expect(')')
+            else:
+                self.add_column(columns, charset, self.column_name(tokens), tokens)
+        elif tokens.accept('DROP'):
+            if tokens.accept('PRIMARY'):
+                tokens.expect('KEY')
+                for column in columns:
+                    if column['COLUMN_KEY'] == 'PRI':
+                        column['COLUMN_KEY'] = ''
+            elif tokens.peek('INDEX', 'KEY', 'FOREIGN', 'CHECK', 'CONSTRAINT', 'PARTITION'):
+                tokens.skip_clause()
+            else:
+                tokens.accept('COLUMN')
+                columns.pop(self.find_column(columns, self.column_name(tokens)))
+                tokens.skip_clause()
+        elif tokens.accept('CHANGE'):
+            tokens.accept('COLUMN')
+            old_name = self.column_name(tokens)
+            self.replace_column(columns, charset, old_name, tokens.name(), tokens)
+        elif tokens.accept('MODIFY'):
+            tokens.accept('COLUMN')
+            name = self.column_name(tokens)
+            self.replace_column(columns, charset, name, name, tokens)
+        elif tokens.accept('RENAME'):
+            if tokens.accept('COLUMN'):
+                old_name = tokens.name()
+                tokens.expect('TO')
+                columns[self.find_column(columns, old_name)]['COLUMN_NAME'] = tokens.name()
+            elif tokens.peek('INDEX', 'KEY'):
+                tokens.skip_clause()
+            else:
+                tokens.accept('TO', 'AS')
+                new_key = tokens.table_name(key[0])
+                self.targets.append(new_key)
+                self.changes[key] = (None, None)
+                key = new_key
+        elif tokens.peek(*NEUTRAL_ALTER_WORDS):
+            tokens.skip_clause()
+        else:
+            # CONVERT TO CHARACTER SET, DEFAULT CHARSET and whatever else is not replayed
+            raise DdlError('ALTER TABLE %s is not replayed' % tokens.next()[1])
+        return key
+
+    @staticmethod
+    def column_name(tokens):
+        if tokens.peek('IF'):
+            raise DdlError('IF [NOT] EXISTS of a column is not replayed')
+        return tokens.name()
+
+    @staticmethod
+    def find_column(columns, name, required=True):
+        for i, column in enumerate(columns):
+            if column['COLUMN_NAME'].lower() == name.lower():
+                return i
+        if required:
+            raise DdlError('unknown column %s' % name)
+        return None
+
+    def place_column(self, columns, column, place, default_index):
+        if place is None:
+            columns.insert(default_index, column)
+        elif place[0] == 'FIRST':
+            columns.insert(0, column)
+        else:
+            columns.insert(self.find_column(columns, place[1]) + 1, column)
+
+    def add_column(self, columns, charset, name, tokens):
+        if self.find_column(columns, name, required=False) is not None:
+            raise DdlError('column %s exists' % name)
+        column, column_charset, place = self.column_definition(tokens, name)
+        if column['COLUMN_TYPE'].split('(')[0] in TEXT_TYPES and not column_charset:
+            column['CHARACTER_SET_NAME'] = charset
+        self.place_column(columns, column, place, len(columns))
+
+    def replace_column(self, columns, charset, old_name, name, tokens):
+        i = self.find_column(columns, old_name)
+        old = columns.pop(i)
+        column, column_charset, place = self.column_definition(tokens, name)
+        if column['COLUMN_TYPE'].split('(')[0] in TEXT_TYPES and not column_charset:
+            column['CHARACTER_SET_NAME'] = charset
+        if not column['COLUMN_KEY']:
+            # a changed column stays in the keys it was in
+            column['COLUMN_KEY'] = old['COLUMN_KEY']
+        self.place_column(columns, column, place, i)
+
+    def drop_tables(self, tokens):
+        if tokens.accept('IF'):
+            tokens.expect('EXISTS')
+        while True:
+            key = tokens.table_name(self.schema)
+            self.targets.append(key)
+            if self.table(key) is not None:
+                self.changes[key] = (None, None)
+            if not tokens.accept(','):
+                break
+
+    def drop_database(self, tokens):
+        if tokens.accept('IF'):
+            tokens.expect('EXISTS')
+        schema = tokens.name()
+        for key in list(self.cache.tables):
+            table_schema, table = key.split('.', 1)
+            if table_schema == schema:
+                self.targets.append((table_schema, table))
+                if self.table((table_schema, table)) is not None:
+                    self.changes[(table_schema, table)] = (None, None)
+
+    def rename_tables(self, tokens):
+        while True:
+            old_key = tokens.table_name(self.schema)
+            tokens.expect('TO')
+            new_key = tokens.table_name(self.schema)
+            self.targets.extend((old_key, new_key))
+            table = self.table(old_key)
+            if table is not None:
+                self.changes[old_key] = (None, None)
+                self.changes[new_key] = table
+            if not tokens.accept(','):
+                break
+
+
+class CachedBinLogStreamReader(BinLogStreamReader):
+    """
+    BinLogStreamReader taking table metadata from a SchemaCache at the position of the stream,
+    information_schema is only queried for tables the cache does not know, the result is cached.
+    """
+
+    def __init__(self, schema_cache, *args, **kwargs):
+        super(CachedBinLogStreamReader, self).__init__(*args, **kwargs)
+        self.schema_cache = schema_cache
+
+    def _BinLogStreamReader__get_table_information(self, schema, table):
+        columns = self.schema_cache.columns(schema, table, self.log_file, self.log_pos)
+        if columns is None:
+            columns = BinLogStreamReader._BinLogStreamReader__get_table_information(self, schema, table)
+            if columns and '%s.%s' % (schema, table) not in self.schema_cache.tables:
+                self.schema_cache.add(schema, table, None, None, [dict(column) for column in columns])
+        return columns
+
+    def forget_table(self, schema, table):
+        """drop the table map of schema.table, its next rows are decoded with the columns in the cache"""
+        for table_id, table_map in list(self.table_map.items()):
+            if table_map.schema == schema and table_map.table == table:
+                del self.table_map[table_id]
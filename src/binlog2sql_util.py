@@ -2,20 +2,34 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import codecs
 import datetime
 import getpass
+import json
 import os
 import platform
 import sys
+from collections import OrderedDict
 from contextlib import contextmanager
 
-from pymysqlreplication.event import QueryEvent
+from pymysql import converters
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent
 from pymysqlreplication.row_event import (
     WriteRowsEvent,
     UpdateRowsEvent,
     DeleteRowsEvent,
+    TableMapEvent,
 )
 
+from .binlog2sql_rows import RowsBatch
+
+# read size of reversed_lines, large blocks keep the per-block overhead away from multi-GB flashback files
+REVERSED_BLOCK_SIZE = 8 * 1024 * 1024
+# size of the pieces stream_sql writes a statement in
+STREAM_CHUNK_SIZE = 1024 * 1024
+# json columns are written as json text, values json has no type for (decimal, dates) as their str
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+
 if sys.version > '3':
     PY3PLUS = True
 else:
@@ -42,7 +56,7 @@ def create_unique_file(filename):
 
 @contextmanager
 def file_open(filename, mode):
-    f = open(filename, mode, encoding='utf-8')
+    f = open(filename, mode) if 'b' in mode else open(filename, mode, encoding='utf-8')
     try:
         yield f
     finally:
@@ -51,7 +65,7 @@ def file_open(filename, mode):
 
 @contextmanager
 def file_temp_open(filename, mode):
-    f = open(filename, mode, encoding='utf-8')
+    f = open(filename, mode) if 'b' in mode else open(filename, mode, encoding='utf-8')
     try:
         yield f
     finally:
@@ -60,6 +74,22 @@ def file_temp_open(filename, mode):
             os.remove(filename)
 
 
+def merge_files(filenames, *writers):
+    """Copy filenames in order to every writer, in chunks of whole lines, missing files are skipped"""
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
+        with open(filename, 'rb') as f_part:
+            while True:
+                lines = f_part.readlines(1024 * 1024)
+                if not lines:
+                    break
+                chunk = b''.join(lines)
+                for writer in writers:
+                    if writer is not None:
+                        writer.write(chunk)
+
+
 def is_dml_event(event):
     if isinstance(event, WriteRowsEvent) \
             or isinstance(event, UpdateRowsEvent) \
@@ -80,113 +110,395 @@ def event_type(event):
     return t
 
 
-def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False):
+SQL_TYPE_EVENTS = {'INSERT': WriteRowsEvent, 'UPDATE': UpdateRowsEvent, 'DELETE': DeleteRowsEvent}
+
+
+def filter_events(sql_type, gtid=False):
+    """
+    only_events for the binlog stream: rows events of sql_type and the events process_binlog needs to follow
+    transactions and positions, everything else is dropped before it is decoded.
+    Query events stay even with only_dml, BEGIN/COMMIT and ddl mark transaction boundaries.
+    """
+    events = [QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, TableMapEvent]
+    if gtid:
+        events.append(GtidEvent)
+    events.extend(SQL_TYPE_EVENTS[t] for t in sql_type if t in SQL_TYPE_EVENTS)
+    return events
+
+
+def concat_sql_from_binlog_event(binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False,
+                                 charset='utf8', no_backslash_escapes=False, template_cache=None):
+    """binlog_event: a RowsBatch with one of its rows, or a QueryEvent"""
     if flashback and no_pk:
         raise ValueError('only one of flashback or no_pk can be True')
-    if not (isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent)
-            or isinstance(binlog_event, DeleteRowsEvent) or isinstance(binlog_event, QueryEvent)):
-        raise ValueError('binlog_event must be WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent or QueryEvent')
+    if not (isinstance(binlog_event, RowsBatch) or isinstance(binlog_event, QueryEvent)):
+        raise ValueError('binlog_event must be RowsBatch or QueryEvent')
 
     sql = ''
-    if isinstance(binlog_event, WriteRowsEvent) \
-            or isinstance(binlog_event, UpdateRowsEvent) \
-            or isinstance(binlog_event, DeleteRowsEvent):
-        pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
-        sql = cursor.mogrify(pattern['template'], pattern['values'])
+    if isinstance(binlog_event, RowsBatch):
+        pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk,
+                                       template_cache=template_cache)
+        sql = render_sql(pattern['template'], pattern['values'],
+                         charset=charset, no_backslash_escapes=no_backslash_escapes)
         time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-        sql += ' #start %s end %s time %s' % (e_start_pos, binlog_event.packet.log_pos, time)
+        sql += ' #start %s end %s time %s' % (e_start_pos, binlog_event.log_pos, time)
     elif flashback is False and isinstance(binlog_event, QueryEvent) \
             and binlog_event.query != 'BEGIN' \
             and binlog_event.query != 'COMMIT':
         if binlog_event.schema:
-            sql = 'USE {0};\n'.format(binlog_event.schema)
+            # the default database of a query event is read as bytes
+            schema = binlog_event.schema
+            sql = 'USE {0};\n'.format(schema.decode('utf-8') if isinstance(schema, bytes) else schema)
         sql += '{0};'.format(fix_object(binlog_event.query))
 
     return sql
 
 
-def reversed_lines(fin):
-    """Generate the lines of file in reverse order."""
-    part = ''
-    for block in reversed_blocks(fin):
-        # if PY3PLUS:
-        #     try:
-        #         block = platform.system() == 'Windows' and block.decode("gbk") or block.decode("utf-8")
-        #     except UnicodeDecodeError as ed_err:
-        #         print(ed_err)
-        #         continue
-        for c in reversed(block):
-            if type(c) != str:
-                c = str(c)
-            if c == '\n' and part:
-                yield part[::-1]
-                part = ''
-            part += c
-    if part:
-        yield part[::-1]
+def reversed_lines(fin, block_size=REVERSED_BLOCK_SIZE, start=0, end=None, max_line_size=None):
+    """
+    Generate the lines of a binary file (or of its [start, end) range) in reverse order, without line breaks.
+    A line longer than max_line_size is not read into memory, it is generated as a FileRange to copy in blocks.
+    """
+    if end is None:
+        fin.seek(0, os.SEEK_END)
+        end = fin.tell()
+    part = b''
+    at_end = True
+    here = end
+    # end of the long line whose start is still to be found
+    long_end = None
+    for block in reversed_blocks(fin, block_size, start, end):
+        here -= len(block)
+        if long_end is not None:
+            i = block.rfind(b'\n')
+            if i < 0:
+                continue
+            yield FileRange(fin, here + i + 1, long_end, block_size)
+            # the lines before the long one, the last of them is complete
+            lines = block[:i].split(b'\n')
+            long_end = None
+        else:
+            lines = (block + part).split(b'\n')
+        part = lines[0]
+        if at_end:
+            # the line break ending the last line does not start an empty line
+            if lines[-1] == b'' and len(lines) > 1:
+                lines.pop()
+            at_end = False
+        for i in range(len(lines) - 1, 0, -1):
+            yield lines[i]
+        if max_line_size and len(part) > max_line_size:
+            long_end, part = here + len(part), b''
+    if long_end is not None:
+        yield FileRange(fin, start, long_end, block_size)
+    elif part or not at_end:
+        yield part
+
+
+class FileRange(object):
+    """[start, end) of a file, read in blocks of block_size"""
+
+    def __init__(self, fin, start, end, block_size=REVERSED_BLOCK_SIZE):
+        self.fin, self.start, self.end, self.block_size = fin, start, end, block_size
+
+    def __len__(self):
+        return self.end - self.start
+
+    def blocks(self):
+        here = self.start
+        while here < self.end:
+            self.fin.seek(here, os.SEEK_SET)
+            block = self.fin.read(min(self.block_size, self.end - here))
+            if not block:
+                raise EOFError('%s ends before %d' % (getattr(self.fin, 'name', 'file'), self.end))
+            here += len(block)
+            yield block
 
 
 # binlog2sql_util
-def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False):
-    template = ''
-    values = []
+def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False, template_cache=None):
+    """binlog_event: RowsBatch, row: values of an INSERT/DELETE row, (before, after) values of an UPDATE row"""
+    template, values = sql_template_values(binlog_event, row=row, flashback=flashback, no_pk=no_pk,
+                                           template_cache=template_cache)
+    return {'template': template, 'values': list(map(fix_object, values))}
+
+
+def stream_sql(binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False, charset='utf8',
+               no_backslash_escapes=False, template_cache=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    concat_sql_from_binlog_event of a row, generated in pieces of about chunk_size chars for rows too large
+    to be held as one string: long values are escaped piece by piece.
+    """
+    template, values = sql_template_values(binlog_event, row=row, flashback=flashback, no_pk=no_pk,
+                                           template_cache=template_cache)
+    parts = template.split('%s')
+
+    def pieces():
+        yield parts[0]
+        for value, part in zip(values, parts[1:]):
+            for piece in literal_pieces(value, charset, no_backslash_escapes, chunk_size):
+                yield piece
+            yield part
+        yield ' #start %s end %s time %s' % (e_start_pos, binlog_event.log_pos,
+                                             datetime.datetime.fromtimestamp(binlog_event.timestamp))
+    return joined_pieces(pieces(), chunk_size)
+
+
+def literal_pieces(value, charset='utf8', no_backslash_escapes=False, chunk_size=STREAM_CHUNK_SIZE):
+    """sql_literal(fix_object(value)) in pieces of about chunk_size chars"""
+    if isinstance(value, (dict, list)):
+        text = joined_pieces(JSON_ENCODER.iterencode(json_value(value)), chunk_size)
+    elif isinstance(value, bytes) and len(value) > chunk_size:
+        if not is_utf8(value, chunk_size):
+            # two hex digits per byte
+            step = max(chunk_size // 2, 1)
+            yield "X'"
+            for i in range(0, len(value), step):
+                yield value[i:i + step].hex()
+            yield "'"
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        text = (decoder.decode(value[i:i + chunk_size]) for i in range(0, len(value), chunk_size))
+    elif isinstance(value, str) and len(value) > chunk_size:
+        text = (value[i:i + chunk_size] for i in range(0, len(value), chunk_size))
+    else:
+        yield sql_literal(fix_object(value), charset, no_backslash_escapes)
+        return
+    yield "'"
+    for piece in text:
+        yield escape_text(piece, no_backslash_escapes)
+    yield "'"
+
+
+def joined_pieces(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    """join small pieces of text into pieces of at least chunk_size chars, except the last one"""
+    pending, size = [], 0
+    for piece in pieces:
+        pending.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield ''.join(pending)
+
+
+def is_utf8(value, chunk_size=STREAM_CHUNK_SIZE):
+    """whether bytes decode as utf-8, checked piece by piece"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for i in range(0, len(value), chunk_size):
+            decoder.decode(value[i:i + chunk_size])
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def sql_template_values(binlog_event, row=None, flashback=False, no_pk=False, template_cache=None):
+    """the template of a row and its values in placeholder order, before fix_object"""
+    columns = binlog_event.columns
+    if not flashback and no_pk and binlog_event.sql_type == 'INSERT' and binlog_event.primary_key:
+        columns, row = binlog_event.without_primary_key(row)
+
+    if template_cache is None:
+        template = generate_sql_template(binlog_event, row=row, flashback=flashback, columns=columns)
+    else:
+        key = sql_template_key(binlog_event, row=row, flashback=flashback, no_pk=no_pk, columns=columns)
+        template = template_cache.get(key)
+        if template is None:
+            template = generate_sql_template(binlog_event, row=row, flashback=flashback, columns=columns)
+            template_cache.put(key, template)
+
+    if binlog_event.sql_type == 'UPDATE':
+        before_values, after_values = row
+        values = before_values + after_values if flashback else after_values + before_values
+    else:
+        values = row
+    return template, values
+
+
+def generate_sql_template(binlog_event, row=None, flashback=False, columns=None):
+    """columns: names of the values in row, binlog_event.columns by default"""
+    columns = columns if columns is not None else binlog_event.columns
+    sql_type = binlog_event.sql_type
     if flashback is True:
-        if isinstance(binlog_event, WriteRowsEvent):
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ' AND '.join(map(compare_items, row['values'].items()))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, DeleteRowsEvent):
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(map(lambda key: '`%s`' % key, row['values'].keys())),
-                ', '.join(['%s'] * len(row['values']))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, UpdateRowsEvent):
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(['`%s`=%%s' % x for x in row['before_values'].keys()]),
-                ' AND '.join(map(compare_items, row['after_values'].items())))
-            values = map(fix_object, list(row['before_values'].values()) + list(row['after_values'].values()))
+        # a rolled back INSERT is a DELETE and the other way round, an UPDATE sets the before image back
+        sql_type = {'INSERT': 'DELETE', 'DELETE': 'INSERT'}.get(sql_type, sql_type)
+    template = ''
+    if sql_type == 'INSERT':
+        template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
+            binlog_event.schema, binlog_event.table,
+            ', '.join(map(lambda key: '`%s`' % key, columns)),
+            ', '.join(['%s'] * len(columns))
+        )
+    elif sql_type == 'DELETE':
+        template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
+            binlog_event.schema, binlog_event.table, ' AND '.join(map(compare_items, zip(columns, row))))
+    elif sql_type == 'UPDATE':
+        where_values = row[1] if flashback else row[0]
+        template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
+            binlog_event.schema, binlog_event.table,
+            ', '.join(['`%s`=%%s' % k for k in columns]),
+            ' AND '.join(map(compare_items, zip(columns, where_values)))
+        )
+    return template
+
+
+def generate_batch_pattern(binlog_event, row=None, flashback=False, no_pk=False, template_cache=None):
+    """
+    Pattern of a row that can be merged with the following rows into one multi-row statement:
+    INSERT ... VALUES (...), (...) or DELETE ... WHERE pk IN (...).
+    Return None if the row needs a statement of its own (UPDATE, or DELETE of a table without primary key).
+    """
+    sql_type = binlog_event.sql_type
+    is_insert = sql_type == ('DELETE' if flashback else 'INSERT')
+    is_delete = sql_type == ('INSERT' if flashback else 'DELETE')
+    if not (is_insert or (is_delete and binlog_event.primary_key)):
+        return None
+    columns = binlog_event.columns
+    if is_insert and no_pk and binlog_event.primary_key:
+        columns, row = binlog_event.without_primary_key(row)
+
+    key = (binlog_event.schema, binlog_event.table, binlog_event.table_id, sql_type,
+           flashback, no_pk, columns, 'batch')
+    pattern = template_cache.get(key) if template_cache is not None else None
+    if pattern is None:
+        if is_insert:
+            head = 'INSERT INTO `{0}`.`{1}`({2}) VALUES '.format(
+                binlog_event.schema, binlog_event.table, ', '.join(map(lambda k: '`%s`' % k, columns)))
+            tail = ';'
+            indexes = None
+        else:
+            columns = binlog_event.key_columns
+            indexes = binlog_event.key_indexes
+            key_columns = ', '.join(map(lambda k: '`%s`' % k, columns))
+            if len(columns) > 1:
+                key_columns = '(' + key_columns + ')'
+            head = 'DELETE FROM `{0}`.`{1}` WHERE {2} IN ('.format(binlog_event.schema, binlog_event.table, key_columns)
+            tail = ');'
+        item = ', '.join(['%s'] * len(columns))
+        if is_insert or len(columns) > 1:
+            item = '(' + item + ')'
+        # indexes: positions of the item values in a row, None for all of them
+        pattern = {'key': key, 'head': head, 'tail': tail, 'item': item, 'indexes': indexes}
+        if template_cache is not None:
+            template_cache.put(key, pattern)
+
+    indexes = pattern['indexes']
+    values = row if indexes is None else [row[i] for i in indexes]
+    return dict(pattern, values=list(map(fix_object, values)))
+
+
+def sql_bytes(sql):
+    """bytes of sql once written, encoded as utf-8"""
+    return len(sql) if sql.isascii() else len(sql.encode('utf-8'))
+
+
+class SqlBatch(object):
+    """Collect consecutive rows of one batch pattern into a multi-row statement of at most max_size bytes"""
+
+    def __init__(self, max_size, reverse=False):
+        self.max_size = max_size
+        # flashback statements are replayed in reverse, so are the rows inside one statement
+        self.reverse = reverse
+        self._pattern = None
+        self._items = []
+        self._size = 0
+        self._start_pos = self._end_pos = self._timestamp = None
+
+    def add(self, pattern, item, e_start_pos, binlog_event):
+        """add a rendered row, return the previous statement if it had to be closed"""
+        sql = None
+        size = sql_bytes(item) + 2
+        if self._items and (pattern['key'] != self._pattern['key'] or self._size + size > self.max_size):
+            sql = self.flush()
+        if not self._items:
+            self._pattern = pattern
+            self._size = sql_bytes(pattern['head']) + sql_bytes(pattern['tail'])
+            self._start_pos = e_start_pos
+        self._items.append(item)
+        self._size += size
+        self._end_pos, self._timestamp = binlog_event.log_pos, binlog_event.timestamp
+        return sql
+
+    def flush(self):
+        if not self._items:
+            return None
+        items = reversed(self._items) if self.reverse else self._items
+        sql = self._pattern['head'] + ', '.join(items) + self._pattern['tail']
+        sql += ' #start %s end %s time %s' % (self._start_pos, self._end_pos,
+                                               datetime.datetime.fromtimestamp(self._timestamp))
+        self._items = []
+        return sql
+
+
+def sql_template_key(binlog_event, row=None, flashback=False, no_pk=False, columns=None):
+    """Everything the template depends on: table, columns, event type, mode and which WHERE values are NULL"""
+    if binlog_event.sql_type == 'UPDATE':
+        where_values = row[1] if flashback else row[0]
     else:
-        if isinstance(binlog_event, WriteRowsEvent):
-            if no_pk:
-                # print binlog_event.__dict__
-                # tableInfo = (binlog_event.table_map)[binlog_event.table_id]
-                # if tableInfo.primary_key:
-                #     row['values'].pop(tableInfo.primary_key)
-                if binlog_event.primary_key:
-                    row['values'].pop(binlog_event.primary_key)
-
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(map(lambda key: '`%s`' % key, row['values'].keys())),
-                ', '.join(['%s'] * len(row['values']))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, DeleteRowsEvent):
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table, ' AND '.join(map(compare_items, row['values'].items())))
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, UpdateRowsEvent):
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(['`%s`=%%s' % k for k in row['after_values'].keys()]),
-                ' AND '.join(map(compare_items, row['before_values'].items()))
-            )
-            values = map(fix_object, list(row['after_values'].values()) + list(row['before_values'].values()))
-
-    return {'template': template, 'values': list(values)}
-
-
-def reversed_blocks(fin, block_size=4096):
+        where_values = row
+    null_mask = tuple([v is None for v in where_values])
+    return (binlog_event.schema, binlog_event.table, binlog_event.table_id, binlog_event.sql_type,
+            flashback, no_pk, columns if columns is not None else binlog_event.columns, null_mask)
+
+
+class SqlTemplateCache(object):
+    """LRU cache of sql templates, shared by all rows of the same table layout"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # bumped whenever templates are dropped, so copies of the cache in other processes can follow
+        self.generation = 0
+        self._templates = OrderedDict()
+        self._table_ids = {}
+
+    def get(self, key):
+        template = self._templates.get(key)
+        if template is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._templates.move_to_end(key)
+        return template
+
+    def put(self, key, template):
+        self._templates[key] = template
+        if len(self._templates) > self.maxsize:
+            self._templates.popitem(last=False)
+
+    def on_table_map(self, schema, table, table_id):
+        """a new table_id for a known table means it was re-mapped, drop its old templates"""
+        old_id = self._table_ids.get((schema, table))
+        self._table_ids[(schema, table)] = table_id
+        if old_id is not None and old_id != table_id:
+            self.invalidate(schema, table)
+
+    def invalidate(self, schema=None, table=None):
+        """drop templates of one table, or all of them when no table is given"""
+        self.generation += 1
+        if table is None:
+            self._templates.clear()
+            self._table_ids.clear()
+            return
+        for key in [k for k in self._templates if k[0] == schema and k[1] == table]:
+            del self._templates[key]
+
+    def __len__(self):
+        return len(self._templates)
+
+
+def reversed_blocks(fin, block_size=REVERSED_BLOCK_SIZE, start=0, end=None):
     """Generate blocks of file's contents in reverse order."""
-    fin.seek(0, os.SEEK_END)
-    here = fin.tell()
-    while 0 < here:
-        delta = min(block_size, here)
+    if end is None:
+        fin.seek(0, os.SEEK_END)
+        end = fin.tell()
+    here = end
+    while start < here:
+        delta = min(block_size, here - start)
         here -= delta
         fin.seek(here, os.SEEK_SET)
         yield fin.read(delta)
@@ -201,18 +513,64 @@ def compare_items(items):
         return '`%s`=%%s' % k
 
 
+def sql_literal(value, charset='utf8', no_backslash_escapes=False):
+    """
+    Escape a python value to a SQL literal, same as pymysql Connection.literal() but without a connection.
+    Bytes become a hex literal, the sql is written as utf-8 text.
+    """
+    if isinstance(value, str):
+        return "'" + escape_text(value, no_backslash_escapes) + "'"
+    if value is None:
+        return 'NULL'
+    if type(value) is int:
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return "X'%s'" % value.hex()
+    return converters.escape_item(value, charset, mapping=converters.encoders)
+
+
+def escape_text(value, no_backslash_escapes=False):
+    """escape a str for a quoted SQL literal, without the quotes"""
+    if no_backslash_escapes:
+        return value.replace("'", "''")
+    return converters.escape_string(value)
+
+
+def render_sql(template, values, charset='utf8', no_backslash_escapes=False):
+    """Fill the %s placeholders of template with escaped values, the output is identical to cursor.mogrify"""
+    return template % tuple([sql_literal(v, charset, no_backslash_escapes) for v in values])
+
+
 def fix_object(value):
     """Fixes python objects so that they can be properly inserted into SQL queries"""
     if isinstance(value, set):
         value = ','.join(value)
+    if isinstance(value, (dict, list)):
+        # a json column
+        return JSON_ENCODER.encode(json_value(value))
     if PY3PLUS and isinstance(value, bytes):
-        return value.decode('utf-8')
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            # binary data, sql_literal writes it as hex
+            return value
     elif not PY3PLUS and isinstance(value, unicode):
         return value.encode('utf-8')
     else:
         return value
 
 
+def json_value(value):
+    """a json document of pymysqlreplication, whose keys and strings are bytes, with str instead"""
+    if isinstance(value, dict):
+        return {k.decode('utf-8') if isinstance(k, bytes) else k: json_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [json_value(v) for v in value]
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
 def command_line_args(args):
     need_print_help = False if args else True
     parser = parse_args()
@@ -220,7 +578,7 @@ def command_line_args(args):
     if args.help or need_print_help:
         parser.print_help()
         sys.exit(1)
-    if not args.start_file:
+    if not args.start_file and not args.servers_file:
         raise ValueError('Lack of parameter: start_file')
     if args.flashback and args.stop_never:
         raise ValueError('Only one of flashback or stop-never can be True')
@@ -229,7 +587,19 @@ def command_line_args(args):
     if (args.start_time and not is_valid_datetime(args.start_time)) or \
             (args.stop_time and not is_valid_datetime(args.stop_time)):
         raise ValueError('Incorrect datetime argument')
-    if not args.password:
+    if args.flashback and args.checkpoint_file:
+        raise ValueError('Only one of flashback or checkpoint-file can be set')
+    if args.apply_rollback and not args.flashback:
+        raise ValueError('apply-rollback needs flashback')
+    if args.compact and (args.stop_never or args.checkpoint_file):
+        raise ValueError('compact can not be used with stop-never or checkpoint-file')
+    if args.output_format != 'sql' and args.batch_size:
+        raise ValueError('Only one of batch-size or output-format %s can be set' % args.output_format)
+    if args.binlog_dir and not args.schema_file:
+        raise ValueError('Lack of parameter: schema_file')
+    if args.binlog_dir and not args.apply_rollback:
+        args.password = ''
+    elif not args.password:
         args.password = getpass.getpass()
     else:
         args.password = args.password[0]
@@ -276,16 +646,91 @@ def parse_args():
                         help='only print dml, ignore ddl. default: False')
     binlog.add_argument('--sql-type', dest='sql_type', type=str, default=['INSERT', 'UPDATE', 'DELETE'],
                         help='Sql type you want to process. default: INSERT, UPDATE, DELETE.')
+    binlog.add_argument('--index-dir', dest='index_dir', type=str, default='',
+                        help='Directory of the binlog time index, used to seek to --start-datetime')
+    binlog.add_argument('--build-index', dest='build_index', type=bool, default=False,
+                        help='After parsing, read the rotated binlog files of the range that are not indexed yet '
+                             'whole and index them. default: False')
+    binlog.add_argument('--schema-cache-file', dest='schema_cache_file', type=str, default='',
+                        help='Versioned table metadata kept across runs and updated by the ddl in the binlog, '
+                             'created from the server when missing')
+    binlog.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='Parse binlog files in parallel with this many worker processes. default: 1')
+    binlog.add_argument('--render-workers', dest='render_workers', type=int, default=0,
+                        help='Render sql in this many processes while binlog is read. default: 0, render inline')
+    binlog.add_argument('--event-memory-limit', dest='event_memory_limit', type=int, default=64 * 1024 * 1024,
+                        help='Render rows events larger than this many bytes one row at a time and write their sql '
+                             'in pieces, the raw event is still read whole. default: 64MB, 0 for no limit')
+    binlog.add_argument('--checkpoint-file', dest='checkpoint_file', type=str, default='',
+                        help='Save the resume point (binlog file and position) to this file and resume from it '
+                             'when it exists')
+    binlog.add_argument('--checkpoint-interval', dest='checkpoint_interval', type=float, default=1.0,
+                        help='Seconds between two checkpoints, 0 saves one after every transaction. default: 1')
     binlog.add_argument('--no-primary-key', dest='no_pk', type=bool, default=False,
                         help='Generate insert sql without primary key if exists. default: False')
 
+    offline = parser.add_argument_group('offline setting')
+    offline.add_argument('--binlog-dir', dest='binlog_dir', type=str, default='',
+                         help='Parse binlog files in this local directory, no mysql server needed')
+    offline.add_argument('--schema-file', dest='schema_file', type=str, default='',
+                         help='Table metadata snapshot used by --binlog-dir')
+
+    monitor = parser.add_argument_group('monitor setting')
+    monitor.add_argument('--progress-interval', dest='progress_interval', type=float, default=0,
+                         help='Print a progress line to stderr every this many seconds. default: 0, none')
+    monitor.add_argument('--metrics-port', dest='metrics_port', type=int, default=None,
+                         help='Serve prometheus metrics on http://HOST:PORT/metrics, meant for --stop-never')
+    monitor.add_argument('--metrics-host', dest='metrics_host', type=str, default='127.0.0.1',
+                         help='Address the metrics are served on, 0.0.0.0 for every interface. default: 127.0.0.1')
+    monitor.add_argument('--profile', dest='profile', type=str, default='',
+                         help='Run under cProfile and dump the stats to this file')
+
+    fleet = parser.add_argument_group('fleet setting')
+    fleet.add_argument('--servers-file', dest='servers_file', type=str, default='',
+                       help='Json list of servers to parse at once, connection settings missing there are taken '
+                            'from the connect setting')
+    fleet.add_argument('--fleet-concurrency', dest='fleet_concurrency', type=int, default=4,
+                       help='Binlog files parsed at the same time across all servers. default: 4')
+
     flashback = parser.add_argument_group('flashback filter')
     flashback.add_argument('-B', '--flashback', dest='flashback', type=bool, default=True,
                            help='Flashback data to start_position of start_file. default: True')
+    flashback.add_argument('--flashback-transaction', dest='flashback_transaction', type=bool, default=False,
+                           help='Wrap every rolled back transaction in BEGIN; ... COMMIT;. default: False')
+    flashback.add_argument('--batch-size', dest='batch_size', type=int, default=0,
+                           help='Merge consecutive INSERT/DELETE rows into statements of at most this many bytes. '
+                                'default: 0, one statement per row')
+    flashback.add_argument('--compact', dest='compact', type=bool, default=False,
+                           help='Fold the changes of every row of a table with a primary key into its net change, '
+                                'e.g. an UPDATE chain into one UPDATE. default: False')
+    flashback.add_argument('--compact-memory-limit', dest='compact_memory_limit', type=int,
+                           default=256 * 1024 * 1024,
+                           help='Spill the row state of --compact to disk beyond this many bytes. default: 256MB')
+    flashback.add_argument('--output-compress', dest='output_compress', type=str, default=None,
+                           choices=['gzip', 'zstd'], help='Compress origin.sql and rollback.sql. default: none')
+    flashback.add_argument('--output-rotate-size', dest='output_rotate_size', type=int, default=0,
+                           help='Start a new origin.sql.N after this many bytes. default: 0, no rotation')
+    flashback.add_argument('--output-format', dest='output_format', type=str, default='sql',
+                           choices=['sql', 'jsonl', 'msgpack'],
+                           help='sql, or every row change as a json line (jsonl) or msgpack object (msgpack, needs '
+                                'the msgpack package) with its before and after images. default: sql')
     flashback.add_argument('-O', '--output_path', dest='output_path', type=str, default=None,
                            help="Sql file output path.")
     flashback.add_argument('--output_console', dest='output_console', type=bool, default=False,
                            help="Show sql output console. default: False")
+
+    apply = parser.add_argument_group('apply setting')
+    apply.add_argument('--apply-rollback', dest='apply_rollback', type=bool, default=False,
+                       help='Apply rollback.sql to the server once it is written. default: False')
+    apply.add_argument('--apply-dry-run', dest='apply_dry_run', type=bool, default=False,
+                       help='Only batch rollback.sql and report what --apply-rollback would apply. default: False')
+    apply.add_argument('--apply-workers', dest='apply_workers', type=int, default=1,
+                       help='Apply the transactions of different tables on this many connections at once, the '
+                            'transactions of one table keep their order, those of several tables run alone. '
+                            'default: 1')
+    apply.add_argument('--apply-batch-size', dest='apply_batch_size', type=int, default=500,
+                       help='Statements of whole transactions sent in one round trip and committed together. '
+                            'default: 500')
     return parser
 
 
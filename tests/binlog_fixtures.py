@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fixture binlog files for the tests, written by the synthetic binlog writer, and offline
+parses of them.
+"""
+
+import datetime
+import os
+
+from src.binlog2sql import Binlog2sql
+from synthetic_binlog import BinlogWriter, Column, Table, write_schema_snapshot
+
+LOG_FILE = 'mysql-bin.000001'
+# timestamp of the first transaction BinlogWriter writes, every transaction is one second later
+START_TIMESTAMP = 1650621000
+ROW_TYPES = ['INSERT', 'UPDATE', 'DELETE']
+
+USERS = Table('test', 'users', 101, [Column('id', 'int', 'PRI'), Column('name', 'varchar')])
+ORDERS = Table('test', 'orders', 102, [Column('id', 'int', 'PRI'), Column('user_id', 'int'),
+                                       Column('note', 'varchar')])
+
+
+def sql_time(second=0):
+    """the time comment of a statement of the transaction written second seconds after the first one"""
+    return str(datetime.datetime.fromtimestamp(START_TIMESTAMP + second))
+
+
+def log_file(n):
+    return 'mysql-bin.%06d' % n
+
+
+def file_timestamp(n):
+    """timestamp of the first transaction of log_file(n), files are written ten seconds apart"""
+    return START_TIMESTAMP + 10 * (n - 1)
+
+
+# the sql of BinlogFixture.write_users, and of its flashback
+INSERT_ALICE = "INSERT INTO `test`.`users`(`id`, `name`) VALUES (1, 'alice'); #start 4 end 273 time %s" % sql_time(0)
+INSERT_BOB = "INSERT INTO `test`.`users`(`id`, `name`) VALUES (2, 'bob'); #start 4 end 273 time %s" % sql_time(0)
+UPDATE_ALICE = ("UPDATE `test`.`users` SET `id`=1, `name`='carol' WHERE `id`=1 AND `name`='alice' LIMIT 1; "
+                "#start 304 end 457 time %s" % sql_time(1))
+DELETE_BOB = "DELETE FROM `test`.`users` WHERE `id`=2 AND `name`='bob' LIMIT 1; #start 488 end 626 time %s" % (
+    sql_time(2))
+
+UNDO_INSERT_ALICE = "DELETE FROM `test`.`users` WHERE `id`=1 AND `name`='alice' LIMIT 1; #start 4 end 273 time %s" % (
+    sql_time(0))
+UNDO_INSERT_BOB = "DELETE FROM `test`.`users` WHERE `id`=2 AND `name`='bob' LIMIT 1; #start 4 end 273 time %s" % (
+    sql_time(0))
+UNDO_UPDATE_ALICE = ("UPDATE `test`.`users` SET `id`=1, `name`='alice' WHERE `id`=1 AND `name`='carol' LIMIT 1; "
+                     "#start 304 end 457 time %s" % sql_time(1))
+UNDO_DELETE_BOB = "INSERT INTO `test`.`users`(`id`, `name`) VALUES (2, 'bob'); #start 488 end 626 time %s" % (
+    sql_time(2))
+
+
+class BinlogFixture(object):
+    """binlog files and a schema snapshot in path/binlog, parsed offline to path/out"""
+
+    def __init__(self, path):
+        self.path = path
+        self.binlog_dir = os.path.join(path, 'binlog')
+        self.output_path = os.path.join(path, 'out')
+        self.schema_file = os.path.join(self.binlog_dir, 'schema.json')
+        os.makedirs(self.binlog_dir)
+
+    def writer(self, name=LOG_FILE, timestamp=START_TIMESTAMP):
+        return BinlogWriter(os.path.join(self.binlog_dir, name), timestamp=timestamp)
+
+    def snapshot(self, *tables):
+        write_schema_snapshot(self.schema_file, tables)
+
+    def binlog2sql(self, **kwargs):
+        kwargs.setdefault('start_file', LOG_FILE)
+        kwargs.setdefault('sql_type', ROW_TYPES)
+        kwargs.setdefault('output_path', self.output_path)
+        kwargs.setdefault('schema_file', self.schema_file)
+        return Binlog2sql(None, binlog_dir=self.binlog_dir, **kwargs)
+
+    def parse(self, **kwargs):
+        """run an offline parse, return the Binlog2sql"""
+        binlog2sql = self.binlog2sql(**kwargs)
+        binlog2sql.process_binlog()
+        return binlog2sql
+
+    def output(self, name='origin.sql'):
+        with open(os.path.join(self.output_path, name), 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def output_bytes(self, name):
+        with open(os.path.join(self.output_path, name), 'rb') as f:
+            return f.read()
+
+    def write_users(self):
+        """
+        INSERT of two users, UPDATE of one and DELETE of the other, one transaction each, their rows events end
+        at 273, 457 and 626
+        """
+        writer = self.writer()
+        writer.transaction([(USERS, 'INSERT', [(1, 'alice'), (2, 'bob')])])
+        writer.transaction([(USERS, 'UPDATE', [((1, 'alice'), (1, 'carol'))])])
+        writer.transaction([(USERS, 'DELETE', [(2, 'bob')])])
+        writer.close()
+        self.snapshot(USERS)
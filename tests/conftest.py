@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from binlog_fixtures import BinlogFixture  # noqa: E402
+
+
+@pytest.fixture
+def binlogs(tmp_path, monkeypatch):
+    # the flashback temp file is created in the working directory
+    monkeypatch.chdir(tmp_path)
+    return BinlogFixture(str(tmp_path))
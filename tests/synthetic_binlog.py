@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic binlog files for the tests and the benchmarks: row based binlog v4 with crc32 checksums as written by
+mysql 5.7, together with the schema snapshot BinLogFileReader needs to decode them.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from pymysql.util import int2byte
+
+BINLOG_MAGIC = b'\xfebin'
+SERVER_VERSION = b'5.7.30-log'
+# mysql splits the rows of a statement into events of about binlog-row-event-max-size bytes
+ROW_EVENT_MAX_SIZE = 8192
+
+QUERY_EVENT = 2
+ROTATE_EVENT = 4
+FORMAT_DESCRIPTION_EVENT = 15
+XID_EVENT = 16
+TABLE_MAP_EVENT = 19
+ROWS_EVENT = {'INSERT': 30, 'UPDATE': 31, 'DELETE': 32}
+
+MYSQL_TYPE_LONG = 3
+MYSQL_TYPE_VARCHAR = 15
+MYSQL_TYPE_JSON = 245
+MYSQL_TYPE_BLOB = 252
+JSONB_TYPE_SMALL_OBJECT = 0x00
+JSONB_TYPE_STRING = 0x0c
+
+
+def _length_coded(n):
+    if n < 251:
+        return int2byte(n)
+    if n < 2 ** 16:
+        return b'\xfc' + struct.pack('<H', n)
+    if n < 2 ** 24:
+        return b'\xfd' + struct.pack('<I', n)[:3]
+    return b'\xfe' + struct.pack('<Q', n)
+
+
+def _bitmap(bits):
+    data = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            data[i // 8] |= 1 << (i % 8)
+    return bytes(data)
+
+
+def _json_string(value):
+    """variable length prefix of a string inside mysql binary json"""
+    data, n = b'', len(value)
+    while True:
+        if n >> 7:
+            data += int2byte((n & 0x7f) | 0x80)
+            n >>= 7
+        else:
+            return data + int2byte(n) + value
+
+
+def json_object(obj):
+    """mysql binary json of a flat object with string values"""
+    keys = [k.encode('utf-8') for k in obj]
+    values = [_json_string(v.encode('utf-8')) for v in obj.values()]
+    header_size = 4 + 4 * len(keys) + 3 * len(keys)
+    key_entries, value_entries = b'', b''
+    offset = header_size
+    for key in keys:
+        key_entries += struct.pack('<HH', offset, len(key))
+        offset += len(key)
+    for value in values:
+        value_entries += struct.pack('<BH', JSONB_TYPE_STRING, offset)
+        offset += len(value)
+    body = key_entries + value_entries + b''.join(keys) + b''.join(values)
+    return int2byte(JSONB_TYPE_SMALL_OBJECT) + struct.pack('<HH', len(keys), offset) + body
+
+
+class Column(object):
+    """kind: int, varchar, blob or json"""
+
+    def __init__(self, name, kind, key=''):
+        self.name, self.kind, self.key = name, kind, key
+
+    @property
+    def type_code(self):
+        return {'int': MYSQL_TYPE_LONG, 'varchar': MYSQL_TYPE_VARCHAR,
+                'blob': MYSQL_TYPE_BLOB, 'json': MYSQL_TYPE_JSON}[self.kind]
+
+    @property
+    def metadata(self):
+        if self.kind == 'varchar':
+            return struct.pack('<H', 1020)
+        if self.kind in ('blob', 'json'):
+            return int2byte(4)
+        return b''
+
+    def encode(self, value):
+        if self.kind == 'int':
+            return struct.pack('<i', value)
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        if self.kind == 'varchar':
+            return struct.pack('<H', len(value)) + value
+        if self.kind == 'json':
+            value = json_object(value)
+        return struct.pack('<I', len(value)) + value
+
+    def snapshot(self):
+        column_type = {'int': 'int(11)', 'varchar': 'varchar(255)', 'blob': 'longblob', 'json': 'json'}[self.kind]
+        text = self.kind == 'varchar'
+        return {'COLUMN_NAME': self.name, 'COLLATION_NAME': 'utf8mb4_general_ci' if text else None,
+                'CHARACTER_SET_NAME': 'utf8mb4' if text else None, 'COLUMN_COMMENT': '',
+                'COLUMN_TYPE': column_type, 'COLUMN_KEY': self.key}
+
+
+class Table(object):
+
+    def __init__(self, schema, name, table_id, columns):
+        self.schema, self.name, self.table_id, self.columns = schema, name, table_id, columns
+
+    def encode_row(self, row):
+        return _bitmap([value is None for value in row]) + b''.join(
+            column.encode(value) for column, value in zip(self.columns, row) if value is not None)
+
+
+def schema_snapshot(tables):
+    return {'%s.%s' % (table.schema, table.name): [column.snapshot() for column in table.columns]
+            for table in tables}
+
+
+class BinlogWriter(object):
+    """append events to a binlog file, positions and checksums are filled in"""
+
+    def __init__(self, filename, timestamp=1650621000):
+        self.filename = filename
+        self.timestamp = timestamp
+        self._f = open(filename, 'wb')
+        self._f.write(BINLOG_MAGIC)
+        self.pos = len(BINLOG_MAGIC)
+        self._xid = 0
+        self.events = 0
+        self._event(FORMAT_DESCRIPTION_EVENT, struct.pack('<H', 4) + SERVER_VERSION.ljust(50, b'\x00') +
+                    struct.pack('<I', self.timestamp) + int2byte(19) + bytes(38) + int2byte(1))
+
+    def _event(self, event_type, body):
+        size = 19 + len(body) + 4
+        data = struct.pack('<IBIIIH', self.timestamp, event_type, 1, size, self.pos + size, 0) + body
+        self._f.write(data + struct.pack('<I', zlib.crc32(data) & 0xffffffff))
+        self.pos += size
+        self.events += 1
+
+    def query(self, query, schema=''):
+        schema, query = schema.encode('utf-8'), query.encode('utf-8')
+        self._event(QUERY_EVENT, struct.pack('<IIBHH', 1, 0, len(schema), 0, 0) + schema + b'\x00' + query)
+
+    def table_map(self, table):
+        schema, name = table.schema.encode('utf-8'), table.name.encode('utf-8')
+        metadata = b''.join(column.metadata for column in table.columns)
+        body = struct.pack('<Q', table.table_id)[:6] + struct.pack('<H', 1)
+        body += int2byte(len(schema)) + schema + b'\x00' + int2byte(len(name)) + name + b'\x00'
+        body += _length_coded(len(table.columns)) + bytes(column.type_code for column in table.columns)
+        body += _length_coded(len(metadata)) + metadata + _bitmap([True] * len(table.columns))
+        self._event(TABLE_MAP_EVENT, body)
+
+    def rows(self, table, sql_type, images, last=True):
+        """images: rows for INSERT/DELETE, (before, after) pairs for UPDATE"""
+        n = len(table.columns)
+        body = struct.pack('<Q', table.table_id)[:6] + struct.pack('<HH', 1 if last else 0, 2)
+        body += _length_coded(n) + _bitmap([True] * n)
+        if sql_type == 'UPDATE':
+            body += _bitmap([True] * n)
+            body += b''.join(table.encode_row(before) + table.encode_row(after) for before, after in images)
+        else:
+            body += b''.join(table.encode_row(row) for row in images)
+        self._event(ROWS_EVENT[sql_type], body)
+
+    def xid(self):
+        self._xid += 1
+        self._event(XID_EVENT, struct.pack('<Q', self._xid))
+
+    def transaction(self, statements):
+        """statements: [(table, sql_type, images)], rows are split into events like mysql does"""
+        self.query('BEGIN')
+        for table, sql_type, images in statements:
+            self.table_map(table)
+            chunk, size = [], 0
+            for image in images:
+                chunk.append(image)
+                size += len(table.encode_row(image[0] if sql_type == 'UPDATE' else image)) * (
+                    2 if sql_type == 'UPDATE' else 1)
+                if size >= ROW_EVENT_MAX_SIZE:
+                    self.rows(table, sql_type, chunk, last=False)
+                    chunk, size = [], 0
+            if chunk:
+                self.rows(table, sql_type, chunk)
+        self.xid()
+        self.timestamp += 1
+
+    def rotate(self, next_file):
+        self._event(ROTATE_EVENT, struct.pack('<Q', 4) + next_file.encode('utf-8'))
+
+    def close(self):
+        self._f.close()
+
+
+def write_schema_snapshot(filename, tables):
+    with open(filename, 'w') as f:
+        json.dump(schema_snapshot(tables), f)
+
+
+def binlog_size_mb(binlog_dir, log_files):
+    return sum(os.path.getsize(os.path.join(binlog_dir, f)) for f in log_files) / 1024.0 / 1024.0
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+
+import pytest
+
+from src.binlog2sql_apply import RollbackApplier
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql):
+        if self.connection.pool.fail_on and self.connection.pool.fail_on in sql:
+            raise RuntimeError('failed: %s' % self.connection.pool.fail_on)
+        self.connection.executed.append(sql)
+
+    def nextset(self):
+        return None
+
+
+class FakeConnection(object):
+    """commits what it executed to pool.committed, one list of statements per commit"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.pool.committed.extend(sql.split('\n') for sql in self.executed)
+        self.executed = []
+
+    def rollback(self):
+        self.executed = []
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.committed = []
+
+    def acquire(self, conn_setting):
+        return FakeConnection(self)
+
+    def release(self, conn_setting, connection):
+        pass
+
+    def close(self):
+        pass
+
+
+def delete(table, row_id):
+    return "DELETE FROM `test`.`%s` WHERE `id`=%d LIMIT 1; #start 4 end 100" % (table, row_id)
+
+
+def write_rollback(path, transactions):
+    with open(path, 'w') as f:
+        for statements in transactions:
+            f.write('\n'.join(['BEGIN;'] + statements + ['COMMIT;']) + '\n')
+    return path
+
+
+def test_transaction_of_several_tables(tmp_path):
+    """applied whole in one batch, however the tables are spread over the lanes"""
+    transaction = [delete('orders', 1), delete('users', 1), delete('orders', 2)]
+    rollback_file = write_rollback(str(tmp_path / 'rollback.sql'), [[delete('users', 2)], transaction])
+    pool = FakePool()
+    RollbackApplier({}, workers=4, pool=pool, out=io.StringIO()).apply_file(rollback_file)
+    assert pool.committed == [[delete('users', 2)], transaction]
+
+
+def test_transaction_not_split(tmp_path):
+    transactions = [[delete('users', 1), delete('users', 2), delete('users', 3)], [delete('users', 4)]]
+    rollback_file = write_rollback(str(tmp_path / 'rollback.sql'), transactions)
+    pool = FakePool()
+    summary = RollbackApplier({}, batch_size=2, pool=pool, out=io.StringIO()).apply_file(rollback_file)
+    assert pool.committed == transactions
+    assert (summary['statements'], summary['batches']) == (4, 2)
+
+
+def test_resume(tmp_path):
+    transactions = [[delete('users', n)] for n in range(1, 5)]
+    rollback_file = write_rollback(str(tmp_path / 'rollback.sql'), transactions)
+    state_file = rollback_file + '.applied'
+    pool = FakePool(fail_on='`id`=3 ')
+    with pytest.raises(RuntimeError):
+        RollbackApplier({}, batch_size=1, pool=pool, out=io.StringIO()).apply_file(rollback_file,
+                                                                                  state_file=state_file)
+    assert pool.committed == transactions[:2]
+    with open(state_file) as f:
+        state = json.load(f)
+    # the third transaction, BEGIN; and its statement and COMMIT; are one line each
+    with open(rollback_file, 'rb') as f:
+        assert state['offset'] == len(b''.join(f.readlines()[:6]))
+    pool = FakePool()
+    summary = RollbackApplier({}, batch_size=1, pool=pool, out=io.StringIO()).apply_file(rollback_file,
+                                                                                        state_file=state_file)
+    assert pool.committed == transactions[2:]
+    assert (summary['statements'], summary['skipped']) == (2, 2)
+    assert not os.path.exists(state_file)
+
+
+def test_resume_other_file(tmp_path):
+    rollback_file = write_rollback(str(tmp_path / 'rollback.sql'), [[delete('users', 1)]])
+    state_file = rollback_file + '.applied'
+    with open(state_file, 'w') as f:
+        json.dump({'file': os.path.abspath(rollback_file), 'size': 1, 'offset': 0, 'committed': []}, f)
+    with pytest.raises(ValueError):
+        RollbackApplier({}, pool=FakePool(), out=io.StringIO()).apply_file(rollback_file, state_file=state_file)
+
+
+def test_resume_rewritten_file(tmp_path):
+    """the state of a failed apply is kept for the same rollback.sql written again, not for another of its size"""
+    transactions = [[delete('users', n)] for n in range(1, 5)]
+    rollback_file = write_rollback(str(tmp_path / 'rollback.sql'), transactions)
+    state_file = rollback_file + '.applied'
+    with pytest.raises(RuntimeError):
+        RollbackApplier({}, batch_size=1, pool=FakePool(fail_on='`id`=3 '), out=io.StringIO()).apply_file(
+            rollback_file, state_file=state_file)
+    write_rollback(rollback_file, transactions)
+    assert not RollbackApplier({}, pool=FakePool(), out=io.StringIO()).stale_state(rollback_file, state_file)
+    write_rollback(rollback_file, [[delete('users', n)] for n in range(5, 9)])
+    applier = RollbackApplier({}, pool=FakePool(), out=io.StringIO())
+    assert applier.stale_state(rollback_file, state_file)
+    with pytest.raises(ValueError):
+        applier.apply_file(rollback_file, state_file=state_file)
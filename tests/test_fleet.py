@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pymysql
+import pytest
+
+from binlog_fixtures import (
+    BinlogFixture, ROW_TYPES, USERS, log_file, file_timestamp, INSERT_ALICE, INSERT_BOB, UPDATE_ALICE, DELETE_BOB
+)
+from src.binlog2sql_fleet import Fleet, binlog_range, server_path
+from src.binlog2sql_pool import ConnectionPool
+
+
+def read_lines(filename):
+    with open(filename, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def test_fleet_offline(tmp_path):
+    """every server parsed to a directory of its own, shared index_dir and schema_cache_file split per server"""
+    shard01 = BinlogFixture(str(tmp_path / 'shard01'))
+    shard01.write_users()
+    shard01.snapshot(USERS)
+    shard02 = BinlogFixture(str(tmp_path / 'shard02'))
+    for n in (1, 2):
+        writer = shard02.writer(log_file(n), timestamp=file_timestamp(n))
+        writer.transaction([(USERS, 'INSERT', [(n, 'user %d' % n)])])
+        if n == 1:
+            writer.rotate(log_file(2))
+        writer.close()
+    shard02.snapshot(USERS)
+    output_path = str(tmp_path / 'out')
+    servers = [{'name': name, 'binlog_dir': fixture.binlog_dir, 'schema_file': fixture.schema_file}
+               for name, fixture in [('shard01', shard01), ('shard02', shard02)]]
+    fleet = Fleet(servers, output_path, concurrency=2, sql_type=ROW_TYPES, render_workers=2,
+                  index_dir=str(tmp_path / 'index'), schema_cache_file=str(tmp_path / 'schema_cache.json'))
+    summary = fleet.run()
+
+    assert [(name, result['status'], result['files']) for name, result in summary['servers'].items()] == [
+        ('shard01', 'ok', 1), ('shard02', 'ok', 2)]
+    assert summary['totals']['rows'] == 6
+    with open(os.path.join(output_path, 'summary.json')) as f:
+        assert json.load(f)['totals'] == summary['totals']
+    assert read_lines(os.path.join(output_path, 'shard01', 'origin.sql')) == [
+        INSERT_ALICE, INSERT_BOB, UPDATE_ALICE, DELETE_BOB]
+    assert [line.split(' #')[0] for line in read_lines(os.path.join(output_path, 'shard02', 'origin.sql'))] == [
+        "INSERT INTO `test`.`users`(`id`, `name`) VALUES (%d, 'user %d');" % (n, n) for n in (1, 2)]
+    assert sorted(os.listdir(str(tmp_path / 'index'))) == ['shard01', 'shard02']
+    assert os.path.exists(str(tmp_path / 'schema_cache.shard01.json'))
+    assert os.path.exists(str(tmp_path / 'schema_cache.shard02.json'))
+
+
+def test_fleet_failed_server(tmp_path):
+    """a server that can not be planned fails alone"""
+    shard01 = BinlogFixture(str(tmp_path / 'shard01'))
+    shard01.write_users()
+    shard01.snapshot(USERS)
+    servers = [{'name': 'shard01', 'binlog_dir': shard01.binlog_dir, 'schema_file': shard01.schema_file},
+               {'name': 'empty', 'binlog_dir': str(tmp_path), 'schema_file': shard01.schema_file}]
+    summary = Fleet(servers, str(tmp_path / 'out'), sql_type=ROW_TYPES).run()
+    assert summary['servers']['shard01']['status'] == 'ok'
+    assert summary['servers']['empty']['status'] == 'failed'
+    assert summary['totals']['failed'] == 1
+
+
+def test_fleet_options():
+    with pytest.raises(ValueError):
+        Fleet([{'name': 'a'}, {'name': 'a'}], 'out')
+    with pytest.raises(ValueError):
+        Fleet([{'name': 'a'}], 'out', stop_never=True)
+    assert server_path('idx', 'shard01', 'index_dir') == os.path.join('idx', 'shard01')
+    assert server_path('/var/cache/schema.json', 'shard01', 'schema_cache_file') == '/var/cache/schema.shard01.json'
+
+
+def test_binlog_range_basename(tmp_path):
+    """the files of the basename of stop_file, other binlog-like files are not in the range"""
+    for filename in [log_file(1), log_file(2), 'relay-bin.000001', 'relay-bin.000005', 'mysql-bin.index']:
+        open(str(tmp_path / filename), 'w').close()
+    options = {'binlog_dir': str(tmp_path), 'stop_file': log_file(2)}
+    assert binlog_range({}, options) == (log_file(1), log_file(2))
+    assert binlog_range({}, dict(options, stop_file='relay-bin.000005')) == ('relay-bin.000001', 'relay-bin.000005')
+    with pytest.raises(ValueError):
+        binlog_range({}, {'binlog_dir': str(tmp_path)})
+    os.remove(str(tmp_path / 'relay-bin.000001'))
+    os.remove(str(tmp_path / 'relay-bin.000005'))
+    assert binlog_range({}, {'binlog_dir': str(tmp_path)}) == (log_file(1), log_file(2))
+
+
+class Connection(object):
+
+    def __init__(self, **conn_setting):
+        self.conn_setting = conn_setting
+        self.alive, self.closed = True, False
+
+    def ping(self, reconnect=True):
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_reuse():
+    """a connection is reused per server and user, at most max_idle of them are kept"""
+    pool = ConnectionPool(max_idle=1, connect=Connection)
+    a, b = {'host': 'a', 'user': 'root'}, {'host': 'b', 'user': 'root'}
+    with pool.connection(a) as first:
+        pass
+    with pool.connection(a) as second:
+        assert second is first
+    with pool.connection(b) as other:
+        assert other is not first and other.conn_setting == b
+    extra = [pool.acquire(a), pool.acquire(a)]
+    for connection in extra:
+        pool.release(a, connection)
+    assert [connection.closed for connection in extra] == [False, True]
+    assert (pool.created, pool.reused) == (3, 2)
+    pool.close()
+    assert extra[0].closed and other.closed
+
+
+def test_pool_dead_and_failed():
+    """a dead idle connection is replaced, one whose block raised is closed rather than kept"""
+    pool = ConnectionPool(connect=Connection)
+    conn_setting = {'host': 'a', 'ssl': {'ca': 'ca.pem'}}
+    with pool.connection(conn_setting) as dead:
+        dead.alive = False
+    with pool.connection(conn_setting) as fresh:
+        assert fresh is not dead and dead.closed
+    with pytest.raises(RuntimeError):
+        with pool.connection(conn_setting) as failed:
+            raise RuntimeError('query failed')
+    assert failed is fresh and failed.closed
+    assert pool.acquire(conn_setting) is not failed
+    assert (pool.created, pool.reused) == (3, 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+
+import pytest
+
+from binlog_fixtures import log_file
+from src.binlog2sql_metrics import Metrics, MetricsServer
+
+
+class Stream(object):
+    """events of (log_file, log_pos), the position of the stream follows the event read"""
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.log_file, self.log_pos = None, 0
+
+    def __iter__(self):
+        for self.log_file, self.log_pos in self.positions:
+            yield (self.log_file, self.log_pos)
+
+
+def metrics(**kwargs):
+    sizes = OrderedDict([(log_file(1), 1000), (log_file(2), 2000), (log_file(3), 500)])
+    return Metrics(binlog_sizes=sizes, eof_file=log_file(3), eof_pos=300, out=io.StringIO(), **kwargs)
+
+
+def test_lag_bytes():
+    m = metrics()
+    assert m.lag_bytes is None
+    m.log_file, m.log_pos = log_file(1), 400
+    assert m.lag_bytes == 600 + 2000 + 300
+    m.log_file, m.log_pos = log_file(3), 250
+    assert m.lag_bytes == 50
+    m.log_file = 'mysql-bin.000009'
+    assert m.lag_bytes is None
+
+
+def test_watch():
+    m = metrics()
+    positions = [(log_file(1), 120), (log_file(2), 4), (log_file(2), 900)]
+    assert list(m.watch(Stream(positions))) == positions
+    assert (m.counters['events'], m.log_file, m.log_pos) == (3, log_file(2), 900)
+    assert m.seconds['decode'] >= 0
+
+
+def test_progress_line():
+    m = metrics(progress_interval=0.01)
+    m.counters.update(events=10, events_skipped=2, rows=7, bytes_written=3 * 1024 * 1024)
+    m.rollback_total, m.counters['rollback_bytes'] = 200, 50
+    list(m.watch(Stream([(log_file(3), 100)])))
+    m.report()
+    line = m.out.getvalue().splitlines()[-1]
+    assert line.startswith('[binlog2sql] %s:100 lag 0.0 MB events 11 (skipped 2) rows 7 written 3.0 MB rollback 25%% '
+                           '| decode ' % log_file(3))
+    assert ' elapsed ' in line
+
+
+def test_prometheus_text():
+    m = metrics()
+    m.counters.update(events=5, rows=3)
+    m.seconds['render'] = 1.5
+    m.log_file, m.log_pos = log_file(3), 100
+    lines = m.prometheus_text().splitlines()
+    assert lines[:4] == ['# TYPE binlog2sql_events_total counter', 'binlog2sql_events_total 5',
+                         '# TYPE binlog2sql_events_skipped_total counter', 'binlog2sql_events_skipped_total 0']
+    assert 'binlog2sql_rows_total 3' in lines
+    assert 'binlog2sql_stage_seconds_total{stage="render"} 1.500000' in lines
+    assert 'binlog2sql_log_pos{log_file="%s"} 100' % log_file(3) in lines
+    assert lines[-2:] == ['# TYPE binlog2sql_lag_bytes gauge', 'binlog2sql_lag_bytes 200']
+
+
+def test_metrics_server():
+    """served on 127.0.0.1 unless told otherwise"""
+    m = metrics()
+    server = MetricsServer(m, 0)
+    try:
+        host, port = server.httpd.server_address
+        assert host == '127.0.0.1'
+        response = urllib.request.urlopen('http://127.0.0.1:%d/metrics' % port, timeout=5)
+        assert response.headers['Content-Type'] == 'text/plain; version=0.0.4'
+        assert response.read().decode('utf-8') == m.prometheus_text()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen('http://127.0.0.1:%d/other' % port, timeout=5)
+    finally:
+        server.close()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from binlog_fixtures import (
+    USERS, ORDERS, Column, Table, file_timestamp, log_file, sql_time, INSERT_ALICE, INSERT_BOB, UPDATE_ALICE,
+    DELETE_BOB, UNDO_INSERT_ALICE, UNDO_INSERT_BOB, UNDO_UPDATE_ALICE, UNDO_DELETE_BOB
+)
+
+
+def test_insert_update_delete(binlogs):
+    binlogs.write_users()
+    binlogs.parse()
+    assert binlogs.output() == [INSERT_ALICE, INSERT_BOB, UPDATE_ALICE, DELETE_BOB]
+
+
+def test_flashback(binlogs):
+    binlogs.write_users()
+    binlogs.parse(flashback=True)
+    assert binlogs.output() == [UNDO_INSERT_ALICE, UNDO_INSERT_BOB, UNDO_UPDATE_ALICE, UNDO_DELETE_BOB]
+    # transactions in reverse, and the rows inside a transaction too
+    assert binlogs.output('rollback.sql') == [UNDO_DELETE_BOB, UNDO_UPDATE_ALICE, UNDO_INSERT_BOB, UNDO_INSERT_ALICE]
+
+
+def test_flashback_transaction(binlogs):
+    binlogs.write_users()
+    binlogs.parse(flashback=True, flashback_transaction=True)
+    assert binlogs.output('rollback.sql') == [
+        'BEGIN;', UNDO_DELETE_BOB, 'COMMIT;',
+        'BEGIN;', UNDO_UPDATE_ALICE, 'COMMIT;',
+        'BEGIN;', UNDO_INSERT_BOB, UNDO_INSERT_ALICE, 'COMMIT;',
+    ]
+
+
+def test_no_pk(binlogs):
+    binlogs.write_users()
+    binlogs.parse(no_pk=True)
+    assert binlogs.output()[:2] == [
+        "INSERT INTO `test`.`users`(`name`) VALUES ('alice'); #start 4 end 273 time %s" % sql_time(0),
+        "INSERT INTO `test`.`users`(`name`) VALUES ('bob'); #start 4 end 273 time %s" % sql_time(0),
+    ]
+
+
+def test_sql_type(binlogs):
+    binlogs.write_users()
+    binlogs.parse(sql_type=['UPDATE'])
+    assert binlogs.output() == [UPDATE_ALICE]
+
+
+def test_positions(binlogs):
+    binlogs.write_users()
+    binlogs.parse(start_pos=304, stop_pos=457)
+    assert binlogs.output() == [UPDATE_ALICE]
+
+
+def test_time_window(binlogs):
+    binlogs.write_users()
+    binlogs.parse(start_time=sql_time(1), stop_time=sql_time(2))
+    assert binlogs.output() == [UPDATE_ALICE]
+
+
+def test_only_schemas_and_tables(binlogs):
+    writer = binlogs.writer()
+    writer.transaction([(USERS, 'INSERT', [(1, 'alice')]), (ORDERS, 'INSERT', [(10, 1, 'book')])])
+    writer.close()
+    binlogs.snapshot(USERS, ORDERS)
+    binlogs.parse(only_tables=['orders'])
+    assert binlogs.output() == [
+        "INSERT INTO `test`.`orders`(`id`, `user_id`, `note`) VALUES (10, 1, 'book'); #start 4 end 366 time %s" % (
+            sql_time(0))]
+    binlogs.parse(only_schemas=['other'])
+    assert binlogs.output() == []
+
+
+def test_ddl(binlogs):
+    writer = binlogs.writer()
+    writer.transaction([(USERS, 'INSERT', [(1, 'alice')])])
+    writer.query('ALTER TABLE users ADD COLUMN age int', schema='test')
+    writer.close()
+    binlogs.snapshot(USERS)
+    binlogs.parse(only_dml=False)
+    assert binlogs.output() == [
+        "INSERT INTO `test`.`users`(`id`, `name`) VALUES (1, 'alice'); #start 4 end 263 time %s" % sql_time(0),
+        'USE test;',
+        'ALTER TABLE users ADD COLUMN age int;',
+    ]
+    # ddl is never rolled back
+    binlogs.parse(only_dml=False, flashback=True)
+    assert binlogs.output('rollback.sql') == [
+        "DELETE FROM `test`.`users` WHERE `id`=1 AND `name`='alice' LIMIT 1; #start 4 end 263 time %s" % sql_time(0)]
+
+
+def test_values(binlogs):
+    blobs = Table('test', 'blobs', 103, [Column('id', 'int', 'PRI'), Column('data', 'blob'), Column('doc', 'json'),
+                                         Column('note', 'varchar')])
+    writer = binlogs.writer()
+    writer.transaction([(blobs, 'INSERT', [(1, b'\x00\xff', {'k': 'v'}, "it's"), (2, None, None, None)])])
+    writer.close()
+    binlogs.snapshot(blobs)
+    binlogs.parse()
+    assert binlogs.output() == [
+        "INSERT INTO `test`.`blobs`(`id`, `data`, `doc`, `note`) "
+        "VALUES (1, X'00ff', '{\\\"k\\\": \\\"v\\\"}', 'it\\'s'); #start 4 end 296 time %s" % sql_time(0),
+        "INSERT INTO `test`.`blobs`(`id`, `data`, `doc`, `note`) VALUES (2, NULL, NULL, NULL); "
+        "#start 4 end 296 time %s" % sql_time(0),
+    ]
+
+
+def test_files(binlogs):
+    for n in (1, 2):
+        writer = binlogs.writer(log_file(n), timestamp=file_timestamp(n))
+        writer.transaction([(USERS, 'INSERT', [(n, 'user %d' % n)])])
+        if n == 1:
+            writer.rotate(log_file(2))
+        writer.close()
+    binlogs.snapshot(USERS)
+    binlogs.parse(stop_file=log_file(2), flashback=True)
+    assert binlogs.output('rollback.sql') == [
+        "DELETE FROM `test`.`users` WHERE `id`=2 AND `name`='user 2' LIMIT 1; #start 4 end 264 time %s" % (
+            sql_time(10)),
+        "DELETE FROM `test`.`users` WHERE `id`=1 AND `name`='user 1' LIMIT 1; #start 4 end 264 time %s" % (
+            sql_time(0)),
+    ]
+
+
+def test_missing_schema_file(binlogs):
+    binlogs.write_users()
+    with pytest.raises(ValueError):
+        binlogs.binlog2sql(schema_file=None)
+
+
+def test_apply_rollback_needs_host(binlogs):
+    binlogs.write_users()
+    with pytest.raises(ValueError):
+        binlogs.binlog2sql(flashback=True, apply_rollback=True)
+    binlogs.binlog2sql(flashback=True, apply_rollback=True, apply_dry_run=True)
+
+
+
+def test_schema_cache_ddl(binlogs):
+    """the cache is seeded with the columns at the start, the rows on each side of the ddl get their own columns"""
+    users_with_age = Table('test', 'users', 101, [Column('id', 'int', 'PRI'), Column('age', 'int'),
+                                                  Column('name', 'varchar')])
+    writer = binlogs.writer()
+    writer.transaction([(USERS, 'INSERT', [(1, 'alice')])])
+    writer.query('ALTER TABLE users ADD COLUMN age int AFTER id', schema='test')
+    writer.transaction([(users_with_age, 'INSERT', [(2, 30, 'bob')])])
+    writer.close()
+    # the snapshot has the columns at the start position
+    binlogs.snapshot(USERS)
+    binlogs.parse(schema_cache_file=os.path.join(binlogs.path, 'schema_cache.json'))
+    assert binlogs.output() == [
+        "INSERT INTO `test`.`users`(`id`, `name`) VALUES (1, 'alice'); #start 4 end 263 time %s" % sql_time(0),
+        "INSERT INTO `test`.`users`(`id`, `age`, `name`) VALUES (2, 30, 'bob'); #start 380 end 523 time %s" % sql_time(1),
+    ]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import time
+
+from src.binlog2sql_output import AsyncWriter
+from src.binlog2sql_pipeline import SqlWriter
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def read_lines(filename):
+    with open(filename, 'rb') as f:
+        return f.read().split(b'\n')
+
+
+def test_rotate_after_newline(tmp_path):
+    """a statement written in pieces across buffers stays in one file"""
+    writer = AsyncWriter(filename=str(tmp_path / 'origin.sql'), rotate_size=10, buffer_size=4)
+    for piece in ['INSERT ', 'INTO t VALUES ', '(1);\n', 'INSERT INTO t ', 'VALUES (2);\n']:
+        writer.write(piece)
+    writer.close()
+    assert writer.files == [str(tmp_path / 'origin.sql'), str(tmp_path / 'origin.sql.1')]
+    assert [read_lines(filename) for filename in writer.files] == [
+        [b'INSERT INTO t VALUES (1);', b''], [b'INSERT INTO t VALUES (2);', b'']]
+    assert writer.file_starts == [0, len(b'INSERT INTO t VALUES (1);\n')]
+
+
+def test_console_multibyte_split():
+    """a buffer handed over inside a multibyte character"""
+    console = io.StringIO()
+    writer = AsyncWriter(stream=console, buffer_size=1)
+    data = u"INSERT INTO t VALUES ('中文');\n".encode('utf-8')
+    for i in range(len(data)):
+        writer.write(data[i:i + 1])
+    writer.close()
+    assert console.getvalue() == data.decode('utf-8')
+
+
+def test_flush_interval(tmp_path):
+    """a buffer that does not fill up still reaches the file"""
+    filename = str(tmp_path / 'origin.sql')
+    writer = AsyncWriter(filename=filename, flush_interval=0.05)
+    writer.write('INSERT INTO t VALUES (1);\n')
+    assert wait_for(lambda: writer.bytes_written == writer.tell())
+    writer.sync()
+    assert read_lines(filename) == [b'INSERT INTO t VALUES (1);', b'']
+    writer.close()
+
+
+def test_console_flushed_at_boundary(tmp_path):
+    console = io.StringIO()
+    f_console = AsyncWriter(stream=console, flush_interval=0)
+    f_origin = AsyncWriter(filename=str(tmp_path / 'origin.sql'), flush_interval=0)
+    writer = SqlWriter(f_origin, console=f_console)
+    writer.write_row_sql('INSERT INTO t VALUES (1);')
+    writer.mark_boundary('mysql-bin.000001', 300)
+    assert wait_for(lambda: console.getvalue() == 'INSERT INTO t VALUES (1);\n')
+    f_console.close()
+    f_origin.close()
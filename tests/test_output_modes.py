@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from binlog_fixtures import (
+    USERS, ORDERS, Column, Table, file_timestamp, log_file, sql_time, INSERT_ALICE, INSERT_BOB, UPDATE_ALICE,
+    DELETE_BOB, UNDO_INSERT_ALICE, UNDO_INSERT_BOB, UNDO_UPDATE_ALICE, UNDO_DELETE_BOB
+)
+from src import binlog2sql_compact
+from src.binlog2sql import Binlog2sql
+from src.binlog2sql_compact import RowCompactor
+from src.binlog2sql_rows import RowsBatch
+from src.binlog2sql_schema import SchemaCache
+
+
+def write_files(binlogs, files=3, transactions=4):
+    """files rotated into each other, every transaction inserts an order and updates it"""
+    for n in range(1, files + 1):
+        writer = binlogs.writer(log_file(n), timestamp=file_timestamp(n))
+        for i in range(transactions):
+            order_id = n * 100 + i
+            writer.transaction([(ORDERS, 'INSERT', [(order_id, n, 'new')]),
+                                (ORDERS, 'UPDATE', [((order_id, n, 'new'), (order_id, n, 'paid'))])])
+        if n < files:
+            writer.rotate(log_file(n + 1))
+        writer.close()
+    binlogs.snapshot(USERS, ORDERS)
+
+
+def test_batch_size(binlogs):
+    binlogs.write_users()
+    binlogs.parse(batch_size=1000, flashback=True)
+    undo_insert = "DELETE FROM `test`.`users` WHERE `id` IN (2, 1); #start 4 end 273 time %s" % sql_time(0)
+    assert binlogs.output() == [undo_insert, UNDO_UPDATE_ALICE, UNDO_DELETE_BOB]
+    assert binlogs.output('rollback.sql') == [UNDO_DELETE_BOB, UNDO_UPDATE_ALICE, undo_insert]
+
+
+def test_batch_size_in_bytes(binlogs):
+    """a statement of multibyte values stays within batch_size once encoded"""
+    writer = binlogs.writer(log_file(1))
+    writer.transaction([(USERS, 'INSERT', [(n, u'\u4e2d' * 20) for n in range(1, 4)])])
+    writer.close()
+    binlogs.snapshot(USERS)
+    binlogs.parse(batch_size=200)
+    statements = [line.split(' #start')[0] for line in binlogs.output()]
+    assert len(statements) == 2
+    assert all(len(sql.encode('utf-8')) <= 200 for sql in statements)
+
+
+def test_output_compress(binlogs):
+    binlogs.write_users()
+    binlogs.parse(flashback=True, output_compress='gzip')
+    assert gzip.decompress(binlogs.output_bytes('rollback.sql.gz')).decode('utf-8').splitlines() == [
+        UNDO_DELETE_BOB, UNDO_UPDATE_ALICE, UNDO_INSERT_BOB, UNDO_INSERT_ALICE]
+
+
+@pytest.mark.parametrize('options', [{'render_workers': 2}, {'event_memory_limit': 1}, {'workers': 2}])
+def test_same_output(binlogs, options):
+    """renderer processes, streamed events and parallel files write what a plain parse writes"""
+    write_files(binlogs)
+    binlogs.parse(stop_file=log_file(3), flashback=True)
+    expected = binlogs.output_bytes('origin.sql'), binlogs.output_bytes('rollback.sql')
+    binlogs.parse(stop_file=log_file(3), flashback=True, **options)
+    assert (binlogs.output_bytes('origin.sql'), binlogs.output_bytes('rollback.sql')) == expected
+
+
+def test_checkpoint_resume(binlogs):
+    binlogs.write_users()
+    checkpoint_file = os.path.join(binlogs.path, 'checkpoint.json')
+    binlogs.parse(stop_pos=457, checkpoint_file=checkpoint_file, checkpoint_interval=0)
+    assert binlogs.output() == [INSERT_ALICE, INSERT_BOB, UPDATE_ALICE]
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    # stop_pos is the end of the UPDATE rows event, its transaction is not complete
+    assert (checkpoint['log_file'], checkpoint['log_pos']) == (log_file(1), 304)
+    # the second run cuts origin.sql back to the checkpoint and reads on from there
+    binlogs.parse(checkpoint_file=checkpoint_file, checkpoint_interval=0)
+    assert binlogs.output() == [INSERT_ALICE, INSERT_BOB, UPDATE_ALICE, DELETE_BOB]
+
+
+def test_checkpoint_purged(binlogs):
+    """a checkpoint is resumed from its binlog position only, the gtid just names where it was"""
+    binlogs.write_users()
+    checkpoint_file = os.path.join(binlogs.path, 'checkpoint.json')
+    gtid = '3e11fa47-71ca-11e1-9e33-c80aa9429562:23'
+    with open(checkpoint_file, 'w') as f:
+        json.dump({'log_file': log_file(0), 'log_pos': 4, 'gtid': gtid, 'origin_offset': 0, 'origin_files': [0]}, f)
+    with pytest.raises(ValueError, match=gtid):
+        binlogs.parse(checkpoint_file=checkpoint_file)
+
+
+def test_index_rotated_files(binlogs):
+    """a run with build_index indexes the rotated files it read only part of, the next run skips them"""
+    write_files(binlogs)
+    index_dir = os.path.join(binlogs.path, 'index')
+    first_run = binlogs.parse(stop_pos=300, index_dir=index_dir)
+    assert not first_run.index.get(log_file(1))['complete']
+    first_run = binlogs.parse(stop_pos=300, index_dir=index_dir, build_index=True)
+    assert first_run.index.get(log_file(1))['complete']
+    assert not os.path.exists(os.path.join(index_dir, '%s.idx' % log_file(3)))
+    start_time = str(datetime.datetime.fromtimestamp(file_timestamp(2)))
+    second_run = binlogs.binlog2sql(stop_file=log_file(3), start_time=start_time, index_dir=index_dir)
+    assert (second_run.start_file, second_run.binlogList) == (log_file(2), [log_file(2), log_file(3)])
+
+
+def test_jsonl(binlogs):
+    binlogs.write_users()
+    binlogs.parse(output_format='jsonl')
+    records = [json.loads(line) for line in binlogs.output('origin.jsonl')]
+    assert [(r['type'], r['before'], r['after'], r['start_pos'], r['log_pos']) for r in records] == [
+        ('INSERT', None, {'id': 1, 'name': 'alice'}, 4, 273),
+        ('INSERT', None, {'id': 2, 'name': 'bob'}, 4, 273),
+        ('UPDATE', {'id': 1, 'name': 'alice'}, {'id': 1, 'name': 'carol'}, 304, 457),
+        ('DELETE', {'id': 2, 'name': 'bob'}, None, 488, 626),
+    ]
+
+
+def test_msgpack(binlogs):
+    msgpack = pytest.importorskip('msgpack')
+    binlogs.write_users()
+    binlogs.parse(output_format='jsonl')
+    records = [json.loads(line) for line in binlogs.output('origin.jsonl')]
+    binlogs.parse(output_format='msgpack')
+    assert list(msgpack.Unpacker(io.BytesIO(binlogs.output_bytes('origin.msgpack')), raw=False)) == records
+
+
+def test_compact(binlogs):
+    binlogs.write_users()
+    binlogs.parse(compact=True, flashback=True)
+    # alice was inserted and renamed, bob inserted and deleted: one INSERT of carol, undone by one DELETE
+    undo = "DELETE FROM `test`.`users` WHERE `id`=1 AND `name`='carol' LIMIT 1; #start 4 end 457 time %s" % sql_time(1)
+    assert binlogs.output('rollback.sql') == [undo]
+
+
+def test_apply_dry_run(binlogs):
+    write_files(binlogs, files=1)
+    binlog2sql = binlogs.parse(flashback=True, flashback_transaction=True, apply_rollback=True, apply_dry_run=True)
+    assert binlog2sql.apply_summary['statements'] == 8
+    assert binlog2sql.apply_summary['dry_run'] is True
+
+
+def test_parallel_ddl(binlogs, monkeypatch):
+    """ddl in every file: the files after the first one are parsed again once, with the ddl replayed in order"""
+    columns = [Column('id', 'int', 'PRI'), Column('name', 'varchar')]
+    for n in (1, 2, 3):
+        writer = binlogs.writer(log_file(n), timestamp=file_timestamp(n))
+        users = Table('test', 'users', 101, list(columns))
+        writer.transaction([(users, 'INSERT', [tuple([n, 'user'] + [n] * (n - 1))])])
+        writer.query('ALTER TABLE users ADD COLUMN c%d int' % n, schema='test')
+        columns.append(Column('c%d' % n, 'int'))
+        if n < 3:
+            writer.rotate(log_file(n + 1))
+        writer.close()
+    binlogs.snapshot(USERS)
+    # a cache from an earlier run, it has none of the ddl yet
+    schema_cache_file = os.path.join(binlogs.path, 'schema_cache.json')
+    SchemaCache.load(binlogs.schema_file).save(schema_cache_file)
+    stale = []
+    merge_schema_parts = Binlog2sql.merge_schema_parts
+
+    def record_stale(self, tasks):
+        stale_tasks = merge_schema_parts(self, tasks)
+        stale.append([task['start_file'] for task in stale_tasks])
+        return stale_tasks
+
+    monkeypatch.setattr(Binlog2sql, 'merge_schema_parts', record_stale)
+    binlogs.parse(stop_file=log_file(3), workers=3, schema_cache_file=schema_cache_file)
+    assert stale == [[log_file(2), log_file(3)], []]
+    assert [line.split(' VALUES')[0] for line in binlogs.output()] == [
+        "INSERT INTO `test`.`users`(`id`, `name`)",
+        "INSERT INTO `test`.`users`(`id`, `name`, `c1`)",
+        "INSERT INTO `test`.`users`(`id`, `name`, `c1`, `c2`)",
+    ]
+
+
+def test_compact_spilled_order(binlogs):
+    """state spilled to run files still comes out in the order the rows were first changed"""
+    write_files(binlogs)
+    binlogs.parse(stop_file=log_file(3), compact=True)
+    expected = binlogs.output()
+    assert [line.split('VALUES (')[1].split(',')[0] for line in expected] == [
+        str(n * 100 + i) for n in (1, 2, 3) for i in range(4)]
+    binlog2sql = binlogs.parse(stop_file=log_file(3), compact=True, compact_memory_limit=1)
+    assert binlog2sql.output_stats['compact']['spills'] > 1
+    assert binlogs.output() == expected
+
+
+def test_compact_external_merge(tmp_path, monkeypatch):
+    """runs merged in several passes fold each row the same as in memory"""
+    monkeypatch.setattr(binlog2sql_compact, 'COMPACT_MERGE_CHUNK', 2)
+    monkeypatch.setattr(binlog2sql_compact, 'COMPACT_MERGE_FANIN', 2)
+    columns = ('id', 'name')
+    batches = []
+    for n in range(20):
+        rows = [(None, (i, 'v%d' % n)) if n == i else ((i, 'v%d' % (n - 1)), (i, 'v%d' % n))
+                for i in range(n + 1) if n == i or (n + i) % 3 == 0]
+        batches.append(RowsBatch('test', 't', 1, 'id', 0, n, 'UPDATE', columns, [
+            row for row in rows if row[0] is not None]))
+        batches.append(RowsBatch('test', 't', 1, 'id', 0, n, 'INSERT', columns, [
+            row[1] for row in rows if row[0] is None]))
+    batches.append(RowsBatch('test', 't', 1, 'id', 0, 20, 'DELETE', columns, [(3, 'v3'), (7, 'v7')]))
+
+    def compact(**kwargs):
+        with RowCompactor(**kwargs) as compactor:
+            for batch in batches:
+                compactor.add(batch, 4)
+            changes = [(batch.sql_type, batch.rows) for batch, _ in compactor.changes()]
+        return compactor, changes
+
+    _, expected = compact(memory_limit=0)
+    assert [change[0] for change in expected].count('INSERT') == 18
+    compactor, changes = compact(memory_limit=1, spill_dir=str(tmp_path))
+    assert compactor.spills > binlog2sql_compact.COMPACT_MERGE_FANIN
+    assert changes == expected
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from binlog_fixtures import LOG_FILE, USERS
+from synthetic_binlog import schema_snapshot
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from src.binlog2sql_file import BinLogFileReader
+from src.binlog2sql_rows import RowsReader, compact_row, rows_event_type
+
+ROWS_EVENTS = [WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent]
+
+
+def rows_events(binlogs):
+    return [e for e in BinLogFileReader(binlogs.binlog_dir, [LOG_FILE], schema_snapshot([USERS]),
+                                        only_events=ROWS_EVENTS) if type(e) in ROWS_EVENTS]
+
+
+def test_rows_event_internals(binlogs):
+    """RowsReader relies on members of RowsEvent that are not public, a new mysql-replication may change them"""
+    binlogs.write_users()
+    for binlog_event in rows_events(binlogs):
+        assert binlog_event._RowsEvent__rows is None
+        assert binlog_event.complete
+        assert binlog_event.packet.read_bytes + 1 < binlog_event.event_size
+        assert callable(binlog_event._fetch_one_row)
+
+
+def test_lazy_rows_match_event_rows(binlogs):
+    binlogs.write_users()
+    expected = [[compact_row(rows_event_type(e), row) for row in e.rows] for e in rows_events(binlogs)]
+    reader = RowsReader()
+    lazy = [list(reader.read(e, lazy=True).rows) for e in rows_events(binlogs)]
+    assert lazy == expected == [[(1, 'alice'), (2, 'bob')], [((1, 'alice'), (1, 'carol'))], [(2, 'bob')]]
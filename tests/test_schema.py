@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pymysqlreplication import BinLogStreamReader
+
+from binlog_fixtures import LOG_FILE, USERS
+from synthetic_binlog import schema_snapshot
+from src.binlog2sql_schema import SchemaCache, CachedBinLogStreamReader
+
+ID = ('id', 'int(11)', 'PRI', None)
+NAME = ('name', 'varchar(255)', '', 'utf8mb4')
+
+
+def cache_of(*tables):
+    return SchemaCache.from_snapshot(schema_snapshot(tables))
+
+
+def summary(cache, table='users', log_pos=2000):
+    """(name, type, key, character set) of the columns of test.table at log_pos"""
+    columns = cache.columns('test', table, LOG_FILE, log_pos)
+    if columns is None:
+        return None
+    return [(c['COLUMN_NAME'], c['COLUMN_TYPE'], c['COLUMN_KEY'], c['CHARACTER_SET_NAME']) for c in columns]
+
+
+@pytest.mark.parametrize('ddl, table, expected', [
+    ('ALTER TABLE users ADD COLUMN age int unsigned AFTER id', 'users',
+     [ID, ('age', 'int unsigned', '', None), NAME]),
+    ('ALTER TABLE `test`.`users` ADD (a int, b text CHARACTER SET latin1)', 'users',
+     [ID, NAME, ('a', 'int', '', None), ('b', 'text', '', 'latin1')]),
+    ("ALTER TABLE users ADD COLUMN note varchar(10) COMMENT 'a, b' /* c */ -- d", 'users',
+     [ID, NAME, ('note', 'varchar(10)', '', 'utf8mb4')]),
+    ("ALTER TABLE `users` ADD COLUMN `age` int(10) unsigned NOT NULL DEFAULT '0' COMMENT 'age' AFTER `id`, "
+     "ADD INDEX `idx_age` (`age`), ALGORITHM=INPLACE, LOCK=NONE", 'users',
+     [ID, ('age', 'int(10) unsigned', '', None), NAME]),
+    ("ALTER TABLE users ALTER COLUMN name SET DEFAULT '', ENGINE=InnoDB, ADD COLUMN age int", 'users',
+     [ID, NAME, ('age', 'int', '', None)]),
+    ('ALTER TABLE users DROP COLUMN name', 'users', [ID]),
+    ('ALTER TABLE users CHANGE name nick varchar(32) FIRST', 'users', [('nick', 'varchar(32)', '', 'utf8mb4'), ID]),
+    ('ALTER TABLE users MODIFY id bigint', 'users', [('id', 'bigint', 'PRI', None), NAME]),
+    ('ALTER TABLE users RENAME COLUMN name TO nick', 'users', [ID, ('nick', 'varchar(255)', '', 'utf8mb4')]),
+    ('ALTER TABLE users DROP PRIMARY KEY, ADD PRIMARY KEY (name(10))', 'users',
+     [('id', 'int(11)', '', None), ('name', 'varchar(255)', 'PRI', 'utf8mb4')]),
+    ('ALTER TABLE users RENAME TO people', 'users', None),
+    ('ALTER TABLE users RENAME TO people', 'people', [ID, NAME]),
+    ('RENAME TABLE users TO people', 'people', [ID, NAME]),
+    ('DROP TABLE IF EXISTS users', 'users', None),
+    ('DROP DATABASE test', 'users', None),
+    ('CREATE TABLE people LIKE users', 'people', [ID, NAME]),
+    ('CREATE TABLE people (id bigint unsigned NOT NULL AUTO_INCREMENT, nick varchar(20), PRIMARY KEY (id)) '
+     'DEFAULT CHARSET=latin1', 'people', [('id', 'bigint unsigned', 'PRI', None), ('nick', 'varchar(20)', '', 'latin1')]),
+    # as SHOW CREATE TABLE writes it
+    ("CREATE TABLE `people` (\n  `id` int(11) NOT NULL AUTO_INCREMENT,\n  `nick` varchar(32) COLLATE utf8mb4_bin "
+     "DEFAULT NULL,\n  `avatar` blob,\n  PRIMARY KEY (`id`),\n  UNIQUE KEY `uk_nick` (`nick`)\n) ENGINE=InnoDB "
+     "AUTO_INCREMENT=7 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci", 'people',
+     [('id', 'int(11)', 'PRI', None), ('nick', 'varchar(32)', '', 'utf8mb4'), ('avatar', 'blob', '', None)]),
+])
+def test_replay(ddl, table, expected):
+    cache = cache_of(USERS)
+    cache.replay('test', ddl, LOG_FILE, 1000)
+    assert summary(cache, table) == expected
+    if table == 'users':
+        # events before the ddl keep the columns they had
+        assert summary(cache, log_pos=500) == [ID, NAME]
+
+
+def test_replay_unchanged_columns():
+    cache = cache_of(USERS)
+    assert cache.replay('test', 'ALTER TABLE users ADD INDEX idx_name (name), ENGINE=InnoDB', LOG_FILE, 1000) == []
+    assert not cache.dirty
+
+
+def test_replay_twice():
+    """a resumed parse reads ddl the cache has already"""
+    cache = cache_of(USERS)
+    assert cache.replay('test', 'ALTER TABLE users DROP COLUMN name', LOG_FILE, 1000) == [('test', 'users')]
+    assert cache.replay('test', 'ALTER TABLE users DROP COLUMN name', LOG_FILE, 1000) == []
+    assert summary(cache) == [ID]
+
+
+def test_replay_failed_invalidates():
+    cache = cache_of(USERS)
+    assert cache.replay('test', 'ALTER TABLE users DROP COLUMN nope', LOG_FILE, 1000) == [('test', 'users')]
+    assert summary(cache, log_pos=500) == [ID, NAME]
+    with pytest.raises(ValueError):
+        summary(cache)
+    # a table created again is known again
+    cache.replay('test', 'DROP TABLE users', LOG_FILE, 3000)
+    cache.replay('test', 'CREATE TABLE users (id int PRIMARY KEY)', LOG_FILE, 4000)
+    assert summary(cache, log_pos=5000) == [('id', 'int', 'PRI', None)]
+
+
+@pytest.mark.parametrize('ddl', [
+    'ALTER TABLE users CONVERT TO CHARACTER SET latin1',
+    'ALTER TABLE users DEFAULT CHARSET=latin1, ADD COLUMN note text',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS age int',
+    'CREATE TABLE users SELECT * FROM people',
+])
+def test_replay_not_supported(ddl):
+    """ddl that is not replayed leaves the columns unknown, or takes them from the server"""
+    cache = cache_of(USERS)
+    assert cache.replay('test', ddl, LOG_FILE, 1000) == [('test', 'users')]
+    with pytest.raises(ValueError):
+        summary(cache)
+    cache = cache_of(USERS)
+    refreshed = []
+
+    def refresh(schema, table):
+        refreshed.append((schema, table))
+        return [dict(column, CHARACTER_SET_NAME='latin1') if column['CHARACTER_SET_NAME'] else column
+                for column in cache.columns(schema, table)]
+
+    assert cache.replay('test', ddl, LOG_FILE, 1000, refresh=refresh) == [('test', 'users')]
+    assert refreshed == [('test', 'users')]
+    assert summary(cache) == [ID, ('name', 'varchar(255)', '', 'latin1')]
+    assert summary(cache, log_pos=500) == [ID, NAME]
+
+
+def test_replay_failed_without_table():
+    with pytest.raises(ValueError):
+        cache_of(USERS).replay('test', 'ALTER TABLE (', LOG_FILE, 1000)
+
+
+def test_cached_stream_reader_override():
+    """CachedBinLogStreamReader replaces a private method of BinLogStreamReader, a new mysql-replication may rename it"""
+    assert '_BinLogStreamReader__get_table_information' in vars(BinLogStreamReader)
+    reader = CachedBinLogStreamReader(cache_of(USERS), connection_settings={}, server_id=1)
+    reader.log_file, reader.log_pos = LOG_FILE, 2000
+    columns = reader._BinLogStreamReader__get_table_information('test', 'users')
+    assert [column['COLUMN_NAME'] for column in columns] == ['id', 'name']
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import io
+from decimal import Decimal
+
+import pytest
+from pymysql import converters
+from pymysql.connections import Connection
+from pymysql.constants import SERVER_STATUS
+from pymysql.cursors import Cursor
+
+from src.binlog2sql_util import fix_object, render_sql, reversed_lines, FileRange, SqlTemplateCache
+
+TEMPLATE = 'INSERT INTO `test`.`t`(`v`) VALUES (%s);'
+
+# values as pymysqlreplication decodes them, rendered after fix_object like every row value
+VALUES = [
+    0, 42, -7, 2 ** 63 + 1, True, 1.5, -0.25,
+    Decimal('12345.6789'), Decimal('-0.001'),
+    datetime.datetime(2022, 4, 22, 10, 30, 5), datetime.datetime(2022, 4, 22, 10, 30, 5, 123),
+    datetime.date(2022, 4, 22), datetime.time(23, 59, 59), datetime.time(1, 2, 3, 456),
+    datetime.timedelta(hours=838, minutes=59, seconds=59), datetime.timedelta(seconds=-1),
+    datetime.timedelta(days=1, microseconds=5),
+    {'a'}, set(), None,
+    b'plain bytes', u'中文'.encode('utf-8'),
+    '', 'alice', "it's", 'back\\slash', 'nul\x00byte', 'ctrl-z\x1a', 'line\nbreak\r\ttab', '"double"', u'中文',
+    {'k': [1, 'v']},
+]
+
+
+def stub_connection(no_backslash_escapes=False):
+    """a Connection with the escaping settings of a connected one, it never connects"""
+    connection = Connection.__new__(Connection)
+    connection.charset, connection.encoding = 'utf8', 'utf8'
+    connection.server_status = SERVER_STATUS.SERVER_STATUS_NO_BACKSLASH_ESCAPES if no_backslash_escapes else 0
+    connection._binary_prefix = False
+    connection.encoders = {k: v for (k, v) in converters.encoders.items() if type(k) is not int}
+    return connection
+
+
+@pytest.mark.parametrize('no_backslash_escapes', [False, True])
+@pytest.mark.parametrize('value', VALUES, ids=repr)
+def test_render_sql_mogrify_parity(value, no_backslash_escapes):
+    values = [fix_object(value)]
+    expected = Cursor(stub_connection(no_backslash_escapes)).mogrify(TEMPLATE, values)
+    assert render_sql(TEMPLATE, values, no_backslash_escapes=no_backslash_escapes) == expected
+
+
+def test_render_sql_divergences():
+    """bytes that are not utf-8 become a hex literal, json a string of json text"""
+    assert render_sql(TEMPLATE, [fix_object(b'\xff\x00\'')]) == "INSERT INTO `test`.`t`(`v`) VALUES (X'ff0027');"
+    assert render_sql(TEMPLATE, [fix_object({b'k': [b'v', 1]})]) == \
+        'INSERT INTO `test`.`t`(`v`) VALUES (\'{\\"k\\": [\\"v\\", 1]}\');'
+
+
+def template_key(table, n=0, table_id=1):
+    return 'test', table, table_id, 'INSERT', False, False, ('id', 'name'), (False, n == 1)
+
+
+def test_template_cache_eviction():
+    """the least recently used template goes first once maxsize is reached"""
+    cache = SqlTemplateCache(maxsize=2)
+    cache.put(template_key('a'), 'A')
+    cache.put(template_key('b'), 'B')
+    assert cache.get(template_key('a')) == 'A'
+    cache.put(template_key('c'), 'C')
+    assert len(cache) == 2
+    assert cache.get(template_key('b')) is None
+    assert (cache.get(template_key('a')), cache.get(template_key('c'))) == ('A', 'C')
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_template_cache_invalidate():
+    cache = SqlTemplateCache()
+    for key in [template_key('a'), template_key('a', 1), template_key('b')]:
+        cache.put(key, 'sql')
+    cache.invalidate('test', 'a')
+    assert cache.generation == 1
+    assert [cache.get(key) for key in [template_key('a'), template_key('a', 1), template_key('b')]] == [
+        None, None, 'sql']
+    cache.invalidate()
+    assert (cache.generation, len(cache)) == (2, 0)
+
+
+def test_template_cache_table_remapped():
+    """templates of a table are dropped when it is mapped to a new table_id, not when it is mapped again"""
+    cache = SqlTemplateCache()
+    cache.on_table_map('test', 'a', 1)
+    cache.on_table_map('test', 'b', 2)
+    cache.put(template_key('a'), 'A')
+    cache.put(template_key('b', table_id=2), 'B')
+    cache.on_table_map('test', 'a', 1)
+    assert (cache.generation, len(cache)) == (0, 2)
+    cache.on_table_map('test', 'a', 3)
+    assert cache.generation == 1
+    assert (cache.get(template_key('a')), cache.get(template_key('b', table_id=2))) == (None, 'B')
+
+
+def read_reversed(data, block_size=3, **kwargs):
+    """the lines reversed_lines generates for data, a FileRange as ('range', its bytes)"""
+    lines = []
+    for line in reversed_lines(io.BytesIO(data), block_size=block_size, **kwargs):
+        if isinstance(line, FileRange):
+            lines.append(('range', b''.join(line.blocks())))
+        else:
+            lines.append(line)
+    return lines
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 4, 7, 64])
+@pytest.mark.parametrize('data', [
+    b'', b'\n', b'a', b'a\n', b'\n\n', b'one\ntwo\nthree\n', b'one\ntwo\nthree', b'ab\n\ncd\n\n',
+    u'中文\n行尾\n\xe9t\xe9'.encode('utf-8'),
+])
+def test_reversed_lines(data, block_size):
+    """lines crossing block boundaries, with and without a trailing newline, multibyte characters split"""
+    expected = data.split(b'\n')
+    if expected[-1] == b'' and len(expected) > 1:
+        expected.pop()
+    if data == b'':
+        expected = []
+    assert read_reversed(data, block_size) == expected[::-1]
+
+
+def test_reversed_lines_range():
+    data = b'skip\none\ntwo\nskip'
+    assert read_reversed(data, start=5, end=13) == [b'two', b'one']
+
+
+def test_reversed_lines_multibyte():
+    lines = [u'中文行%d' % i for i in range(5)]
+    data = '\n'.join(lines).encode('utf-8') + b'\n'
+    for block_size in range(1, 8):
+        assert [line.decode('utf-8') for line in read_reversed(data, block_size)] == lines[::-1]
+
+
+def test_reversed_lines_long_line():
+    """a line over max_line_size comes as a FileRange of the whole line, the lines around it as they are"""
+    long_line = u'中'.encode('utf-8') * 5 + b'x' * 10
+    for data, expected in [
+        (b'a\n' + long_line + b'\nb\n', [b'b', ('range', long_line), b'a']),
+        (long_line + b'\nb', [b'b', ('range', long_line)]),
+        (b'a\n' + long_line, [('range', long_line), b'a']),
+    ]:
+        for block_size in (2, 3, 5):
+            assert read_reversed(data, block_size, max_line_size=8) == expected